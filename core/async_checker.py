@@ -0,0 +1,294 @@
+# modules/async_checker.py
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from core.concurrency import (AsyncAdaptiveSemaphore, LocalExhaustionError, async_run_adaptive, log_levels,
+                              make_controller, raise_if_local_exhaustion)
+from core.handshake import async_open_tunnel
+from core.httpparse import HttpParseError, async_forward_body, async_read_head, body_framing, parse_head
+from core.detect import DEFAULT_DETECT_TIMEOUT, async_detect_protocols
+from core.precheck import DEFAULT_PRECHECK_CONCURRENCY, DEFAULT_PRECHECK_TIMEOUT, pre_check
+from core.probe import (MAX_SPEED_LATENCY, BodySink, async_single_connection_check, async_start_tls,
+                        classify_anonymity, score_result)
+from core.profiles import async_run_profiles
+from core.throughput import BudgetReached, MeterSink
+
+DEFAULT_CONCURRENCY = 1000
+CANCEL_POLL_INTERVAL = 0.2  # 轮询 cancel_event 的间隔 (秒)
+
+
+class AsyncProxyChecker:
+    """
+    基于 asyncio 的代理验证器，验证流程与结果格式同 ProxyManager._full_check_proxy，
+    validate_all 的参数及 result_queue / cancel_event 约定与线程版 validate_all_proxies 一致。
+    所有探测都是同一事件循环上的非阻塞连接，由固定数量的协程从候选列表中依次领取任务，
+    单核即可同时进行上千个探测，并发数由 concurrency 限制。
+    HTTP 请求直接写在代理隧道上（HTTP 上游访问 http:// 目标时按普通代理转发，以便检测 Via / X-Forwarded-For），
+    使用 HTTP/1.0 以避免分块编码；仅地理位置查询仍是阻塞调用，放在默认线程池中执行。
+    probe 为 'single' 时每个代理只建立一条隧道，所有探测经 keep-alive 复用 (见 core.probe)。
+    validate_all 在预检之后按 detect_timeout 做握手探测 (见 core.detect)，只按实际协议验证。
+    给出 adaptive (见 core.concurrency.DEFAULT_ADAPTIVE_OPTIONS) 时各阶段的实际并发由 AIMD 控制器在上限内调整。
+    """
+    def __init__(self, checker, concurrency: int = DEFAULT_CONCURRENCY, precheck_timeout=DEFAULT_PRECHECK_TIMEOUT,
+                 precheck_concurrency=DEFAULT_PRECHECK_CONCURRENCY, probe='separate', detect_timeout=DEFAULT_DETECT_TIMEOUT,
+                 adaptive=None):
+        self._checker = checker  # ProxyManager / ProxyChecker：提供超时、验证目标、本机 IP 及地理位置查询
+        self.concurrency = max(1, int(concurrency))
+        self.precheck_timeout = precheck_timeout
+        self.precheck_concurrency = precheck_concurrency
+        self.probe = probe
+        self.detect_timeout = detect_timeout  # 握手探测的超时，None 表示不做握手探测
+        self.adaptive = adaptive  # 自适应并发选项，None 表示固定并发
+        self.controller = None    # 最近一次完整验证使用的并发控制器
+        self._gate = None
+        session = getattr(checker, 'checker_session', None) or checker.session
+        self._user_agent = session.headers.get('User-Agent', 'Mozilla/5.0')
+
+    # --- 单个 HTTP 请求 ---
+    async def _open(self, proxy, protocol, url, timeout):
+        """建立经由代理访问 url 的连接，返回 (reader, writer, 请求行中的目标)。"""
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        port = parts.port or (443 if secure else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        if protocol in ('HTTP', 'HTTPS') and not secure:
+            # 与 requests 相同：HTTP 上游访问 http:// 目标时直接发送完整 URL，不建立隧道
+            host, port_str = proxy.rsplit(':', 1)
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port_str)), timeout)
+            return reader, writer, url
+        # 'HTTPS' 类型的免费代理实际上几乎都是支持 CONNECT 的明文 HTTP 代理
+        tunnel_protocol = 'HTTP' if protocol == 'HTTPS' else protocol
+        reader, writer = await async_open_tunnel(proxy, tunnel_protocol, parts.hostname, port, timeout)
+        if secure:
+            try:
+                reader, writer = await asyncio.wait_for(async_start_tls(reader, writer, parts.hostname), timeout)
+            except BaseException:
+                writer.close()
+                raise
+        return reader, writer, path
+
+    async def _request(self, proxy, protocol, url, method='GET', timeout=5, keep_body=False, sink=None):
+        """经由代理发送一个请求，返回 (状态码, BodySink)；状态码 >= 400 时抛出 HttpParseError。给出 sink 时报文体写入其中。"""
+        async def _run():
+            reader, writer, target = await self._open(proxy, protocol, url, timeout)
+            try:
+                host = urlsplit(url).netloc
+                writer.write(f"{method} {target} HTTP/1.0\r\nHost: {host}\r\nUser-Agent: {self._user_agent}\r\n"
+                             f"Accept: */*\r\nAccept-Encoding: identity\r\nConnection: close\r\n\r\n".encode())
+                await writer.drain()
+                raw_head = await async_read_head(reader)
+                if raw_head is None:
+                    raise HttpParseError("代理未返回响应")
+                head = parse_head(raw_head, is_request=False)
+                if head.status >= 400:
+                    raise HttpParseError(f"HTTP {head.status}")
+                body = BodySink(keep_body) if sink is None else sink
+                mode, length = body_framing(head, method)
+                await async_forward_body(reader, body, mode, length)
+                return head.status, body
+            finally:
+                writer.close()
+        return await asyncio.wait_for(_run(), timeout)
+
+    # --- 验证步骤 ---
+    async def _full_check_proxy(self, proxy_info: dict, validation_mode='online', log_queue=None):
+        checker = self._checker
+        if self.probe == 'single':
+            result = await async_single_connection_check(checker, proxy_info, log_queue, self._user_agent)
+            return await self._check_profiles(result)
+        proxy = proxy_info['proxy']
+        protocol = proxy_info['protocol'].upper()
+        targets = checker.next_validation_targets()
+        result = {
+            'proxy': proxy, 'protocol': protocol, 'status': 'Failed',
+            'latency': float('inf'), 'speed': 0, 'anonymity': 'Unknown', 'location': 'N/A'
+        }
+        try:
+            start_time = time.time()
+            await self._request(proxy, protocol, targets['latency_check'], 'HEAD', checker.timeout)
+            result['latency'] = time.time() - start_time
+
+            _, sink = await self._request(proxy, protocol, targets['anonymity_check'], timeout=checker.timeout,
+                                          keep_body=True)
+            result['anonymity'] = classify_anonymity(json.loads(sink.body()), checker.public_ip)
+
+            # 延迟低于7秒的才进行测速
+            if result['latency'] <= MAX_SPEED_LATENCY:
+                throughput = checker.throughput
+                meter = await throughput.async_admit()
+                try:
+                    await self._request(proxy, protocol, throughput.url(targets),
+                                        timeout=meter.remaining(), sink=MeterSink(meter))
+                except asyncio.CancelledError:
+                    raise
+                except (BudgetReached, asyncio.TimeoutError):
+                    pass  # 达到字节或时间上限，按已收到的部分计算
+                except Exception as e:
+                    if log_queue and not meter.size:
+                        log_queue.put(f"[Checker] 测速失败 {proxy}: {str(e) or type(e).__name__}")
+                finally:
+                    throughput.settle(meter)
+                # 速度单位 Mbps，按稳态传输计算
+                result['speed'], result['speed_confidence'] = meter.result()
+
+            # 地理位置查询仍为阻塞的 HTTP 调用，放到线程池中
+            loop = asyncio.get_running_loop()
+            result['location'] = await loop.run_in_executor(None, checker._get_proxy_location, proxy.split(":")[0])
+
+            result['score'] = score_result(result)
+
+            result['status'] = 'Working'
+            return await self._check_profiles(result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise_if_local_exhaustion(e)  # 本机资源耗尽不是代理的问题
+            if log_queue:
+                log_queue.put(f"[Checker] 验证失败 {proxy}: {str(e) or type(e).__name__}")
+            return result
+
+    async def _check_profiles(self, result):
+        """对验证通过的代理逐个请求各画像 (checker.validation_profiles) 的目标，结果存入 result['profiles']。"""
+        profiles = self._checker.validation_profiles
+        if result['status'] != 'Working' or not profiles:
+            return result
+
+        async def request(url, method, timeout):
+            await self._request(result['proxy'], result['protocol'], url, method, timeout)
+
+        result['profiles'] = await async_run_profiles(profiles, request, result)
+        return result
+
+    # --- 调度 ---
+    async def _check(self, proxy_info, validation_mode, log_queue):
+        """经闸门 (启用自适应并发时) 完整验证一个代理；本机资源耗尽时降低并发后重试，不判为失效。"""
+        return await async_run_adaptive(self._gate, lambda p: self._full_check_proxy(p, validation_mode, log_queue), proxy_info)
+
+    def _new_controller(self, log_queue):
+        self.controller = make_controller(self.concurrency, self.adaptive, "完整验证", log_queue, 2)
+        self._gate = AsyncAdaptiveSemaphore(self.controller) if self.controller else None
+
+    async def _run_pool(self, items, worker, cancel_event):
+        """以 concurrency 个协程并发处理 items，cancel_event 被设置时取消全部任务；返回是否被取消。"""
+        pending = iter(items)
+
+        async def _worker():
+            for item in pending:
+                await worker(item)
+
+        return await self._supervise(asyncio.gather(*(_worker() for _ in range(min(self.concurrency, len(items))))),
+                                     cancel_event)
+
+    async def _supervise(self, done_all, cancel_event):
+        """等待 done_all 完成，期间 cancel_event 被设置则取消它；返回是否被取消。"""
+        try:
+            while True:
+                done, _ = await asyncio.wait([done_all], timeout=CANCEL_POLL_INTERVAL)
+                if done:
+                    done_all.result()
+                    return False
+                if cancel_event and cancel_event.is_set():
+                    return True
+        finally:
+            if not done_all.done():
+                done_all.cancel()
+                await asyncio.gather(done_all, return_exceptions=True)
+
+    async def _validate_all(self, all_proxies_flat, result_queue, log_queue, validation_mode, cancel_event):
+        total_proxies = len(all_proxies_flat)
+        log_queue.put(f"[*] 阶段一：TCP预检开始，总数: {total_proxies}...")
+        # TCP 预检用 selectors 批量连接，比逐个创建 asyncio 传输更轻，放到线程中运行以免阻塞事件循环
+        loop = asyncio.get_running_loop()
+        precheck_controller = make_controller(self.precheck_concurrency, self.adaptive, "TCP预检", log_queue)
+        try:
+            survivors = await loop.run_in_executor(None, pre_check, all_proxies_flat, self.precheck_timeout,
+                                                   self.precheck_concurrency, cancel_event, precheck_controller)
+        except LocalExhaustionError as e:
+            log_queue.put(f"[!] 本机资源耗尽，TCP预检中止 (未检查的代理不记为失效): {e}")
+            return
+        if cancel_event and cancel_event.is_set():
+            log_queue.put("[Checker] 任务在TCP预检后被用户取消。")
+            return
+        log_queue.put(f"[+] 阶段一：TCP预检完成，幸存者: {len(survivors)} / {total_proxies}。")
+        detect_controller = (make_controller(self.concurrency, self.adaptive, "握手探测", log_queue, 3)
+                             if self.detect_timeout is not None else None)
+        if self.detect_timeout is not None and survivors:
+            log_queue.put(f"[*] 握手探测开始，识别 {len(survivors)} 个候选的实际协议...")
+            survivors = await async_detect_protocols(survivors, self._checker.next_validation_targets()['anonymity_check'],
+                                                     self.detect_timeout, self.concurrency, cancel_event, detect_controller)
+            if cancel_event and cancel_event.is_set():
+                log_queue.put("[Checker] 任务在握手探测阶段被用户取消。")
+                return
+            log_queue.put(f"[+] 握手探测完成，可用代理端口: {len(survivors)}。")
+
+        log_queue.put("\n" + "="*20 + f" 阶段二：开始完整质量验证 (asyncio, 并发 {self.concurrency}) " + "="*20)
+        if not survivors:
+            result_queue.put(None)
+            return
+
+        self._new_controller(log_queue)
+
+        async def _full_check(proxy_info):
+            result = await self._check(proxy_info, validation_mode, log_queue)
+            if result:
+                result_queue.put(result)
+
+        cancelled = await self._run_pool(survivors, _full_check, cancel_event)
+        log_levels(log_queue, precheck_controller, detect_controller, self.controller)
+        if cancelled:
+            log_queue.put("[Checker] 任务在完整验证阶段被用户取消。")
+            return
+        result_queue.put(None)
+
+    async def _validate_stream(self, items, on_result, log_queue, validation_mode, cancel_event):
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue(self.concurrency)
+        self._new_controller(log_queue)
+        # on_result 通常要获取轮换器的线程锁 (见 RefreshPipeline._publish)，交给单独的线程按顺序执行，不阻塞事件循环
+        publisher = ThreadPoolExecutor(max_workers=1)
+
+        def _publish(result):
+            try:
+                on_result(result)
+            except Exception as e:
+                log_queue.put(f"[!] 处理验证结果出错: {e}")
+
+        async def _feed():
+            # items 是阻塞迭代器，在线程池中逐个取出
+            while (item := await loop.run_in_executor(None, next, items, None)) is not None:
+                await pending.put(item)
+            for _ in range(self.concurrency):
+                await pending.put(None)
+
+        async def _worker():
+            while (item := await pending.get()) is not None:
+                result = await self._check(item, validation_mode, log_queue)
+                if result:
+                    publisher.submit(_publish, result)
+
+        try:
+            if await self._supervise(asyncio.gather(_feed(), *(_worker() for _ in range(self.concurrency))),
+                                     cancel_event):
+                log_queue.put("[Checker] 流式验证被中断，进行中的检查已取消。")
+        finally:
+            # 等已提交的结果处理完再返回，调用方据此判断哪些代理本轮通过了验证
+            await loop.run_in_executor(None, publisher.shutdown)
+
+    def validate_stream(self, items, on_result, log_queue, validation_mode='online', cancel_event=None):
+        """
+        流式验证：从阻塞迭代器 items 中不断取出 {'proxy', 'protocol'} 进行完整验证 (不做 TCP 预检)，
+        每个结果按完成顺序交给 on_result，在单独的线程中依次调用，不阻塞事件循环；
+        items 耗尽或 cancel_event 被设置、且已提交的结果都处理完后返回。
+        """
+        asyncio.run(self._validate_stream(items, on_result, log_queue, validation_mode, cancel_event))
+
+    def validate_all(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online', cancel_event=None):
+        """阻塞执行全部验证，结果逐个放入 result_queue，正常结束时放入 None，被取消时不放。"""
+        all_proxies_flat = [{'proxy': p, 'protocol': proto} for proto, proxies in proxies_by_protocol.items() for p in proxies]
+        asyncio.run(self._validate_all(all_proxies_flat, result_queue, log_queue, validation_mode, cancel_event))
@@ -0,0 +1,447 @@
+# modules/async_server.py
+
+import asyncio
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.breaker import record_tunnel_outcome
+from core.failover import DEFAULT_FAILOVER_OPTIONS, async_connect_with_failover, iter_candidates
+from core.handshake import async_open_tunnel
+from core.httpparse import (HttpParseError, async_forward_body, async_read_head, body_framing, parse_head,
+                            request_origin)
+from core.pool import UpstreamPool
+from core.relay import SocketRelay
+from core.server import BAD_GATEWAY_RESPONSE, BAD_REQUEST_RESPONSE, MAX_UPSTREAMS_PER_CLIENT
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class AsyncProxyServer:
+    """
+    基于 asyncio 的本地代理服务，接口与 ProxyServer 一致。
+    HTTP 和 SOCKS5 两个监听器共用一个事件循环，上游连接与握手均为非阻塞，
+    单进程即可承载上万条并发隧道，而不必为每个客户端创建线程。
+    """
+    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue,
+                 connect_timeout=10, backlog=1024, relay_options=None, pool_options=None, failover_options=None):
+        self._rotator = rotator
+        self._log_queue = log_queue
+        self._running = False
+
+        self._http_host = http_host
+        self._http_port = http_port
+        self._socks5_host = socks5_host
+        self._socks5_port = socks5_port
+
+        self._connect_timeout = connect_timeout
+        self._backlog = backlog
+        # 复用线程版的转发配置: 空闲超时、读缓冲上限和 socket 调优
+        self._relay = SocketRelay(relay_options)
+        # 上游预热连接池 (可选)，取出的连接交给事件循环完成剩余握手
+        self._pool = None
+        if pool_options and pool_options.get('enabled'):
+            self._pool = UpstreamPool(rotator, log_queue, pool_options)
+        # 上游故障转移 / 竞速连接策略
+        self._failover = dict(DEFAULT_FAILOVER_OPTIONS)
+        if failover_options:
+            self._failover.update(failover_options)
+
+        self._loop = None
+        self._thread = None
+        self._stop_event = None
+        self._tasks = set()
+        # 熔断回报要获取轮换器的线程锁 (刷新期间可能被长时间持有)，交给单独的线程按顺序执行，不阻塞事件循环
+        self._reporter = None
+
+        self.rotate_per_request = False
+
+    def log(self, message):
+        self._log_queue.put(f"[Server] {message}")
+
+    def set_rotation_mode(self, per_request: bool, selection: str = None):
+        """设置代理轮换模式；selection 可同时切换轮换器的选择方式 ('round_robin' / 'weighted')。"""
+        self.rotate_per_request = per_request
+        mode = "逐请求轮换" if per_request else "固定当前"
+        if selection:
+            self._rotator.set_selection_mode(selection)
+            mode += ", 加权随机" if selection == 'weighted' else ", 顺序轮换"
+        self.log(f"服务轮换模式已切换为: {mode}")
+
+    def start_all(self):
+        """在独立线程中启动事件循环，并同时运行 HTTP 和 SOCKS5 服务。"""
+        if self._running:
+            return
+        self._running = True
+        self._raise_nofile_limit()
+        self._loop = asyncio.new_event_loop()
+        self._reporter = ThreadPoolExecutor(max_workers=1, thread_name_prefix='breaker-report')
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        if self._pool:
+            self._pool.start()
+
+    def stop_all(self):
+        """通知事件循环关闭监听器和所有隧道，并等待其退出。"""
+        if not self._running:
+            return
+        self._running = False
+        if self._loop and self._stop_event:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        if self._reporter:
+            self._reporter.shutdown(wait=False)
+        if self._pool:
+            self._pool.stop()
+        self.log("所有代理服务已停止。")
+
+    def _raise_nofile_limit(self):
+        """尽量把文件描述符软限制提升到硬限制，每条隧道需要两个描述符。"""
+        if resource is None:
+            return
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if hard == resource.RLIM_INFINITY or hard > soft:
+                target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+                resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+                self.log(f"文件描述符上限已从 {soft} 提升至 {target}")
+        except (ValueError, OSError) as e:
+            self.log(f"[!] 无法提升文件描述符上限: {e}")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+
+    async def _serve(self):
+        self._stop_event = asyncio.Event()
+        servers = []
+        listeners = [
+            ("HTTP", self._http_host, self._http_port, self._handle_http_client),
+            ("SOCKS5", self._socks5_host, self._socks5_port, self._handle_socks5_client),
+        ]
+        for name, host, port, handler in listeners:
+            try:
+                server = await asyncio.start_server(
+                    self._track(handler), host, port, reuse_address=True, backlog=self._backlog
+                )
+                servers.append(server)
+                self.log(f"{name} 代理服务接口已启动于 {host}:{port} (asyncio)")
+            except Exception as e:
+                self.log(f"[!] 启动 {name} 服务失败: {e}")
+
+        if servers and self._running:
+            await self._stop_event.wait()
+
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.log("asyncio 代理服务循环已退出。")
+
+    def _track(self, handler):
+        """包装客户端处理协程，记录任务以便停止服务时统一取消。"""
+        async def wrapper(reader, writer):
+            task = asyncio.current_task()
+            self._tasks.add(task)
+            try:
+                await handler(reader, writer)
+            finally:
+                self._tasks.discard(task)
+                writer.close()
+        return wrapper
+
+    async def _get_upstream_connection(self, target_host, target_port):
+        """
+        从轮换器获取一个上游代理，并以非阻塞方式通过它连接目标地址。
+        首选上游失败时，在时限内依次（或竞速）尝试其他候选上游。
+        """
+        candidates = iter_candidates(self._rotator, self.rotate_per_request, self._failover['max_attempts'])
+        upstream_proxy_info, streams, failures = await async_connect_with_failover(
+            candidates,
+            lambda proxy_info, timeout: self._connect_upstream(proxy_info, target_host, target_port, timeout),
+            self._failover,
+        )
+        for proxy_info, error in failures:
+            self.log(f"[!] 上游代理 {proxy_info.get('proxy')} 错误: {str(error) or type(error).__name__}")
+        self._report_outcome(upstream_proxy_info, failures)
+
+        if streams is None:
+            if not failures:
+                self.log("[!] 代理池为空或无符合条件的代理，无法转发请求。")
+            return None
+        if failures:
+            self.log(f"故障转移: {upstream_proxy_info['proxy']} -> {target_host}:{target_port} (此前 {len(failures)} 个候选失败)")
+        elif self.rotate_per_request:
+            self.log(f"轮换: {upstream_proxy_info['proxy']} -> {target_host}:{target_port}")
+        return streams
+
+    def _report_outcome(self, winner, failures):
+        """在回报线程中把隧道建立结果计入熔断器，不等待其完成。"""
+        def report():
+            for address, seconds in record_tunnel_outcome(self._rotator, winner, failures):
+                self.log(f"熔断: 上游代理 {address} 连续失败, 隔离 {seconds:g} 秒")
+        try:
+            self._reporter.submit(report)
+        except RuntimeError:  # 服务正在停止
+            pass
+
+    async def _connect_upstream(self, upstream_proxy_info, target_host, target_port, timeout):
+        """
+        通过指定上游代理建立到目标地址的隧道，返回 (reader, writer)，失败时抛出异常。
+        预热连接协商失败时重新拨号，两者共用 timeout，重新拨号只能使用剩余的时间。
+        """
+        addr = upstream_proxy_info.get('proxy')
+        proto = upstream_proxy_info.get('protocol')
+        if not addr or not proto:
+            raise ValueError(f"代理信息格式不正确: {upstream_proxy_info}")
+        timeout = min(timeout, self._connect_timeout)
+        deadline = time.monotonic() + timeout
+
+        pooled = self._pool.acquire(addr) if self._pool else None
+        if pooled:
+            sock, greeted = pooled
+            try:
+                return await async_open_tunnel(addr, proto, target_host, target_port, timeout,
+                                               sock=sock, greeted=greeted)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                sock.close()  # 预热连接协商失败，回退到重新拨号
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise asyncio.TimeoutError(f"连接上游代理 {addr} 超时")
+
+        return await async_open_tunnel(addr, proto, target_host, target_port, timeout)
+
+    async def _handle_http_client(self, reader, writer):
+        """处理单个HTTP客户端连接，支持同一持久连接上的多个请求。"""
+        upstreams = {}  # (host, port) -> (reader, writer)，同一客户端连接内按源站复用
+        try:
+            while self._running:
+                raw_head = await async_read_head(reader)
+                if raw_head is None:
+                    return
+                try:
+                    request = parse_head(raw_head, is_request=True)
+                except HttpParseError as e:
+                    self.log(f"[!] 无法解析 HTTP 请求: {e}")
+                    writer.write(BAD_REQUEST_RESPONSE)
+                    await writer.drain()
+                    return
+
+                if request.method == 'CONNECT':
+                    await self._handle_http_connect(reader, writer, request)
+                    return
+                if not await self._serve_http_request(reader, writer, request, upstreams):
+                    return
+        except (asyncio.CancelledError, ConnectionError, OSError, HttpParseError):
+            pass
+        except Exception as e:
+            self.log(f"处理 HTTP 请求时出错: {e}")
+        finally:
+            for _, remote_writer in upstreams.values():
+                remote_writer.close()
+
+    async def _handle_http_connect(self, reader, writer, request):
+        """处理 CONNECT 请求：建立隧道后转为原始字节转发。"""
+        target_host, target_port_str = request.target.rsplit(':', 1)
+        upstream = await self._get_upstream_connection(target_host, int(target_port_str))
+        if not upstream:
+            writer.write(BAD_GATEWAY_RESPONSE)
+            await writer.drain()
+            return
+        remote_reader, remote_writer = upstream
+        try:
+            writer.write(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+            await writer.drain()
+            await self._forward_data(reader, writer, remote_reader, remote_writer)
+        finally:
+            remote_writer.close()
+
+    async def _serve_http_request(self, reader, writer, request, upstreams):
+        """
+        转发一个普通 HTTP 请求及其响应，返回客户端连接能否继续处理下一个请求。
+        非逐请求轮换模式下，发往同一源站的请求复用同一条上游连接。
+        """
+        client_keep_alive = request.keep_alive()
+        origin = request_origin(request)
+        request_mode, request_length = body_framing(request)
+        head_bytes = request.serialize()
+
+        upstream = None if self.rotate_per_request else upstreams.pop(origin, None)
+        reused = upstream is not None
+        raw_response = None
+        while True:
+            if upstream is None:
+                upstream = await self._get_upstream_connection(*origin)
+                if not upstream:
+                    writer.write(BAD_GATEWAY_RESPONSE)
+                    await writer.drain()
+                    return False
+            remote_reader, remote_writer = upstream
+            try:
+                remote_writer.write(head_bytes)
+                await remote_writer.drain()
+                if request_mode == 'none':
+                    raw_response = await async_read_head(remote_reader)
+                    if raw_response is None:
+                        raise ConnectionResetError("上游连接已关闭")
+                break
+            except (OSError, HttpParseError):
+                remote_writer.close()
+                upstream = None
+                # 复用的空闲连接可能已被源站关闭，无请求体时换一条新连接重试一次
+                if reused and request_mode == 'none':
+                    reused = False
+                    continue
+                raise
+
+        keep_upstream = False
+        try:
+            if request_mode != 'none':
+                if request.has_token('Expect', '100-continue'):
+                    raw_response = await async_read_head(remote_reader)
+                    if raw_response is not None and parse_head(raw_response, is_request=False).status == 100:
+                        writer.write(raw_response)
+                        raw_response = None
+                        await async_forward_body(reader, remote_writer, request_mode, request_length)
+                    else:
+                        # 源站拒绝了请求体，客户端连接上残留的请求体无法再可靠分帧
+                        client_keep_alive = False
+                else:
+                    await async_forward_body(reader, remote_writer, request_mode, request_length)
+
+            while True:
+                if raw_response is None:
+                    raw_response = await async_read_head(remote_reader)
+                    if raw_response is None:
+                        raise HttpParseError("上游未返回响应")
+                response = parse_head(raw_response, is_request=False)
+                if 100 <= response.status < 200 and response.status != 101:
+                    writer.write(raw_response)  # 转发临时响应，继续等待最终响应
+                    raw_response = None
+                    continue
+                break
+            writer.write(raw_response)
+
+            if response.status == 101:
+                # 协议升级 (如 WebSocket)：之后的数据不再是 HTTP 报文
+                await writer.drain()
+                await self._forward_data(reader, writer, remote_reader, remote_writer)
+                return False
+
+            response_mode, response_length = body_framing(response, request.method)
+            await async_forward_body(remote_reader, writer, response_mode, response_length)
+            await writer.drain()
+
+            keep_upstream = (client_keep_alive and response_mode != 'close' and response.keep_alive()
+                             and not self.rotate_per_request)
+            if keep_upstream:
+                upstreams[origin] = upstream
+                while len(upstreams) > MAX_UPSTREAMS_PER_CLIENT:
+                    _, stale_writer = upstreams.pop(next(iter(upstreams)))
+                    stale_writer.close()
+            return client_keep_alive and response_mode != 'close'
+        finally:
+            if not keep_upstream:
+                remote_writer.close()
+
+    async def _handle_socks5_client(self, reader, writer):
+        """处理单个SOCKS5客户端连接。"""
+        remote_writer = None
+        try:
+            data = await reader.readexactly(2)
+            if data[0] != 5:
+                return
+            await reader.readexactly(data[1])
+            writer.write(b"\x05\x00")
+
+            data = await reader.readexactly(4)
+            if data[0] != 5 or data[1] != 1:
+                return
+
+            atyp = data[3]
+            if atyp == 1:
+                addr = socket.inet_ntoa(await reader.readexactly(4))
+            elif atyp == 3:
+                domain_len = (await reader.readexactly(1))[0]
+                addr = (await reader.readexactly(domain_len)).decode('utf-8')
+            else:
+                # 暂不支持IPv6
+                writer.write(b"\x05\x08\x00\x01\x00\x00\x00\x00\x00\x00")
+                await writer.drain()
+                return
+
+            port = struct.unpack('!H', await reader.readexactly(2))[0]
+
+            upstream = await self._get_upstream_connection(addr, port)
+            if not upstream:
+                writer.write(b"\x05\x04\x00\x01\x00\x00\x00\x00\x00\x00")  # Host unreachable
+                await writer.drain()
+                return
+            remote_reader, remote_writer = upstream
+
+            writer.write(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+            await self._forward_data(reader, writer, remote_reader, remote_writer)
+        except (asyncio.CancelledError, asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        except Exception as e:
+            self.log(f"处理 SOCKS5 请求时出错: {e}")
+        finally:
+            if remote_writer:
+                remote_writer.close()
+
+    async def _forward_data(self, client_reader, client_writer, remote_reader, remote_writer):
+        """在客户端和上游之间双向转发数据，任意一方关闭或空闲超时即结束隧道。"""
+        for w in (client_writer, remote_writer):
+            sock = w.get_extra_info('socket')
+            if sock is not None:
+                self._relay.tune_socket(sock)
+        read_size = self._relay.options['max_buffer_size']
+        idle_timeout = self._relay.options['idle_timeout']
+        loop = asyncio.get_running_loop()
+        last_activity = [loop.time()]
+
+        async def pipe(src, dst):
+            try:
+                while True:
+                    data = await src.read(read_size)
+                    if not data:
+                        break
+                    last_activity[0] = loop.time()
+                    dst.write(data)
+                    await dst.drain()
+            except (ConnectionError, OSError):
+                pass
+
+        async def idle_watch():
+            while True:
+                remaining = last_activity[0] + idle_timeout - loop.time()
+                if remaining <= 0:
+                    return
+                await asyncio.sleep(remaining)
+
+        tasks = [
+            asyncio.ensure_future(pipe(client_reader, remote_writer)),
+            asyncio.ensure_future(pipe(remote_reader, client_writer)),
+        ]
+        if idle_timeout:
+            tasks.append(asyncio.ensure_future(idle_watch()))
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,152 @@
+# modules/breaker.py
+
+import heapq
+import threading
+import time
+
+import socks
+
+DEFAULT_BREAKER_OPTIONS = {
+    'failure_threshold': 3,    # 连续失败多少次后熔断 (隔离)
+    'open_seconds': 30,        # 首次隔离时长 (秒)
+    'backoff_factor': 2,       # 重新接纳后试探失败时, 隔离时长按此倍数增长
+    'max_open_seconds': 600,   # 隔离时长上限 (秒)
+    'probe_timeout': 15,       # 半开状态下试探请求的最长等待时间, 超时未回报则允许下一次试探 (秒)
+}
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class _Circuit:
+    __slots__ = ('state', 'failures', 'trips', 'reopen_at', 'probe_at')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0          # 连续熔断次数, 决定下一次隔离时长
+        self.reopen_at = 0.0
+        self.probe_at = None    # 半开状态下当前试探请求的开始时间
+
+
+class CircuitBreaker:
+    """
+    按上游地址维护的熔断器。
+    closed: 正常使用，连续失败达到阈值后转为 open；
+    open: 隔离一段时间（按指数退避增长），到期后转为 half_open；
+    half_open: 重新接纳，只放行一个试探请求，成功则恢复 closed，失败则以更长的时长再次隔离。
+    只为出现过失败的地址保存状态；本身不修改代理记录，由 ProxyRotator 据此维护索引。
+    """
+    def __init__(self, options=None):
+        self.options = dict(DEFAULT_BREAKER_OPTIONS)
+        if options:
+            self.options.update(options)
+        self._circuits = {}      # 代理地址 -> _Circuit
+        self._due = []           # (reopen_at, 代理地址) 小顶堆, 可能含已失效条目
+        self.half_open = set()   # 处于半开状态的地址, 读端无锁判断是否需要争夺试探资格
+        self._lock = threading.Lock()
+
+    def configure(self, options):
+        with self._lock:
+            self.options.update(options)
+
+    def clear(self):
+        with self._lock:
+            self._circuits.clear()
+            self._due.clear()
+            self.half_open.clear()
+
+    def forget(self, address):
+        with self._lock:
+            self._circuits.pop(address, None)
+            self.half_open.discard(address)
+
+    def tracked(self, address) -> bool:
+        return address in self._circuits
+
+    def record_failure(self, address, now=None):
+        """记录一次失败，返回 (连续失败次数, 本次触发的隔离秒数或 None)。"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            circuit = self._circuits.get(address)
+            if circuit is None:
+                circuit = self._circuits[address] = _Circuit()
+            circuit.failures += 1
+            if circuit.state == OPEN:
+                return circuit.failures, None
+            if circuit.state == HALF_OPEN or circuit.failures >= self.options['failure_threshold']:
+                return circuit.failures, self._trip(address, circuit, now)
+            return circuit.failures, None
+
+    def _trip(self, address, circuit, now):
+        options = self.options
+        seconds = min(options['open_seconds'] * options['backoff_factor'] ** circuit.trips,
+                      options['max_open_seconds'])
+        circuit.trips += 1
+        circuit.state = OPEN
+        circuit.reopen_at = now + seconds
+        circuit.probe_at = None
+        self.half_open.discard(address)
+        heapq.heappush(self._due, (circuit.reopen_at, address))
+        return seconds
+
+    def record_success(self, address):
+        """记录一次成功，关闭熔断器并清除其状态；返回之前是否有状态。"""
+        with self._lock:
+            self.half_open.discard(address)
+            return self._circuits.pop(address, None) is not None
+
+    def next_due(self) -> float:
+        """最早一个隔离到期的时间，没有时为 inf。无锁读取，可能略有滞后。"""
+        due = self._due
+        return due[0][0] if due else float('inf')
+
+    def pop_due(self, now=None):
+        """取出隔离已到期的地址并转为半开状态。"""
+        now = time.monotonic() if now is None else now
+        ready = []
+        with self._lock:
+            while self._due and self._due[0][0] <= now:
+                reopen_at, address = heapq.heappop(self._due)
+                circuit = self._circuits.get(address)
+                if circuit is None or circuit.state != OPEN or circuit.reopen_at != reopen_at:
+                    continue  # 已被移除、重置或再次隔离
+                circuit.state = HALF_OPEN
+                circuit.probe_at = None
+                self.half_open.add(address)
+                ready.append(address)
+        return ready
+
+    def claim_probe(self, address, now=None) -> bool:
+        """半开状态下争夺试探资格：没有在途试探（或上一个试探已超时）时返回 True。非半开地址总是返回 True。"""
+        if address not in self.half_open:
+            return True
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            circuit = self._circuits.get(address)
+            if circuit is None or circuit.state != HALF_OPEN:
+                return True
+            if circuit.probe_at is not None and now - circuit.probe_at < self.options['probe_timeout']:
+                return False
+            circuit.probe_at = now
+            return True
+
+
+def upstream_at_fault(error) -> bool:
+    """判断隧道失败是否确定由上游本身造成（无法连上上游），而不是目标站点不可达或超时这类难以归咎的情况。"""
+    return isinstance(error, (socks.ProxyConnectionError, ConnectionRefusedError, ConnectionResetError))
+
+
+def record_tunnel_outcome(rotator, winner, failures):
+    """
+    将一次隧道建立的结果回报给轮换器的熔断器，返回 [(代理地址, 隔离秒数)]。
+    有候选成功时，其余失败的候选都计为失败；全部失败时目标站点本身可能不可达，只计入明确连不上上游的失败。
+    """
+    tripped = []
+    for proxy_info, error in failures:
+        if winner is not None or upstream_at_fault(error):
+            seconds = rotator.report_failure(proxy_info['proxy'])
+            if seconds:
+                tripped.append((proxy_info['proxy'], seconds))
+    if winner is not None:
+        rotator.report_success(winner['proxy'])
+    return tripped
@@ -2,11 +2,22 @@
 
 import requests
 import json
-import socket
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import subprocess
 
+from core.async_checker import DEFAULT_CONCURRENCY, AsyncProxyChecker
+from core.concurrency import (AdaptiveSemaphore, LocalExhaustionError, log_levels, make_controller,
+                              raise_if_local_exhaustion, release_proxy_pool, run_adaptive)
+from core.detect import DEFAULT_DETECT_TIMEOUT, detect_protocols
+from core.geocache import LocationCache
+from core.geoip import GeoIPDatabase
+from core.judge import JudgePool
+from core.precheck import DEFAULT_PRECHECK_CONCURRENCY, DEFAULT_PRECHECK_TIMEOUT, pre_check
+from core.probe import single_connection_check
+from core.profiles import load_profiles, run_profiles
+from core.throughput import ThroughputProbe
+
 class ProxyChecker:
     """
     一个经过优化的多阶段代理验证器，结合TCP预检和完整质量验证。
@@ -43,8 +54,13 @@ class ProxyChecker:
             'Vietnam': '越南',
             'Thailand': '泰国',
         }
-        self.location_cache = {}
+        self.location_cache = LocationCache()  # 有上限、带过期与磁盘快照的地理位置缓存
+        self.throughput = ThroughputProbe()  # 有字节/时间上限与全局带宽预算的测速
         self.public_ip = None
+        self.judge_pool = None  # 配置了评判服务时替代 validation_targets
+        self.validation_profiles = {}  # 验证画像: 名称 -> 业务目标、超时与评分权重 (见 core.profiles)
+        self.geoip = None  # 离线 IP 库 (core.geoip.GeoIPDatabase)，优先于在线 API
+        self.geoip_online_fallback = True  # 离线库未收录时是否再查询在线 API
 
     def initialize_public_ip(self, log_queue=None):
         """通过调用系统 'curl' 命令获取本机公网IP，作为匿名度检测的基准。"""
@@ -72,13 +88,20 @@ class ProxyChecker:
 
     # --- IP地理位置查询 (聚合多个API) ---
     def _get_proxy_location(self, ip: str):
+        """查询IP的地理位置，经 location_cache 缓存 (见 core.geocache)，同一地址的并发查询只请求一次。"""
+        return self.location_cache.get_or_load(ip, self._lookup_location)
+
+    def _lookup_location(self, ip: str):
         """
-        查询IP的地理位置，聚合多个API源并带缓存，优先国内源，结果翻译为中文。
+        实际查询IP的地理位置，聚合多个API源，优先国内源，结果翻译为中文。
+        加载了离线 IP 库时先查本地，未收录且允许回退时才请求在线 API。
         """
-        if ip in self.location_cache:
-            return self.location_cache[ip]
-
         location = "未知"
+        if self.geoip is not None:
+            country = self.geoip.lookup(ip)
+            if country or not self.geoip_online_fallback:
+                location = self.COUNTRY_NAME_MAP.get(country, country) if country else location
+                return location
         
         # API 1: ip-api.com (国际源, 覆盖广)
         try:
@@ -90,7 +113,6 @@ class ProxyChecker:
                 country = data.get('country', '')
                 if country:
                     location = self.COUNTRY_NAME_MAP.get(country, country)
-                    self.location_cache[ip] = location
                     return location
         except Exception:
             pass # 尝试下一个API
@@ -106,7 +128,6 @@ class ProxyChecker:
                 country = d.get('country', '')
                 if country:
                     location = self.COUNTRY_NAME_MAP.get(country, country)
-                    self.location_cache[ip] = location
                     return location
         except Exception:
             pass # 尝试下一个API
@@ -120,32 +141,76 @@ class ProxyChecker:
             country = data.get('country', '')
             if country:
                 location = self.COUNTRY_NAME_MAP.get(country, country)
-                self.location_cache[ip] = location
                 return location
         except Exception:
             pass
             
-        self.location_cache[ip] = location
         return location
 
-    def _pre_check_proxy(self, proxy: str):
-        """TCP预检，快速判断端口是否开放。"""
+    def set_geoip(self, database: str, online_fallback: bool = True, log_queue=None):
+        """加载离线 IP 库 (CSV 或 .mmdb，见 core.geoip)；database 为空或加载失败时只使用在线 API。"""
+        old, self.geoip = self.geoip, None
+        if old is not None:
+            old.close()
+        self.geoip_online_fallback = online_fallback
+        if not database:
+            return
         try:
-            ip, port_str = proxy.split(':')
-            with socket.create_connection((ip, int(port_str)), timeout=1.5):
-                return True
-        except Exception:
-            return False
+            self.geoip = GeoIPDatabase(database)
+            if log_queue:
+                log_queue.put(f"[Checker] 已加载离线 IP 库 {database}")
+        except (OSError, ImportError, ValueError) as e:
+            if log_queue:
+                log_queue.put(f"[Checker] [!] 加载离线 IP 库失败，改用在线 API: {e}")
 
-    def _full_check_proxy(self, proxy_info: dict, validation_mode: str = 'online', cancel_event=None):
+    def set_judges(self, judges):
+        """设置评判服务根地址列表 (见 core.judge)，各代理的验证轮流分配到其中之一；为空时使用 validation_targets。"""
+        self.judge_pool = JudgePool(judges) if judges else None
+
+    def next_validation_targets(self) -> dict:
+        """为一次验证选取验证目标：配置了评判服务时轮流使用，否则为 validation_targets。"""
+        return self.judge_pool.next_targets() if self.judge_pool else self.validation_targets
+
+    def set_profiles(self, profiles):
+        """设置验证画像 {名称: {'targets', 'method', 'timeout', 'weights'}} (见 core.profiles)，为空时不做画像测量。"""
+        self.validation_profiles = load_profiles(profiles)
+
+    def _check_profiles(self, result, cancel_event=None):
+        """对验证通过的代理逐个请求各画像的目标，结果存入 result['profiles']；被取消时返回 None。"""
+        if not result or result['status'] != 'Working' or not self.validation_profiles:
+            return result
+        proxy_url = f"{result['protocol'].lower()}://{result['proxy']}"
+        proxies_dict = {'http': proxy_url, 'https': proxy_url}
+
+        def request(url, method, timeout):
+            response = self.session.request(method, url, proxies=proxies_dict, timeout=timeout, stream=True)
+            response.close()  # 只需响应头，不读取报文体
+            response.raise_for_status()
+
+        try:
+            profiles = run_profiles(self.validation_profiles, request, result, cancel_event)
+        finally:
+            release_proxy_pool(self.session, proxy_url)
+        if profiles is None:
+            return None
+        result['profiles'] = profiles
+        return result
+
+    def _full_check_proxy(self, proxy_info: dict, validation_mode: str = 'online', cancel_event=None, probe: str = 'separate'):
         """
         对单个代理进行完整的质量验证，此过程可随时取消。
         在每个阻塞网络操作前后，都会检查 cancel_event。
+        probe 为 'single' 时改为只建立一条隧道、经 keep-alive 完成全部探测 (见 core.probe)。
         """
+        if probe == 'single':
+            if cancel_event and cancel_event.is_set(): return None
+            result = single_connection_check(self, proxy_info, None, self.session.headers.get('User-Agent', 'Mozilla/5.0'))
+            return self._check_profiles(result, cancel_event)
         proxy = proxy_info['proxy']
         protocol = proxy_info['protocol']
         proxy_url = f"{protocol.lower()}://{proxy}"
         proxies_dict = {'http': proxy_url, 'https': proxy_url}
+        targets = self.next_validation_targets()
         result = {
             'proxy': proxy, 'protocol': protocol.upper(), 'status': 'Failed',
             'latency': float('inf'), 'speed': 0, 'anonymity': 'Unknown', 'location': 'N/A'
@@ -155,12 +220,12 @@ class ProxyChecker:
             if cancel_event and cancel_event.is_set(): return None
 
             start_time = time.time()
-            self.session.head(self.validation_targets['latency_check'], proxies=proxies_dict, timeout=self.timeout).raise_for_status()
+            self.session.head(targets['latency_check'], proxies=proxies_dict, timeout=self.timeout).raise_for_status()
             result['latency'] = time.time() - start_time
 
             if cancel_event and cancel_event.is_set(): return None
 
-            res_anon = self.session.get(self.validation_targets['anonymity_check'], proxies=proxies_dict, timeout=self.timeout)
+            res_anon = self.session.get(targets['anonymity_check'], proxies=proxies_dict, timeout=self.timeout)
             res_anon.raise_for_status()
             data = res_anon.json()
             origin_ips_str = data.get('headers', {}).get('X-Forwarded-For', data.get('origin', ''))
@@ -178,23 +243,13 @@ class ProxyChecker:
 
             # 延迟低于7秒的才进行测速
             if result['latency'] <= 7.0:
-                speed_check_url = self.validation_targets['latency_check'] if validation_mode == 'online' else self.validation_targets['speed_check']
                 try:
-                    start_speed = time.time()
-                    speed_response = self.session.get(speed_check_url, proxies=proxies_dict, timeout=15, stream=True)
-                    speed_response.raise_for_status()
-                    
-                    content_size = 0
-                    for chunk in speed_response.iter_content(chunk_size=8192):
-                        if cancel_event and cancel_event.is_set():
-                            speed_response.close() # 及时关闭连接
-                            return None
-                        content_size += len(chunk)
-
-                    speed_duration = time.time() - start_speed
-                    if speed_duration > 0 and content_size > 0:
-                        # 计算速度，单位 Mbps
-                        result['speed'] = (content_size / speed_duration) * 8 / (1000**2)
+                    measured = self.throughput.measure(self.session, self.throughput.url(targets),
+                                                       proxies_dict, self.timeout, cancel_event)
+                    if measured is None:
+                        return None
+                    # 速度单位 Mbps，按稳态传输计算
+                    result['speed'], result['speed_confidence'] = measured
                 except Exception:
                     pass # 测速失败不影响整体结果
 
@@ -204,50 +259,73 @@ class ProxyChecker:
             result['location'] = self._get_proxy_location(proxy.split(":")[0])
             
             result['status'] = 'Working'
-            return result
+            return self._check_profiles(result, cancel_event)
 
-        except requests.RequestException:
+        except requests.RequestException as e:
+            raise_if_local_exhaustion(e)  # 本机资源耗尽不是代理的问题
             return result
-        except Exception:
+        except Exception as e:
+            raise_if_local_exhaustion(e)
             return result
+        finally:
+            release_proxy_pool(self.session, proxy_url)
 
     # --- 优化了验证任务的取消逻辑 ---
-    def validate_all(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online', max_workers=100, cancel_event=None):
+    def validate_all(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online', max_workers=100, cancel_event=None,
+                     engine='threaded', concurrency=DEFAULT_CONCURRENCY, precheck_timeout=DEFAULT_PRECHECK_TIMEOUT,
+                     precheck_concurrency=DEFAULT_PRECHECK_CONCURRENCY, probe='separate', detect_protocol=True,
+                     detect_timeout=DEFAULT_DETECT_TIMEOUT, adaptive=None):
+        """
+        验证全部代理，结果逐个放入 result_queue，正常结束时放入 None。
+        engine 为 'asyncio' 时改用 AsyncProxyChecker，以 concurrency 个协程并发验证，max_workers 不再使用。
+        TCP 预检在单线程内以非阻塞连接批量进行 (见 core.precheck)，不限代理数量。
+        probe 为 'single' 时每个代理只建立一条隧道完成全部探测，并在结果中记录各阶段耗时 ('timings')。
+        detect_protocol 为 True 时在预检与完整验证之间做握手探测 (见 core.detect)，每个地址只按实际协议验证一次。
+        给出 adaptive (自适应并发选项，见 core.concurrency) 时，max_workers / concurrency / precheck_concurrency 只作为上限，
+        实际并发由 AIMD 控制器按成功率与连接耗时调整；本机资源耗尽 (EMFILE、端口耗尽) 时降低并发并重试，不把代理判为失效。
+        """
+        if engine == 'asyncio':
+            AsyncProxyChecker(self, concurrency, precheck_timeout, precheck_concurrency, probe,
+                              detect_timeout if detect_protocol else None, adaptive).validate_all(proxies_by_protocol, result_queue, log_queue, validation_mode, cancel_event)
+            return
         all_proxies_flat = [{'proxy': p, 'protocol': proto} for proto, proxies in proxies_by_protocol.items() for p in proxies]
         total_proxies = len(all_proxies_flat)
         
-        survivors = []
-        # 代理数量太多时，跳过TCP预检，避免开销过大
-        if total_proxies > 10000:
-            log_queue.put(f"[!] 代理总数 ({total_proxies}) 超过10000，跳过TCP预检。")
-            survivors = all_proxies_flat
-        else:
-            log_queue.put(f"[*] 阶段一：TCP预检开始，总数: {total_proxies}...")
-            executor = ThreadPoolExecutor(max_workers=500)
-            try:
-                future_to_proxy = {executor.submit(self._pre_check_proxy, p['proxy']): p for p in all_proxies_flat}
-                for future in as_completed(future_to_proxy):
-                    if cancel_event and cancel_event.is_set(): break
-                    if future.result():
-                        survivors.append(future_to_proxy[future])
-            finally:
-                # 如果任务被取消，不等线程池执行完毕
-                executor.shutdown(wait=not (cancel_event and cancel_event.is_set()))
-            log_queue.put(f"[+] 阶段一：TCP预检完成，幸存者: {len(survivors)} / {total_proxies}。")
+        log_queue.put(f"[*] 阶段一：TCP预检开始，总数: {total_proxies}...")
+        precheck_controller = make_controller(precheck_concurrency, adaptive, "TCP预检", log_queue)
+        try:
+            survivors = pre_check(all_proxies_flat, precheck_timeout, precheck_concurrency, cancel_event, precheck_controller)
+        except LocalExhaustionError as e:
+            log_queue.put(f"[!] 本机资源耗尽，TCP预检中止 (未检查的代理不记为失效): {e}")
+            return
+        log_queue.put(f"[+] 阶段一：TCP预检完成，幸存者: {len(survivors)} / {total_proxies}。")
 
         if cancel_event and cancel_event.is_set():
             log_queue.put("[Checker] 任务在TCP预检后被用户取消。")
             return # 直接返回，不往队列放任何东西
 
+        detect_controller = make_controller(concurrency, adaptive, "握手探测", log_queue, 3) if detect_protocol else None
+        if detect_protocol and survivors:
+            log_queue.put(f"[*] 握手探测开始，识别 {len(survivors)} 个候选的实际协议...")
+            survivors = detect_protocols(survivors, self.next_validation_targets()['anonymity_check'], detect_timeout,
+                                         concurrency, cancel_event, detect_controller)
+            if cancel_event and cancel_event.is_set():
+                log_queue.put("[Checker] 任务在握手探测阶段被用户取消。")
+                return
+            log_queue.put(f"[+] 握手探测完成，可用代理端口: {len(survivors)}。")
+
         log_queue.put("\n" + "="*20 + f" 阶段二：开始完整质量验证 " + "="*20)
         
         if not survivors:
             result_queue.put(None) # 正常结束
             return
 
+        controller = make_controller(max_workers, adaptive, "完整验证", log_queue, 2)
+        gate = AdaptiveSemaphore(controller) if controller else None
+        check = lambda p: self._full_check_proxy(p, validation_mode, cancel_event, probe)
         executor = ThreadPoolExecutor(max_workers=max_workers)
         try:
-            futures = [executor.submit(self._full_check_proxy, p, validation_mode, cancel_event) for p in survivors]
+            futures = [executor.submit(run_adaptive, gate, check, p, cancel_event) for p in survivors]
             for future in as_completed(futures):
                 if cancel_event and cancel_event.is_set():
                     break
@@ -259,6 +337,7 @@ class ProxyChecker:
                     log_queue.put(f"[!] 验证器线程出现异常: {e}")
         finally:
             executor.shutdown(wait=not (cancel_event and cancel_event.is_set()))
+        log_levels(log_queue, precheck_controller, detect_controller, controller)
 
         # 只有在任务未被取消的情况下，才发送结束信号(None)
         if not (cancel_event and cancel_event.is_set()):
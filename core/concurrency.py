@@ -0,0 +1,284 @@
+# modules/concurrency.py
+
+import asyncio
+import errno
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_ADAPTIVE_OPTIONS = {
+    'enabled': False,          # 默认关闭，各阶段使用固定并发
+    'initial': 32,             # 初始并发，之后按慢启动翻倍增长，出现拥塞信号后改为线性增长
+    'min': 4,                  # 并发下限
+    'window': 32,              # 每收集多少个结果评估一次 (不少于当前并发)
+    'increase_step': 8,        # 线性增长阶段每个窗口增加的并发
+    'backoff_factor': 0.5,     # 出现拥塞信号时并发乘以此系数
+    'latency_factor': 2.0,     # 窗口平均连接耗时超过基线的倍数视为拥塞
+    'failure_tolerance': 0.15, # 窗口失败比例高于基线多少视为拥塞
+    'log_interval': 5,         # 并发上升日志的最小间隔 (秒)，下降总是记录
+}
+
+# 本机资源耗尽：文件描述符、内核缓冲区、本地端口。这类失败与代理本身无关
+LOCAL_EXHAUSTION_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.EADDRNOTAVAIL}
+_FD_RESERVE = 256
+_DECREASE_COOLDOWN = 1.0   # 同一批并发请求先后报告的资源耗尽只计一次 (秒)
+_LATENCY_NOISE = 0.05      # 连接耗时比基线高出不足该值 (秒) 时不视为拥塞，避免在低延迟网络上误判
+_GATE_POLL_INTERVAL = 0.2
+_EXHAUSTION_ATTEMPTS = 5   # 因本机资源耗尽失败时最多尝试的次数
+
+
+class LocalExhaustionError(Exception):
+    """验证因本机资源耗尽而失败，应降低并发后重试，而不是把代理判为失效。"""
+
+
+def local_exhaustion(error) -> bool:
+    """异常 (及其 __cause__ / __context__ / 包装的原因) 中是否有本机资源耗尽的 OSError。"""
+    stack, seen = [error], set()
+    while stack:
+        e = stack.pop()
+        if e is None or id(e) in seen:
+            continue
+        seen.add(id(e))
+        if isinstance(e, OSError) and e.errno in LOCAL_EXHAUSTION_ERRNOS:
+            return True
+        stack.extend((e.__cause__, e.__context__, getattr(e, 'reason', None)))
+        stack.extend(a for a in getattr(e, 'args', ()) if isinstance(a, BaseException))
+    return False
+
+
+def fd_budget(fds_per_task: int = 1):
+    """按 RLIMIT_NOFILE 软限制估算最多可同时进行的任务数，没有限制或无法获取时返回 None。"""
+    if resource is None:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return max(1, (soft - _FD_RESERVE) // fds_per_task)
+
+
+class ConcurrencyController:
+    """
+    AIMD 并发控制器。每收集一个窗口的结果评估一次：失败比例与平均连接耗时都接近基线时增加并发
+    (先慢启动翻倍，出现过拥塞后每次加 increase_step)；明显劣于基线时乘以 backoff_factor。
+    本机资源耗尽 (EMFILE、端口耗尽等) 通过 congested() 立即降低并发。
+    基线取各窗口中的较好值并缓慢回升，因此候选中大多是死代理时失败比例本身不会被当作拥塞。
+    上限受 maximum 与文件描述符软限制约束；limit 为当前允许的并发，读取无需加锁。
+    """
+    def __init__(self, maximum: int, options=None, name='', log_queue=None, fds_per_task: int = 1):
+        self.options = dict(DEFAULT_ADAPTIVE_OPTIONS)
+        if options:
+            self.options.update(options)
+        budget = fd_budget(fds_per_task)
+        self.maximum = max(1, min(maximum, budget) if budget else maximum)
+        self.minimum = max(1, min(self.options['min'], self.maximum))
+        self.limit = min(max(self.options['initial'], self.minimum), self.maximum)
+        self.peak = self.limit
+        self.name = name
+        self._log_queue = log_queue
+        self._slow_start = True
+        self._lock = threading.Lock()
+        self._reset_window()
+        self._base_failure = None
+        self._base_latency = None
+        self._last_decrease = 0.0
+        self._last_log = 0.0
+
+    def _reset_window(self):
+        self._count = 0
+        self._failures = 0
+        self._latency_sum = 0.0
+        self._latency_count = 0
+
+    def record(self, ok: bool, latency: float = None):
+        """记录一个结果；latency 为成功时的连接耗时 (秒)。"""
+        with self._lock:
+            self._count += 1
+            if not ok:
+                self._failures += 1
+            elif latency is not None:
+                self._latency_sum += latency
+                self._latency_count += 1
+            if self._count >= max(self.options['window'], self.limit):
+                self._evaluate()
+
+    def congested(self, reason: str = "本机资源耗尽"):
+        """立即降低并发；冷却时间内的重复报告只计一次。"""
+        with self._lock:
+            if time.monotonic() - self._last_decrease >= _DECREASE_COOLDOWN:
+                self._decrease(reason)
+
+    def _evaluate(self):
+        options = self.options
+        failure = self._failures / self._count
+        latency = self._latency_sum / self._latency_count if self._latency_count else None
+        self._reset_window()
+        reason = None
+        if self._base_failure is not None and failure > self._base_failure + options['failure_tolerance']:
+            reason = f"失败比例 {failure:.0%}"
+        elif (latency and self._base_latency and latency > self._base_latency * options['latency_factor']
+              and latency > self._base_latency + _LATENCY_NOISE):
+            reason = f"连接耗时 {latency * 1000:.0f}ms"
+        # 基线取较好值，并向当前值缓慢回升，以适应网络条件的变化
+        self._base_failure = failure if self._base_failure is None else min(failure, 0.8 * self._base_failure + 0.2 * failure)
+        if latency:
+            self._base_latency = latency if self._base_latency is None else min(latency, 0.8 * self._base_latency + 0.2 * latency)
+        if reason:
+            self._decrease(reason)
+        else:
+            self._increase()
+
+    def _increase(self):
+        old = self.limit
+        new = old * 2 if self._slow_start else old + self.options['increase_step']
+        self.limit = min(new, self.maximum)
+        self.peak = max(self.peak, self.limit)
+        now = time.monotonic()
+        if self.limit != old and now - self._last_log >= self.options['log_interval']:
+            self._last_log = now
+            self._log(f"{self.name}并发上调: {old} -> {self.limit}")
+
+    def _decrease(self, reason):
+        old = self.limit
+        self._slow_start = False
+        self.limit = max(self.minimum, int(old * self.options['backoff_factor']))
+        self._last_decrease = time.monotonic()
+        self._log(f"{self.name}并发下调: {old} -> {self.limit} ({reason})")
+
+    def _log(self, message):
+        if self._log_queue:
+            self._log_queue.put(f"[Checker] {message}")
+
+    def summary(self) -> str:
+        return f"{self.name}并发: 当前 {self.limit}，峰值 {self.peak}，上限 {self.maximum}"
+
+
+class AdaptiveSemaphore:
+    """线程版闸门：同时持有的数量不超过控制器当前的 limit。"""
+    def __init__(self, controller: ConcurrencyController):
+        self.controller = controller
+        self._active = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, cancel_event=None) -> bool:
+        """等待空位，cancel_event 被设置时返回 False。"""
+        with self._cond:
+            while self._active >= self.controller.limit:
+                if cancel_event and cancel_event.is_set():
+                    return False
+                self._cond.wait(_GATE_POLL_INTERVAL)
+            self._active += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+
+class AsyncAdaptiveSemaphore:
+    """asyncio 版闸门，只能在同一个事件循环中使用。"""
+    def __init__(self, controller: ConcurrencyController):
+        self.controller = controller
+        self._active = 0
+        self._released = asyncio.Event()
+
+    async def acquire(self):
+        while self._active >= self.controller.limit:
+            self._released.clear()
+            try:
+                await asyncio.wait_for(self._released.wait(), _GATE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass  # limit 可能已被调高
+        self._active += 1
+
+    def release(self):
+        self._active -= 1
+        self._released.set()
+
+
+def release_proxy_pool(session, proxy_url: str):
+    """
+    关闭 requests 会话中经由 proxy_url 的连接池。会话为每个代理各保留一个连接池且从不释放，
+    逐个验证大量代理时空闲连接会一直占用文件描述符，直到耗尽。
+    """
+    for adapter in session.adapters.values():
+        manager = adapter.proxy_manager.pop(proxy_url, None)
+        if manager is not None:
+            manager.clear()
+
+
+def log_levels(log_queue, *controllers):
+    """在日志中报告各控制器的当前与峰值并发，未启用的 (None) 跳过。"""
+    for controller in controllers:
+        if controller is not None:
+            log_queue.put(f"[Checker] {controller.summary()}")
+
+
+def raise_if_local_exhaustion(error):
+    """在验证的异常处理中调用：本机资源耗尽时改抛 LocalExhaustionError，由调度方降低并发后重试。"""
+    if local_exhaustion(error):
+        raise LocalExhaustionError(str(error) or type(error).__name__) from error
+
+
+def make_controller(maximum: int, options, name='', log_queue=None, fds_per_task: int = 1):
+    """按自适应并发选项创建控制器；options 为空或未启用时返回 None (使用固定并发)。"""
+    if not options or not options.get('enabled', False):
+        return None
+    return ConcurrencyController(maximum, options, name, log_queue, fds_per_task)
+
+
+def check_outcome(result):
+    """完整验证结果 -> (是否通过, 首个请求的延迟)，供控制器评估；没有结果 (被取消) 时返回 None。"""
+    if result is None:
+        return None
+    working = result['status'] == 'Working'
+    return working, result['latency'] if working else None
+
+
+def run_adaptive(gate, check, item, cancel_event=None, outcome=check_outcome):
+    """
+    执行 check(item)：gate 不为空时在其限制下执行并把 outcome(结果) 反馈给控制器。
+    遇到 LocalExhaustionError 时降低并发并稍等后重试，重试用尽或被取消时返回 None，不把代理判为失效。
+    """
+    for _ in range(_EXHAUSTION_ATTEMPTS):
+        if gate is not None and not gate.acquire(cancel_event):
+            return None
+        try:
+            result = check(item)
+        except LocalExhaustionError:
+            if gate is not None:
+                gate.controller.congested()
+            time.sleep(_GATE_POLL_INTERVAL)  # 等其他任务释放资源
+            continue
+        finally:
+            if gate is not None:
+                gate.release()
+        if gate is not None and (feedback := outcome(result)) is not None:
+            gate.controller.record(*feedback)
+        return result
+    return None
+
+
+async def async_run_adaptive(gate, check, item, outcome=check_outcome):
+    """run_adaptive 的 asyncio 版本，check 为协程函数。"""
+    for _ in range(_EXHAUSTION_ATTEMPTS):
+        if gate is not None:
+            await gate.acquire()
+        try:
+            result = await check(item)
+        except LocalExhaustionError:
+            if gate is not None:
+                gate.controller.congested()
+            await asyncio.sleep(_GATE_POLL_INTERVAL)
+            continue
+        finally:
+            if gate is not None:
+                gate.release()
+        if gate is not None and (feedback := outcome(result)) is not None:
+            gate.controller.record(*feedback)
+        return result
+    return None
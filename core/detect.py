@@ -0,0 +1,130 @@
+# modules/detect.py
+
+import asyncio
+import socket
+from urllib.parse import urlsplit
+
+from core.concurrency import AsyncAdaptiveSemaphore, async_run_adaptive, raise_if_local_exhaustion
+from core.handshake import HandshakeError, async_negotiate, build_socks5_greeting
+from core.httpparse import HttpParseError, async_read_head, parse_head
+
+DEFAULT_DETECT_TIMEOUT = 3     # 单次握手探测的超时 (秒)
+DETECT_ORDER = ('socks5', 'http', 'socks4')  # 一个端口同时支持多种协议时的优先顺序
+CANCEL_POLL_INTERVAL = 0.2
+
+
+async def _resolve_ipv4(hostname):
+    """在本地把目标解析为 IPv4 地址，供 SOCKS4 探测使用；无法解析时返回 None。"""
+    try:
+        socket.inet_aton(hostname)
+        return hostname
+    except (OSError, TypeError):
+        pass
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(hostname, None, family=socket.AF_INET,
+                                                             type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        return None
+    return infos[0][4][0] if infos else None
+
+
+async def _speaks(host, port, protocol, target_url, timeout, socks4_host=None) -> bool:
+    """
+    在新连接上做一次最小的握手，判断端口是否以 protocol 提供可用的代理服务。
+    SOCKS4 发往 socks4_host (本地解析出的目标 IPv4 地址)，不支持 SOCKS4a 扩展的服务端也能识别；未给出时才用域名。
+    """
+    async def _probe():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            if protocol == 'socks5':
+                # 方法协商即可区分 SOCKS5，只接受“无需认证”
+                writer.write(build_socks5_greeting())
+                reply = await reader.readexactly(2)
+                return reply == b"\x05\x00"
+            target = urlsplit(target_url)
+            target_port = target.port or (443 if target.scheme == 'https' else 80)
+            if protocol == 'socks4':
+                await async_negotiate(reader, writer, 'SOCKS4', socks4_host or target.hostname, target_port)
+                return True
+            if target.scheme == 'https':
+                await async_negotiate(reader, writer, 'HTTP', target.hostname, target_port)
+                return True
+            # 多数 HTTP 代理只允许 CONNECT 443，http 目标按普通代理转发一次 HEAD；非代理的 Web 服务一般返回 4xx
+            writer.write(f"HEAD {target_url} HTTP/1.1\r\nHost: {target.netloc}\r\nConnection: close\r\n\r\n".encode())
+            raw_head = await async_read_head(reader)
+            return raw_head is not None and parse_head(raw_head, is_request=False).status < 400
+        finally:
+            writer.close()
+
+    try:
+        return await asyncio.wait_for(_probe(), timeout)
+    except OSError as e:
+        raise_if_local_exhaustion(e)  # 本机资源耗尽时由调用方降低并发后重试
+        return False
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, HandshakeError, HttpParseError):
+        return False
+
+
+async def _detect(address, declared, target_url, timeout, socks4_host=None):
+    """先按声明的协议探测，都不符时同时尝试其余协议，返回实际协议或 None。"""
+    host, port_str = address.rsplit(':', 1)
+    port = int(port_str)
+    for protocol in declared:
+        if await _speaks(host, port, protocol, target_url, timeout, socks4_host):
+            return protocol
+    others = [p for p in DETECT_ORDER if p not in declared]
+    results = await asyncio.gather(*(_speaks(host, port, p, target_url, timeout, socks4_host) for p in others),
+                                   return_exceptions=True)
+    for error in results:
+        if isinstance(error, BaseException):
+            raise error
+    return next((p for p, ok in zip(others, results) if ok), None)
+
+
+async def async_detect_protocols(proxy_infos, target_url, timeout=DEFAULT_DETECT_TIMEOUT, concurrency=1000,
+                                 cancel_event=None, controller=None):
+    """detect_protocols 的 asyncio 版本，在当前事件循环中运行。"""
+    declared = {}  # 地址 -> 声明的协议 (保持首次出现的顺序)
+    for p in proxy_infos:
+        protocol = p['protocol'].lower()
+        protocol = 'http' if protocol == 'https' else protocol
+        protocols = declared.setdefault(p['proxy'], [])
+        if protocol in DETECT_ORDER and protocol not in protocols:
+            protocols.append(protocol)
+
+    detected = {}
+    pending = iter(declared.items())
+    gate = AsyncAdaptiveSemaphore(controller) if controller else None
+    socks4_host = await _resolve_ipv4(urlsplit(target_url).hostname)
+
+    async def _check(item):
+        return await _detect(item[0], item[1], target_url, timeout, socks4_host)
+
+    async def _worker():
+        for item in pending:
+            detected[item[0]] = await async_run_adaptive(gate, _check, item, lambda protocol: (protocol is not None, None))
+
+    done_all = asyncio.gather(*(_worker() for _ in range(max(1, min(concurrency, len(declared))))))
+    try:
+        while not done_all.done():
+            await asyncio.wait([done_all], timeout=CANCEL_POLL_INTERVAL)
+            if cancel_event and cancel_event.is_set():
+                break
+    finally:
+        if not done_all.done():
+            done_all.cancel()
+            await asyncio.gather(done_all, return_exceptions=True)
+    return [{'proxy': address, 'protocol': protocol} for address, protocol in detected.items() if protocol]
+
+
+def detect_protocols(proxy_infos, target_url, timeout=DEFAULT_DETECT_TIMEOUT, concurrency=1000, cancel_event=None,
+                     controller=None):
+    """
+    握手探测：对已通过 TCP 预检的 [{'proxy', 'protocol'}] 逐个地址发送 SOCKS5 方法协商、SOCKS4 CONNECT
+    (目标先在本地解析为 IPv4) 和 HTTP 代理请求 (目标为 target_url)，返回按实际协议改写后的列表；
+    同一地址只保留一项，不说任何代理协议的地址被丢弃。
+    以 concurrency 个协程并发，在调用线程中运行独立的事件循环；传入 controller 时实际并发由其按 AIMD 调整。
+    """
+    if not proxy_infos:
+        return []
+    return asyncio.run(async_detect_protocols(proxy_infos, target_url, timeout, concurrency, cancel_event, controller))
@@ -0,0 +1,191 @@
+# modules/failover.py
+
+import asyncio
+import threading
+import time
+from queue import Queue, Empty
+
+DEFAULT_FAILOVER_OPTIONS = {
+    'max_attempts': 3,    # 单个隧道最多尝试的上游数量 (含首选)
+    'deadline': 10,       # 建立隧道的总时限 (秒), 所有尝试共享
+    'hedge': False,       # 是否并发竞速多个上游
+    'hedge_count': 3,     # 同时在途的最大尝试数
+    'hedge_delay': 0.3,   # 首选未在该时间内完成时, 启动下一个候选 (秒)
+}
+
+
+def iter_candidates(rotator, per_request: bool, max_attempts: int):
+    """
+    按顺序生成候选上游，按地址去重，最多 max_attempts 个。
+    首选与正常流程一致（逐请求模式取下一个，否则取当前代理）；
+    备用候选在逐请求模式下继续轮换，在固定模式下取评分最高的代理，不改变当前代理。
+    """
+    seen = set()
+    first = rotator.get_next_proxy() if per_request else rotator.get_current_proxy()
+    if first and first.get('proxy'):
+        seen.add(first['proxy'])
+        yield first
+    if len(seen) >= max_attempts:
+        return
+
+    if per_request:
+        # 最多多转一圈，避免候选不足时无限循环
+        for _ in range(max_attempts * 2):
+            p = rotator.get_next_proxy()
+            if not p:
+                return
+            if p.get('proxy') and p['proxy'] not in seen:
+                seen.add(p['proxy'])
+                yield p
+                if len(seen) >= max_attempts:
+                    return
+    else:
+        for p in rotator.get_top_proxies(max_attempts + len(seen)):
+            if p.get('proxy') and p['proxy'] not in seen:
+                seen.add(p['proxy'])
+                yield p
+                if len(seen) >= max_attempts:
+                    return
+
+
+def connect_with_failover(candidates, connect_one, options):
+    """
+    依次（或竞速）尝试候选上游，返回 (proxy_info, socket, failures)。
+    connect_one(proxy_info, timeout) 成功时返回已建立隧道的 socket，失败时抛出异常；
+    failures 为 [(proxy_info, exception)]，全部失败时 proxy_info 和 socket 为 None。
+    竞速模式下落后完成的连接会在后台关闭。
+    """
+    deadline = time.monotonic() + options['deadline']
+    candidates = iter(candidates)
+    failures = []
+
+    if not options['hedge']:
+        for info in candidates:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                return info, connect_one(info, remaining), failures
+            except Exception as e:
+                failures.append((info, e))
+        return None, None, failures
+
+    results = Queue()
+    in_flight = 0
+    exhausted = False
+
+    def run(info, timeout):
+        try:
+            results.put((info, connect_one(info, timeout), None))
+        except Exception as e:
+            results.put((info, None, e))
+
+    def launch():
+        nonlocal in_flight, exhausted
+        info = next(candidates, None)
+        if info is None:
+            exhausted = True
+            return
+        in_flight += 1
+        threading.Thread(target=run, args=(info, deadline - time.monotonic()), daemon=True).start()
+
+    winner = (None, None)
+    launch()
+    while in_flight:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        can_hedge = not exhausted and in_flight < options['hedge_count']
+        try:
+            info, sock, error = results.get(timeout=min(remaining, options['hedge_delay']) if can_hedge else remaining)
+        except Empty:
+            if can_hedge:
+                launch()
+            continue
+        in_flight -= 1
+        if sock is not None:
+            winner = (info, sock)
+            break
+        failures.append((info, error))
+        if not exhausted:
+            launch()
+
+    if in_flight:
+        threading.Thread(target=_close_late_results, args=(results, in_flight), daemon=True).start()
+    return winner[0], winner[1], failures
+
+
+def _close_late_results(results, count):
+    """关闭竞速中落后完成的连接。"""
+    for _ in range(count):
+        _, sock, _ = results.get()
+        if sock is not None:
+            sock.close()
+
+
+async def async_connect_with_failover(candidates, connect_one, options):
+    """
+    connect_with_failover 的 asyncio 版本。
+    connect_one(proxy_info, timeout) 为协程，成功时返回 (reader, writer)。
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + options['deadline']
+    candidates = iter(candidates)
+    failures = []
+
+    if not options['hedge']:
+        for info in candidates:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                return info, await connect_one(info, remaining), failures
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures.append((info, e))
+        return None, None, failures
+
+    tasks = {}  # task -> proxy_info
+    exhausted = False
+
+    def launch():
+        nonlocal exhausted
+        info = next(candidates, None)
+        if info is None:
+            exhausted = True
+            return
+        tasks[asyncio.ensure_future(connect_one(info, deadline - loop.time()))] = info
+
+    winner = (None, None)
+    launch()
+    try:
+        while tasks:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            can_hedge = not exhausted and len(tasks) < options['hedge_count']
+            done, _ = await asyncio.wait(
+                tasks, timeout=min(remaining, options['hedge_delay']) if can_hedge else remaining,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                if can_hedge:
+                    launch()
+                continue
+            for task in done:
+                info = tasks.pop(task)
+                if task.exception() is None and winner[1] is None:
+                    winner = (info, task.result())
+                elif task.exception() is None:
+                    task.result()[1].close()
+                else:
+                    failures.append((info, task.exception()))
+            if winner[1] is not None:
+                break
+            if not exhausted:
+                launch()
+    finally:
+        for task in tasks:
+            task.cancel()
+    return winner[0], winner[1], failures
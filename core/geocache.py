@@ -0,0 +1,144 @@
+# modules/geocache.py
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+UNKNOWN_LOCATION = "未知"
+
+DEFAULT_LOCATION_CACHE_OPTIONS = {
+    'max_entries': 65536,     # 最多缓存的条目数，超出时淘汰最久未使用的
+    'ttl_hours': 168,         # 查询成功的结果保留时长 (小时)
+    'miss_ttl_minutes': 10,   # 查询失败 ("未知") 的结果保留时长 (分钟)，避免在线 API 故障时反复重试
+    'prefix_sharing': True,   # 同一 /24 网段的 IPv4 地址共用一条缓存
+    'path': '',               # 快照文件路径，为空时不持久化
+}
+
+
+class _Flight:
+    """一次进行中的查询，同一键的其他调用方等待其结果。"""
+    __slots__ = ('done', 'location')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.location = UNKNOWN_LOCATION
+
+
+class LocationCache:
+    """
+    线程安全的地理位置缓存：容量有上限 (LRU 淘汰)，条目按 TTL 过期。
+    同一键同时只有一个查询在进行 (single-flight)，并发请求同一地址的线程等待该次结果；
+    开启 prefix_sharing 时键为 IPv4 的 /24 网段。可保存到磁盘快照并在启动时重新载入，过期条目不载入。
+    """
+    def __init__(self, options=None):
+        self.options = dict(DEFAULT_LOCATION_CACHE_OPTIONS)
+        if options:
+            self.options.update(options)
+        self._entries = OrderedDict()  # 键 -> (地理位置, 过期时间戳)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if self.options['path']:
+            self.load()
+
+    def configure(self, options):
+        """更新参数；快照路径改变时载入新快照。"""
+        path = self.options['path']
+        with self._lock:
+            self.options.update(options)
+            self._evict()
+        if self.options['path'] and self.options['path'] != path:
+            self.load()
+
+    def _key(self, ip: str) -> str:
+        if self.options['prefix_sharing'] and ip.count('.') == 3:
+            return ip.rsplit('.', 1)[0] + '.0/24'
+        return ip
+
+    def _evict(self):
+        while len(self._entries) > self.options['max_entries']:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, ip):
+        return self.get(ip) is not None
+
+    def get(self, ip: str):
+        """返回未过期的缓存结果，没有时返回 None。"""
+        key = self._key(ip)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, ip: str, location: str):
+        ttl = (self.options['ttl_hours'] * 3600 if location != UNKNOWN_LOCATION
+               else self.options['miss_ttl_minutes'] * 60)
+        key = self._key(ip)
+        with self._lock:
+            self._entries[key] = (location, time.time() + ttl)
+            self._entries.move_to_end(key)
+            self._evict()
+            self._dirty = True
+
+    def get_or_load(self, ip: str, loader):
+        """返回缓存结果；未命中时调用 loader(ip) 查询并缓存，同一键的并发调用只查询一次。"""
+        location = self.get(ip)
+        if location is not None:
+            return location
+        key = self._key(ip)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            return flight.location
+        try:
+            flight.location = loader(ip) or UNKNOWN_LOCATION
+            self.put(ip, flight.location)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.location
+
+    # --- 持久化 ---
+    def load(self):
+        """从快照文件载入未过期的条目，文件不存在或损坏时忽略。"""
+        path = self.options['path']
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        entries = sorted(((k, v) for k, v in data.items()
+                          if isinstance(v, list) and len(v) == 2 and v[1] > now), key=lambda kv: kv[1][1])
+        with self._lock:
+            for key, (location, expires_at) in entries:
+                self._entries.setdefault(key, (location, expires_at))
+            self._evict()
+
+    def save(self):
+        """有新条目时把缓存写入快照文件 (先写临时文件再替换)。"""
+        path = self.options['path']
+        if not path or not self._dirty:
+            return
+        with self._lock:
+            data = {key: list(entry) for key, entry in self._entries.items()}
+            self._dirty = False
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
@@ -0,0 +1,161 @@
+# modules/geoip.py
+
+import csv
+import mmap
+import os
+import socket
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+try:
+    import maxminddb
+except ImportError:  # 未安装 maxminddb 时仅支持 CSV
+    maxminddb = None
+
+# 常见国家/地区代码 -> 英文名，便于沿用 COUNTRY_NAME_MAP 翻译为中文；其余代码原样返回
+COUNTRY_CODES = {
+    'CN': 'China', 'HK': 'Hong Kong', 'SG': 'Singapore', 'US': 'United States', 'JP': 'Japan',
+    'KR': 'South Korea', 'RU': 'Russia', 'DE': 'Germany', 'GB': 'United Kingdom', 'FR': 'France',
+    'CA': 'Canada', 'TW': 'Taiwan', 'NL': 'Netherlands', 'IN': 'India', 'VN': 'Vietnam', 'TH': 'Thailand',
+}
+
+_MAGIC = b'GEO1' + sys.byteorder[0].encode()  # 索引按本机字节序存放，换机器时重建
+_HEADER = struct.Struct('=5s3xII')            # 魔数, 区间数, 国家名表长度
+
+
+def _ip_to_int(value: str):
+    """十进制整数或 IPv4 点分形式 -> 整数；IPv6 等其他形式返回 None。"""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return number if number <= 0xFFFFFFFF else None
+    try:
+        return int.from_bytes(socket.inet_aton(value), 'big') if value.count('.') == 3 else None
+    except OSError:
+        return None
+
+
+def _read_csv(path):
+    """
+    读取 IP 区间 CSV，每行为 起始,结束,国家代码[,国家名]，起止可以是 IPv4 地址或整数
+    (兼容 DB-IP lite 与 IP2Location LITE DB1 格式)；有国家名列时优先使用国家名。返回按起始地址排序的行。
+    """
+    rows = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            start, end = _ip_to_int(row[0]), _ip_to_int(row[1])
+            if start is None or end is None or start > end:
+                continue  # 表头、IPv6 或无效行
+            country = (row[3] if len(row) > 3 and row[3].strip() not in ('', '-') else row[2]).strip()
+            if country and country != '-':
+                rows.append((start, end, country))
+    rows.sort()
+    return rows
+
+
+class GeoIPDatabase:
+    """
+    离线 IP 区间 -> 国家查询。
+    CSV 首次加载时编译为同目录下的 <文件名>.idx 二进制索引 (起始/结束地址 uint32 数组、国家编号 uint16 数组)，
+    之后以 mmap 映射该索引，启动时只解析国家名表；查询在起始地址数组上 bisect，耗时为微秒级。
+    .mmdb 文件在安装了 maxminddb 时直接以 mmap 模式打开。仅支持 IPv4。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._mmap = None
+        self._view = None
+        self._reader = None
+        if path.endswith('.mmdb'):
+            if maxminddb is None:
+                raise ImportError("读取 .mmdb 文件需要安装 maxminddb")
+            self._reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+            return
+        index_path = path + '.idx'
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(path):
+            starts, ends, codes, names = self._compile(path)
+            try:
+                self._write_index(index_path, starts, ends, codes, names)
+            except OSError:  # 目录不可写时直接使用内存中的数组
+                self._starts, self._ends, self._codes, self._names = starts, ends, codes, names
+                return
+        self._map_index(index_path)
+
+    def __len__(self):
+        return len(self._starts) if self._reader is None else 0
+
+    @staticmethod
+    def _compile(path):
+        starts, ends, codes = array('I'), array('I'), array('H')
+        names, name_codes = [], {}
+        for start, end, country in _read_csv(path):
+            code = name_codes.get(country)
+            if code is None:
+                code = name_codes[country] = len(names)
+                names.append(country)
+            starts.append(start)
+            ends.append(end)
+            codes.append(code)
+        return starts, ends, codes, names
+
+    @staticmethod
+    def _write_index(index_path, starts, ends, codes, names):
+        name_table = '\n'.join(names).encode('utf-8')
+        name_table += b'\0' * (-len(name_table) % 4)  # 保证后续 uint32 数组按 4 字节对齐
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(starts), len(name_table)))
+            f.write(name_table)
+            f.write(starts.tobytes())
+            f.write(ends.tobytes())
+            f.write(codes.tobytes())
+        os.replace(tmp_path, index_path)
+
+    def _map_index(self, index_path):
+        with open(index_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, names_size = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            self._mmap.close()
+            os.remove(index_path)  # 其他字节序或旧格式的索引，删除后重新编译
+            self.__init__(self.path)
+            return
+        view = self._view = memoryview(self._mmap)
+        offset = _HEADER.size
+        self._names = view[offset:offset + names_size].tobytes().rstrip(b'\0').decode('utf-8').split('\n')
+        offset += names_size
+        self._starts = view[offset:offset + count * 4].cast('I')
+        offset += count * 4
+        self._ends = view[offset:offset + count * 4].cast('I')
+        offset += count * 4
+        self._codes = view[offset:offset + count * 2].cast('H')
+
+    def lookup(self, ip: str):
+        """返回 IP 所属国家 (数据中的国家名，或国家代码对应的英文名)，未收录时返回 None。"""
+        if self._reader is not None:
+            try:
+                record = self._reader.get(ip)
+            except ValueError:
+                return None
+            names = (record or {}).get('country', {}).get('names', {})
+            return names.get('zh-CN') or names.get('en')
+        number = _ip_to_int(ip)
+        if number is None:
+            return None
+        i = bisect_right(self._starts, number) - 1
+        if i < 0 or self._ends[i] < number:
+            return None
+        country = self._names[self._codes[i]]
+        return COUNTRY_CODES.get(country, country)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+        if self._mmap is not None:
+            for view in (self._starts, self._ends, self._codes, self._view):
+                view.release()
+            self._mmap.close()
+            self._mmap = None
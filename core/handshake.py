@@ -0,0 +1,217 @@
+# modules/handshake.py
+
+import asyncio
+import socket
+import struct
+
+
+class HandshakeError(Exception):
+    """上游代理握手失败（协议不符、拒绝连接等）。"""
+
+
+def _is_ipv4(host: str) -> bool:
+    try:
+        socket.inet_aton(host)
+        return host.count('.') == 3
+    except OSError:
+        return False
+
+
+def build_socks5_greeting() -> bytes:
+    """SOCKS5 方法协商请求，仅声明“无需认证”。"""
+    return b"\x05\x01\x00"
+
+
+def build_socks5_connect(host: str, port: int) -> bytes:
+    """SOCKS5 CONNECT 请求，IPv4 直接发送地址，域名交由上游解析。"""
+    if _is_ipv4(host):
+        return b"\x05\x01\x00\x01" + socket.inet_aton(host) + struct.pack('!H', port)
+    host_bytes = host.encode('idna')
+    return b"\x05\x01\x00\x03" + bytes([len(host_bytes)]) + host_bytes + struct.pack('!H', port)
+
+
+def build_socks4_connect(host: str, port: int) -> bytes:
+    """SOCKS4 CONNECT 请求，域名使用 SOCKS4a 扩展交由上游解析。"""
+    if _is_ipv4(host):
+        return b"\x04\x01" + struct.pack('!H', port) + socket.inet_aton(host) + b"\x00"
+    return b"\x04\x01" + struct.pack('!H', port) + b"\x00\x00\x00\x01\x00" + host.encode('idna') + b"\x00"
+
+
+def build_http_connect(host: str, port: int) -> bytes:
+    """HTTP CONNECT 隧道请求。"""
+    return f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n".encode()
+
+
+def parse_http_connect_status(head: bytes) -> int:
+    """解析 CONNECT 响应头的状态码，格式不正确时抛出 HandshakeError。"""
+    try:
+        return int(head.split(b"\r\n", 1)[0].split()[1])
+    except (IndexError, ValueError):
+        raise HandshakeError("上游返回了无效的 HTTP 响应")
+
+
+# --- 阻塞 socket 版本 ---
+def _recv_exact(sock, count: int) -> bytes:
+    data = b""
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise HandshakeError("上游在握手期间关闭了连接")
+        data += chunk
+    return data
+
+
+def _recv_http_head(sock, limit: int = 65536) -> bytes:
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = sock.recv(1)  # 逐字节读取，避免吞掉隧道建立后的数据
+        if not chunk:
+            raise HandshakeError("上游在握手期间关闭了连接")
+        data += chunk
+        if len(data) > limit:
+            raise HandshakeError("上游 HTTP 响应头过长")
+    return data
+
+
+def socks5_greet(sock):
+    """完成 SOCKS5 方法协商。连接池可提前执行这一步，使隧道建立只剩 CONNECT 一个往返。"""
+    sock.sendall(build_socks5_greeting())
+    reply = _recv_exact(sock, 2)
+    if reply[0] != 5 or reply[1] != 0:
+        raise HandshakeError(f"SOCKS5 方法协商失败: {reply!r}")
+
+
+def _socks5_connect(sock, host, port, greeted=False):
+    if not greeted:
+        socks5_greet(sock)
+    sock.sendall(build_socks5_connect(host, port))
+    reply = _recv_exact(sock, 4)
+    if reply[0] != 5 or reply[1] != 0:
+        raise HandshakeError(f"SOCKS5 CONNECT 被拒绝, 代码: {reply[1]}")
+    atyp = reply[3]
+    if atyp == 1:
+        _recv_exact(sock, 4 + 2)
+    elif atyp == 3:
+        _recv_exact(sock, _recv_exact(sock, 1)[0] + 2)
+    elif atyp == 4:
+        _recv_exact(sock, 16 + 2)
+    else:
+        raise HandshakeError(f"SOCKS5 返回未知地址类型: {atyp}")
+
+
+def _socks4_connect(sock, host, port, greeted=False):
+    sock.sendall(build_socks4_connect(host, port))
+    reply = _recv_exact(sock, 8)
+    if reply[1] != 0x5A:
+        raise HandshakeError(f"SOCKS4 CONNECT 被拒绝, 代码: {reply[1]}")
+
+
+def _http_connect(sock, host, port, greeted=False):
+    sock.sendall(build_http_connect(host, port))
+    status = parse_http_connect_status(_recv_http_head(sock))
+    if status != 200:
+        raise HandshakeError(f"HTTP CONNECT 被拒绝, 状态码: {status}")
+
+
+NEGOTIATORS = {
+    'HTTP': _http_connect,
+    'SOCKS4': _socks4_connect,
+    'SOCKS5': _socks5_connect,
+}
+
+
+def negotiate(sock, protocol: str, target_host: str, target_port: int, greeted: bool = False):
+    """
+    在已连接到上游代理的阻塞 socket 上完成隧道协商。
+    greeted 表示 SOCKS5 方法协商已提前完成（来自连接池的预热连接）。
+    """
+    negotiator = NEGOTIATORS.get(protocol.upper())
+    if not negotiator:
+        raise HandshakeError(f"不支持的上游代理协议: {protocol}")
+    negotiator(sock, target_host, target_port, greeted)
+
+
+# --- asyncio 版本 ---
+async def _async_socks5_connect(reader, writer, host, port, greeted=False):
+    if not greeted:
+        writer.write(build_socks5_greeting())
+        await writer.drain()
+        reply = await reader.readexactly(2)
+        if reply[0] != 5 or reply[1] != 0:
+            raise HandshakeError(f"SOCKS5 方法协商失败: {reply!r}")
+    writer.write(build_socks5_connect(host, port))
+    await writer.drain()
+    reply = await reader.readexactly(4)
+    if reply[0] != 5 or reply[1] != 0:
+        raise HandshakeError(f"SOCKS5 CONNECT 被拒绝, 代码: {reply[1]}")
+    atyp = reply[3]
+    if atyp == 1:
+        await reader.readexactly(4 + 2)
+    elif atyp == 3:
+        length = (await reader.readexactly(1))[0]
+        await reader.readexactly(length + 2)
+    elif atyp == 4:
+        await reader.readexactly(16 + 2)
+    else:
+        raise HandshakeError(f"SOCKS5 返回未知地址类型: {atyp}")
+
+
+async def _async_socks4_connect(reader, writer, host, port, greeted=False):
+    writer.write(build_socks4_connect(host, port))
+    await writer.drain()
+    reply = await reader.readexactly(8)
+    if reply[1] != 0x5A:
+        raise HandshakeError(f"SOCKS4 CONNECT 被拒绝, 代码: {reply[1]}")
+
+
+async def _async_http_connect(reader, writer, host, port, greeted=False):
+    writer.write(build_http_connect(host, port))
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = parse_http_connect_status(head)
+    if status != 200:
+        raise HandshakeError(f"HTTP CONNECT 被拒绝, 状态码: {status}")
+
+
+ASYNC_NEGOTIATORS = {
+    'HTTP': _async_http_connect,
+    'SOCKS4': _async_socks4_connect,
+    'SOCKS5': _async_socks5_connect,
+}
+
+
+async def async_negotiate(reader, writer, protocol: str, target_host: str, target_port: int, greeted: bool = False):
+    """在已连接到上游代理的流上完成隧道协商，greeted 含义同 negotiate。"""
+    negotiator = ASYNC_NEGOTIATORS.get(protocol.upper())
+    if not negotiator:
+        raise HandshakeError(f"不支持的上游代理协议: {protocol}")
+    try:
+        await negotiator(reader, writer, target_host, target_port, greeted)
+    except asyncio.IncompleteReadError:
+        raise HandshakeError("上游在握手期间关闭了连接")
+
+
+async def async_open_tunnel(proxy_addr: str, protocol: str, target_host: str, target_port: int, timeout: float = 10,
+                            sock=None, greeted: bool = False):
+    """
+    以非阻塞方式连接上游代理并完成隧道协商，返回 (reader, writer)。
+    传入 sock 时复用这条已建立的 TCP 连接（如连接池中的预热连接），不再重新拨号。
+    连接、握手整体受 timeout 限制，失败时抛出 HandshakeError / OSError / asyncio.TimeoutError。
+    """
+    if protocol.upper() not in ASYNC_NEGOTIATORS:
+        raise HandshakeError(f"不支持的上游代理协议: {protocol}")
+    upstream_host, upstream_port_str = proxy_addr.rsplit(':', 1)
+
+    async def _dial():
+        if sock is not None:
+            reader, writer = await asyncio.open_connection(sock=sock)
+        else:
+            reader, writer = await asyncio.open_connection(upstream_host, int(upstream_port_str))
+        try:
+            await async_negotiate(reader, writer, protocol, target_host, target_port, greeted)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    return await asyncio.wait_for(_dial(), timeout)
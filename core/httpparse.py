@@ -0,0 +1,279 @@
+# modules/httpparse.py
+
+import asyncio
+from urllib.parse import urlsplit
+
+MAX_HEAD_SIZE = 65536
+HOP_BY_HOP_REQUEST_HEADERS = ('proxy-connection', 'proxy-authorization', 'keep-alive')
+
+
+class HttpParseError(Exception):
+    """HTTP 报文格式错误或超出限制。"""
+
+
+class HttpHead:
+    """已解析的 HTTP 请求头/响应头。"""
+    __slots__ = ('is_request', 'method', 'target', 'version', 'status', 'reason', 'headers')
+
+    def __init__(self, is_request, method=None, target=None, version='HTTP/1.1', status=None, reason='', headers=None):
+        self.is_request = is_request
+        self.method = method
+        self.target = target
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers or []  # [(name, value)], 保留原始顺序和大小写
+
+    def header(self, name, default=None):
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return default
+
+    def has_token(self, name, token) -> bool:
+        """逗号分隔的头部 (如 Connection) 是否包含指定标记，不区分大小写。"""
+        name, token = name.lower(), token.lower()
+        for key, value in self.headers:
+            if key.lower() == name and token in (t.strip().lower() for t in value.split(',')):
+                return True
+        return False
+
+    def remove_headers(self, *names):
+        names = {n.lower() for n in names}
+        self.headers = [(k, v) for k, v in self.headers if k.lower() not in names]
+
+    def keep_alive(self) -> bool:
+        """按 HTTP/1.0 与 HTTP/1.1 的默认语义判断连接是否可复用。"""
+        if self.has_token('Connection', 'close'):
+            return False
+        if self.version == 'HTTP/1.0':
+            return self.has_token('Connection', 'keep-alive') or self.has_token('Proxy-Connection', 'keep-alive')
+        return not self.has_token('Proxy-Connection', 'close')
+
+    def serialize(self) -> bytes:
+        if self.is_request:
+            lines = [f"{self.method} {self.target} {self.version}"]
+        else:
+            lines = [f"{self.version} {self.status} {self.reason}".rstrip()]
+        lines.extend(f"{k}: {v}" for k, v in self.headers)
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+
+def parse_head(raw: bytes, is_request: bool) -> HttpHead:
+    """解析以空行结尾的报文头。"""
+    try:
+        text = raw.decode('latin-1')
+    except UnicodeDecodeError:
+        raise HttpParseError("报文头编码无效")
+    lines = text.split("\r\n")
+    start = lines[0].split(' ', 2)
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        if line[0] in ' \t' and headers:  # 过时的折行格式
+            name, value = headers[-1]
+            headers[-1] = (name, value + ' ' + line.strip())
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise HttpParseError(f"无效的头部行: {line!r}")
+        headers.append((name.strip(), value.strip()))
+
+    if is_request:
+        if len(start) != 3 or not start[2].startswith('HTTP/'):
+            raise HttpParseError(f"无效的请求行: {lines[0]!r}")
+        return HttpHead(True, method=start[0].upper(), target=start[1], version=start[2], headers=headers)
+    if len(start) < 2 or not start[0].startswith('HTTP/') or not start[1].isdigit():
+        raise HttpParseError(f"无效的状态行: {lines[0]!r}")
+    return HttpHead(False, version=start[0], status=int(start[1]), reason=start[2] if len(start) > 2 else '',
+                    headers=headers)
+
+
+def body_framing(head: HttpHead, request_method: str = None):
+    """
+    返回报文体的分帧方式 (mode, length)：
+    'none' 无报文体；'length' 定长；'chunked' 分块；'close' 读到连接关闭为止（仅响应）。
+    """
+    if not head.is_request:
+        if request_method == 'HEAD' or 100 <= head.status < 200 or head.status in (204, 304):
+            return 'none', 0
+    transfer_encoding = head.header('Transfer-Encoding')
+    if transfer_encoding and transfer_encoding.split(',')[-1].strip().lower() == 'chunked':
+        return 'chunked', 0
+    content_length = head.header('Content-Length')
+    if content_length is not None:
+        try:
+            length = int(content_length.split(',')[0])
+        except ValueError:
+            raise HttpParseError(f"无效的 Content-Length: {content_length!r}")
+        return ('length', length) if length > 0 else ('none', 0)
+    return ('none', 0) if head.is_request else ('close', 0)
+
+
+def request_origin(head: HttpHead):
+    """
+    从请求中解析目标 (host, port)，并把绝对 URI 改写为 origin-form，
+    同时去掉只对本地代理有意义的逐跳头部。
+    """
+    if head.target.startswith('/'):
+        host_header = head.header('Host')
+        if not host_header:
+            raise HttpParseError("origin-form 请求缺少 Host 头")
+        parts = urlsplit(f"//{host_header}")
+        host, port = parts.hostname, parts.port or 80
+    else:
+        parts = urlsplit(head.target)
+        if not parts.hostname:
+            raise HttpParseError(f"无法解析请求目标: {head.target!r}")
+        host, port = parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+        head.target = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        if head.header('Host') is None:
+            head.headers.insert(0, ('Host', parts.netloc))
+    head.remove_headers(*HOP_BY_HOP_REQUEST_HEADERS)
+    return host, port
+
+
+class SocketReader:
+    """带缓冲的阻塞 socket 读取器，提供与 asyncio.StreamReader 相近的接口。"""
+    def __init__(self, sock, recv_size=65536):
+        self.sock = sock
+        self._buffer = bytearray()
+        self._recv_size = recv_size
+
+    def _fill(self) -> bool:
+        data = self.sock.recv(self._recv_size)
+        if not data:
+            return False
+        self._buffer += data
+        return True
+
+    def read_head(self, limit=MAX_HEAD_SIZE):
+        """读取一个完整报文头；连接在任何字节到达前关闭时返回 None。"""
+        while True:
+            end = self._buffer.find(b"\r\n\r\n")
+            if end >= 0:
+                head = bytes(self._buffer[:end + 4])
+                del self._buffer[:end + 4]
+                return head
+            if len(self._buffer) > limit:
+                raise HttpParseError("报文头过长")
+            if not self._fill():
+                if self._buffer:
+                    raise HttpParseError("报文头不完整")
+                return None
+
+    def readline(self, limit=MAX_HEAD_SIZE) -> bytes:
+        while True:
+            end = self._buffer.find(b"\n")
+            if end >= 0:
+                line = bytes(self._buffer[:end + 1])
+                del self._buffer[:end + 1]
+                return line
+            if len(self._buffer) > limit:
+                raise HttpParseError("行过长")
+            if not self._fill():
+                raise HttpParseError("连接在报文中途关闭")
+
+    def read(self, max_bytes) -> bytes:
+        """返回至多 max_bytes 字节，缓冲区为空时读一次 socket；EOF 返回 b''。"""
+        if not self._buffer and not self._fill():
+            return b""
+        data = bytes(self._buffer[:max_bytes])
+        del self._buffer[:max_bytes]
+        return data
+
+    def take_buffered(self) -> bytes:
+        """取出缓冲区中尚未消费的全部字节（切换到原始转发时使用）。"""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def forward_body(reader: SocketReader, dst_sock, mode: str, length: int = 0, chunk_size: int = 65536):
+    """按分帧方式把报文体从 reader 原样转发到 dst_sock。"""
+    if mode == 'length':
+        remaining = length
+        while remaining > 0:
+            data = reader.read(min(remaining, chunk_size))
+            if not data:
+                raise HttpParseError("连接在报文体中途关闭")
+            dst_sock.sendall(data)
+            remaining -= len(data)
+    elif mode == 'chunked':
+        while True:
+            line = reader.readline()
+            dst_sock.sendall(line)
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise HttpParseError(f"无效的分块长度: {line!r}")
+            if size == 0:
+                # 转发 trailer 直到空行
+                while True:
+                    line = reader.readline()
+                    dst_sock.sendall(line)
+                    if line in (b"\r\n", b"\n"):
+                        return
+            forward_body(reader, dst_sock, 'length', size + 2, chunk_size)  # 数据 + CRLF
+    elif mode == 'close':
+        while True:
+            data = reader.read(chunk_size)
+            if not data:
+                return
+            dst_sock.sendall(data)
+
+
+async def async_read_head(reader, limit=MAX_HEAD_SIZE):
+    """asyncio 版 read_head：连接在任何字节到达前关闭时返回 None。"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise HttpParseError("报文头不完整")
+        return None
+    except asyncio.LimitOverrunError:
+        raise HttpParseError("报文头过长")
+    if len(head) > limit:
+        raise HttpParseError("报文头过长")
+    return head
+
+
+async def async_forward_body(reader, writer, mode: str, length: int = 0, chunk_size: int = 65536):
+    """asyncio 版 forward_body。"""
+    try:
+        if mode == 'length':
+            remaining = length
+            while remaining > 0:
+                data = await reader.read(min(remaining, chunk_size))
+                if not data:
+                    raise HttpParseError("连接在报文体中途关闭")
+                writer.write(data)
+                await writer.drain()
+                remaining -= len(data)
+        elif mode == 'chunked':
+            while True:
+                line = await reader.readuntil(b"\n")
+                writer.write(line)
+                try:
+                    size = int(line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise HttpParseError(f"无效的分块长度: {line!r}")
+                if size == 0:
+                    while True:
+                        line = await reader.readuntil(b"\n")
+                        writer.write(line)
+                        if line in (b"\r\n", b"\n"):
+                            await writer.drain()
+                            return
+                await async_forward_body(reader, writer, 'length', size + 2, chunk_size)
+        elif mode == 'close':
+            while True:
+                data = await reader.read(chunk_size)
+                if not data:
+                    return
+                writer.write(data)
+                await writer.drain()
+    except asyncio.IncompleteReadError:
+        raise HttpParseError("连接在报文体中途关闭")
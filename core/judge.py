@@ -0,0 +1,196 @@
+# modules/judge.py
+
+import asyncio
+import itertools
+import json
+import threading
+from urllib.parse import urlsplit
+
+from core.httpparse import HttpParseError, async_read_head, body_framing, parse_head
+
+DEFAULT_JUDGE_OPTIONS = {
+    'enabled': False,
+    'host': '0.0.0.0',
+    'port': 8899,
+    'max_payload': 10 * 1024 * 1024,  # /bytes/<n> 单次最多返回的字节数
+    'idle_timeout': 30,               # keep-alive 连接的空闲超时 (秒)
+}
+
+ECHO_PATH = '/get?show_env=1'       # 回显来源 IP 与请求头，格式兼容 httpbin
+PAYLOAD_PATH = '/bytes/262144'      # 测速负载，与默认的测速字节上限相同
+ROOT_PAYLOAD_SIZE = 16 * 1024       # 根路径返回的负载大小，供延迟检测
+MAX_REQUEST_BODY = 65536
+_ZEROS = bytes(65536)
+
+
+def judge_targets(base_url: str) -> dict:
+    """由评判服务的根地址 (如 http://1.2.3.4:8899) 生成与 validation_targets 相同结构的验证目标。"""
+    base = base_url.rstrip('/')
+    return {
+        'latency_check': base + '/',
+        'anonymity_check': base + ECHO_PATH,
+        'speed_check': base + PAYLOAD_PATH,
+    }
+
+
+class JudgePool:
+    """在多个评判服务之间轮流分配验证目标，同一代理的各项探测使用同一个评判服务。"""
+    def __init__(self, judges):
+        self._targets = [judge_targets(j) for j in judges]
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._targets)
+
+    def next_targets(self) -> dict:
+        return self._targets[next(self._counter) % len(self._targets)]
+
+
+def _canonical(name: str) -> str:
+    """把头部名称规范为 httpbin 的首字母大写形式 (x-forwarded-for -> X-Forwarded-For)。"""
+    return '-'.join(part.capitalize() for part in name.split('-'))
+
+
+class JudgeServer:
+    """
+    内置的轻量评判服务，替代 httpbin / baidu / cachefly 等第三方站点，避免高并发验证时被限流。
+    GET/HEAD /get: 以 JSON 回显来源 IP ('origin') 与请求头 ('headers')，与 httpbin 的 show_env 格式一致；
+    GET/HEAD /bytes/<n>: 返回 n 个字节 (不超过 max_payload)，用于测速；
+    其他路径返回 ROOT_PAYLOAD_SIZE 字节，用于延迟检测。
+    接受 origin-form 与绝对 URI 两种请求目标 (后者来自按普通代理转发的 HTTP 上游)，支持 keep-alive。
+    事件循环运行在独立线程中，start / stop 的用法与 AsyncProxyServer 相同。
+    """
+    def __init__(self, host, port, log_queue, options=None):
+        self.options = dict(DEFAULT_JUDGE_OPTIONS)
+        if options:
+            self.options.update(options)
+        self._host = host
+        self._port = port
+        self._log_queue = log_queue
+        self._running = False
+        self._loop = None
+        self._thread = None
+        self._stop_event = None
+        self._started = threading.Event()
+        self.port = None  # 实际监听的端口 (port 为 0 时由系统分配)
+
+    def log(self, message):
+        self._log_queue.put(f"[Judge] {message}")
+
+    def start(self):
+        """在独立线程中启动评判服务，监听成功 (或失败) 后返回。"""
+        if self._running:
+            return
+        self._running = True
+        self._started.clear()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        if self._loop and self._stop_event:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        self.log("评判服务已停止。")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._started.set()
+            self._loop.close()
+
+    async def _serve(self):
+        self._stop_event = asyncio.Event()
+        tasks = set()
+
+        async def handler(reader, writer):
+            task = asyncio.current_task()
+            tasks.add(task)
+            try:
+                await self._handle_client(reader, writer)
+            except asyncio.CancelledError:
+                pass  # 停止服务时取消空闲的 keep-alive 连接，不向 asyncio 报告为异常
+            finally:
+                tasks.discard(task)
+                writer.close()
+
+        try:
+            server = await asyncio.start_server(handler, self._host, self._port, reuse_address=True, backlog=1024)
+        except Exception as e:
+            self.log(f"[!] 启动评判服务失败: {e}")
+            self._running = False
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        self.log(f"评判服务已启动于 {self._host}:{self.port}")
+        self._started.set()
+
+        await self._stop_event.wait()
+        server.close()
+        await server.wait_closed()
+        for task in list(tasks):
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle_client(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        peer_ip = peer[0] if peer else ''
+        try:
+            while True:
+                raw_head = await asyncio.wait_for(async_read_head(reader), self.options['idle_timeout'])
+                if raw_head is None:
+                    return
+                head = parse_head(raw_head, is_request=True)
+                mode, length = body_framing(head)
+                if mode == 'chunked' or length > MAX_REQUEST_BODY:
+                    raise HttpParseError("评判服务不接受请求体")
+                if length:
+                    await reader.readexactly(length)
+                keep_alive = head.keep_alive()
+                await self._respond(writer, head, peer_ip, keep_alive)
+                if not keep_alive:
+                    return
+        except (HttpParseError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return
+
+    async def _respond(self, writer, head, peer_ip, keep_alive):
+        parts = urlsplit(head.target)
+        path = parts.path or '/'
+        if path == '/get':
+            headers = {}
+            for name, value in head.headers:
+                name = _canonical(name)
+                headers[name] = f"{headers[name]}, {value}" if name in headers else value
+            forwarded = headers.get('X-Forwarded-For')
+            body = json.dumps({
+                'args': {}, 'headers': headers,
+                'origin': f"{forwarded}, {peer_ip}" if forwarded else peer_ip,
+                'url': head.target,
+            }).encode()
+            content_type, size = 'application/json', len(body)
+        elif path.startswith('/bytes/') and path[len('/bytes/'):].isdigit():
+            body, content_type = None, 'application/octet-stream'
+            size = min(int(path[len('/bytes/'):]), self.options['max_payload'])
+        else:
+            body, content_type, size = None, 'application/octet-stream', ROOT_PAYLOAD_SIZE
+
+        writer.write((f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {size}\r\n"
+                      f"Cache-Control: no-store\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode())
+        if head.method != 'HEAD':
+            if body is not None:
+                writer.write(body)
+            else:
+                remaining = size
+                while remaining > 0:
+                    chunk = _ZEROS[:min(remaining, len(_ZEROS))]
+                    writer.write(chunk)
+                    await writer.drain()
+                    remaining -= len(chunk)
+        await writer.drain()
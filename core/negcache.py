@@ -0,0 +1,128 @@
+# modules/negcache.py
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from core.records import PROTOCOLS
+
+DEFAULT_NEGATIVE_CACHE_OPTIONS = {
+    'enabled': True,
+    'base_ttl_minutes': 30,     # 首次失败后跳过的时长 (分钟)
+    'backoff_factor': 2,        # 每多失败一次，跳过时长乘以该系数
+    'max_ttl_hours': 24,        # 跳过时长上限 (小时)；过期超过该时长仍未再失败的条目连同失败次数一起遗忘
+    'max_entries': 200000,      # 最多保存的条目数，超出时淘汰最久未失败的
+    'path': '',                 # 快照文件路径，为空时不持久化
+}
+
+ANY_PROTOCOL = '*'   # 端口不可连通或不说任何代理协议：该地址的所有协议都跳过
+
+
+class NegativeCache:
+    """
+    近期失效候选的缓存，键为 'ip:port|协议'：TCP 预检或握手探测失败记在 ANY_PROTOCOL 下，完整验证失败记在具体协议下。
+    每个条目记录连续失败次数，跳过时长按 base_ttl_minutes * backoff_factor^(次数-1) 指数增长，不超过 max_ttl_hours；
+    验证通过时清除该地址的全部条目。过期条目保留失败次数，再次失败时继续增长，长期未再失败后才遗忘。
+    线程安全；可保存到磁盘快照并在启动时重新载入。
+    """
+    def __init__(self, options=None):
+        self.options = dict(DEFAULT_NEGATIVE_CACHE_OPTIONS)
+        if options:
+            self.options.update(options)
+        self._entries = OrderedDict()  # 键 -> [失败次数, 跳过截止时间戳]
+        self._lock = threading.Lock()
+        self._dirty = False
+        if self.options['path']:
+            self.load()
+
+    def configure(self, options):
+        """更新参数；快照路径改变时载入新快照。"""
+        path = self.options['path']
+        with self._lock:
+            self.options.update(options)
+            self._evict()
+        if self.options['path'] and self.options['path'] != path:
+            self.load()
+
+    @staticmethod
+    def _key(address: str, protocol: str) -> str:
+        return f"{address}|{protocol.upper()}"
+
+    def _evict(self):
+        while len(self._entries) > self.options['max_entries']:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def blocked(self, address: str, protocol: str = ANY_PROTOCOL) -> bool:
+        """该地址 (按 protocol) 是否仍在跳过期内。未启用时总是返回 False。"""
+        if not self.options['enabled']:
+            return False
+        now = time.time()
+        entries = self._entries
+        for key in {self._key(address, ANY_PROTOCOL), self._key(address, protocol)}:
+            entry = entries.get(key)
+            if entry is not None and entry[1] > now:
+                return True
+        return False
+
+    def record_failure(self, address: str, protocol: str = ANY_PROTOCOL):
+        """记录一次失败，返回新的跳过时长 (秒)；未启用时不记录。"""
+        options = self.options
+        if not options['enabled']:
+            return 0
+        key = self._key(address, protocol)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            failures = entry[0] + 1 if entry else 1
+            ttl = min(options['base_ttl_minutes'] * 60 * options['backoff_factor'] ** (failures - 1),
+                      options['max_ttl_hours'] * 3600)
+            self._entries[key] = [failures, time.time() + ttl]
+            self._evict()
+            self._dirty = True
+        return ttl
+
+    def forget(self, address: str):
+        """验证通过：清除该地址的全部条目。"""
+        with self._lock:
+            for protocol in (ANY_PROTOCOL,) + PROTOCOLS:
+                if self._entries.pop(self._key(address, protocol), None) is not None:
+                    self._dirty = True
+
+    # --- 持久化 ---
+    def _forgotten(self, entry, now) -> bool:
+        return entry[1] + self.options['max_ttl_hours'] * 3600 <= now
+
+    def load(self):
+        """从快照文件载入仍需记住的条目，文件不存在或损坏时忽略。"""
+        path = self.options['path']
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        entries = sorted(((k, v) for k, v in data.items()
+                          if isinstance(v, list) and len(v) == 2 and not self._forgotten(v, now)),
+                         key=lambda kv: kv[1][1])
+        with self._lock:
+            for key, entry in entries:
+                self._entries.setdefault(key, entry)
+            self._evict()
+
+    def save(self):
+        """有改动时把缓存写入快照文件 (先写临时文件再替换)，长期未再失败的条目不写入。"""
+        path = self.options['path']
+        if not path or not self._dirty:
+            return
+        now = time.time()
+        with self._lock:
+            data = {key: entry for key, entry in self._entries.items() if not self._forgotten(entry, now)}
+            self._dirty = False
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,317 @@
+# modules/pipeline.py
+
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from queue import Empty, Full, PriorityQueue
+
+from core.async_checker import AsyncProxyChecker
+from core.concurrency import AdaptiveSemaphore, LocalExhaustionError, log_levels, make_controller, run_adaptive
+from core.detect import detect_protocols
+from core.precheck import pre_check
+
+DEFAULT_QUEUE_SIZE = 10000   # 各阶段之间队列的容量，满时上游阻塞
+DEFAULT_FETCH_WORKERS = 50   # 同时抓取的源数，源的数量通常小于此值，即每个源各占一个线程
+DEFAULT_DEADLINE_GRACE = 5   # 时间预算用完后，进行中的检查最多再等待的秒数
+CANCEL_POLL_INTERVAL = 0.2
+_DONE = object()             # 阶段结束标记
+_LAST = float('inf')         # 结束标记的优先级，排在所有候选之后
+_KNOWN_PRIOR = 0.5           # 池中已有代理的预期可用率下限，另按评分加至 1
+
+
+class RefreshPipeline:
+    """
+    流水线式刷新：抓取 → 去重 → TCP 预检 → 握手探测 (可选) → 完整验证 → 发布到轮换器。
+    每个源一返回，其代理就进入下游；阶段之间是有界队列，下游跟不上时上游阻塞 (背压)。
+    验证通过的代理立即写入轮换器，刷新期间原有代理继续提供服务，
+    刷新正常结束后才移除本轮没有通过验证的旧代理；被取消或出错时保留旧代理。
+    manager.negative_cache 中近期失效的候选在预检前跳过；预检、握手探测或完整验证失败的候选记入其中，验证通过的从中清除。
+    options['adaptive'] 启用时，预检、握手探测与完整验证各有一个 AIMD 并发控制器，在整轮刷新中持续调整。
+    阶段之间是优先队列，按预期价值排序：候选的预期可用率取给出它的源的历史产出率 (manager.source_stats)
+    与其在池中已有记录的评分中的较高者，预检通过后再按连接耗时折减，价值高的先预检、先验证；
+    每个候选记录所有给出它的源，刷新正常结束后为每个源记录本轮的抓取、去重、预检通过、验证通过数与延迟中位数。
+    deadline (秒，默认取 options['deadline_seconds']，0 为不限) 为整轮的时间预算：到期后停止抓取与派发新的检查，
+    进行中的检查最多再等 options['deadline_grace_seconds'] 秒，之后中断。已验证通过的代理保留，
+    与被取消时一样不移除旧代理、不记录源的产出。
+    """
+    def __init__(self, manager, log_queue, options, validation_mode='online', cancel_event=None, deadline=None):
+        self._manager = manager          # ProxyManager: 提供源、验证方法与轮换器写入接口
+        self._log_queue = log_queue
+        self._options = options          # 即 ProxyManager.validation_options
+        self._validation_mode = validation_mode
+        self._cancel_event = cancel_event
+        queue_size = options.get('queue_size', DEFAULT_QUEUE_SIZE)
+        self._candidates = PriorityQueue(queue_size)  # 元素为 (优先级, 序号, 候选)，优先级为预期价值的相反数
+        self._survivors = PriorityQueue(queue_size)
+        self._seq = itertools.count()
+        self._rank = {}                    # 地址 -> 优先级 (预期价值取负)
+        self._source_runs = {}             # 源名 -> {'fetched', 'unique', 'addresses'}
+        self._alive = set()                # 本轮预检通过的地址
+        self._latencies = {}               # 本轮验证通过的地址 -> 延迟
+        self._stopped = threading.Event()  # 某个阶段出错时通知其余阶段停止
+        # 两级停止信号，由 _watch 根据取消、出错与时间预算设置：先停止派发新的检查，再中断进行中的检查
+        self._stop_dispatch = threading.Event()
+        self._abort = threading.Event()
+        self._budget = options.get('deadline_seconds', 0) if deadline is None else deadline
+        self.expired = False               # 是否因时间预算用完而提前结束
+        self._lock = threading.Lock()
+        self._refreshed = set()            # 本轮验证通过的地址
+        self._unchecked = set()            # 因本机资源耗尽未能预检的地址，不记为失效，池中的旧记录也保留
+        self.stats = {'fetched': 0, 'unique': 0, 'skipped': 0, 'reachable': 0, 'detected': 0, 'working': 0}
+        adaptive = options['adaptive']
+        self._precheck_controller = make_controller(options['precheck_concurrency'], adaptive, "TCP预检", log_queue)
+        self._detect_controller = (make_controller(options['concurrency'], adaptive, "握手探测", log_queue, 3)
+                                   if options['detect_protocol'] else None)
+        self._validate_controller = None
+        self._gate = None
+
+    def _cancelled(self) -> bool:
+        return (self._stop_dispatch.is_set() or self._stopped.is_set()
+                or bool(self._cancel_event and self._cancel_event.is_set()))
+
+    def _watch(self, finished, deadline):
+        """把用户取消、阶段出错与时间预算换算为 _stop_dispatch / _abort，直到 finished 被设置。"""
+        grace = self._options.get('deadline_grace_seconds', DEFAULT_DEADLINE_GRACE)
+        while not finished.wait(CANCEL_POLL_INTERVAL):
+            if self._stopped.is_set() or (self._cancel_event and self._cancel_event.is_set()):
+                self._stop_dispatch.set()
+                self._abort.set()
+            elif deadline is not None and time.monotonic() >= deadline:
+                if not self._stop_dispatch.is_set():
+                    self.expired = True
+                    self._stop_dispatch.set()
+                    self._log_queue.put(f"[Manager] 刷新时间预算 {self._budget} 秒已用完，停止派发新的检查。")
+                if time.monotonic() >= deadline + grace:
+                    self._abort.set()
+
+    def _entry(self, item):
+        priority = _LAST if item is _DONE else self._rank.get(item['proxy'], 0.0)
+        return priority, next(self._seq), item
+
+    def _put(self, queue, item) -> bool:
+        """放入下游队列，队列满时等待；被取消时放弃并返回 False。"""
+        entry = self._entry(item)
+        while not self._cancelled():
+            try:
+                queue.put(entry, timeout=CANCEL_POLL_INTERVAL)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _get(self, queue):
+        """从上游队列取出优先级最高的一项，被取消时返回 _DONE。"""
+        while not self._cancelled():
+            try:
+                return queue.get(timeout=CANCEL_POLL_INTERVAL)[2]
+            except Empty:
+                continue
+        return _DONE
+
+    def _run_stage(self, stage, downstream):
+        """在线程中运行一个阶段；无论正常结束还是出错，都向下游发送结束标记。"""
+        try:
+            stage()
+        except Exception as e:
+            self._log_queue.put(f"[!] 刷新流水线出错: {e}")
+            self._stopped.set()
+        finally:
+            self._put(downstream, _DONE)
+
+    # --- 各阶段 ---
+    def _fetch_stage(self):
+        seen = set()
+        negative_cache, source_stats = self._manager.negative_cache, self._manager.source_stats
+        for protocol, proxies, source in self._manager.iter_fetched_proxies(self._log_queue, self._stop_dispatch):
+            self.stats['fetched'] += len(proxies)
+            run = self._source_runs.setdefault(source, {'fetched': 0, 'unique': 0, 'addresses': set()})
+            run['fetched'] += len(proxies)
+            run['addresses'].update(proxies)
+            rank = -source_stats.yield_rate(source)
+            for proxy in proxies:
+                if rank < self._rank.get(proxy, 0.0):
+                    self._rank[proxy] = rank
+                if (proxy, protocol) in seen:
+                    continue
+                seen.add((proxy, protocol))
+                self.stats['unique'] += 1
+                run['unique'] += 1
+                if negative_cache.blocked(proxy, protocol):
+                    self.stats['skipped'] += 1
+                    continue
+                if not self._put(self._candidates, {'proxy': proxy, 'protocol': protocol}):
+                    return
+
+    def _precheck_stage(self):
+        options = self._options
+        negative_cache = self._manager.negative_cache
+        known = {}  # 地址 -> 是否可连通，同一地址的其他协议不再重复预检
+        probed = set()  # 已做过握手探测的地址，同一地址只按实际协议验证一次
+        finished = False
+        while not finished:
+            item = self._get(self._candidates)
+            if item is _DONE:
+                return
+            # 源通常一次返回一批，把已在队列中的候选一并取出批量预检
+            batch = [item]
+            while len(batch) < options['precheck_concurrency']:
+                try:
+                    item = self._candidates.get_nowait()[2]
+                except Empty:
+                    break
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+            unknown = [p for p in batch if p['proxy'] not in known]
+            rtts = {}
+            try:
+                reachable = {p['proxy'] for p in pre_check(unknown, options['precheck_timeout'],
+                                                           options['precheck_concurrency'], self._stop_dispatch,
+                                                           self._precheck_controller, rtts)}
+            except LocalExhaustionError as e:
+                self._log_queue.put(f"[!] 本机资源耗尽，跳过 {len(unknown)} 个候选的预检 (不记为失效): {e}")
+                self._unchecked.update(p['proxy'] for p in unknown)
+                continue
+            if self._cancelled():
+                return  # 预检被中断时结果不完整，不能据此记录失败
+            known.update((p['proxy'], p['proxy'] in reachable) for p in unknown)
+            self._alive.update(reachable)
+            for address, rtt in rtts.items():  # 连接越慢，完整验证越慢、评分越低，预期价值按连接耗时折减
+                self._rank[address] = self._rank.get(address, 0.0) / (1 + rtt / options['precheck_timeout'])
+            for address in {p['proxy'] for p in unknown} - reachable:
+                negative_cache.record_failure(address)
+            survivors = [p for p in batch if known[p['proxy']]]
+            self.stats['reachable'] += len(survivors)
+            if options['detect_protocol']:
+                survivors = [p for p in survivors if p['proxy'] not in probed]
+                probed.update(p['proxy'] for p in survivors)
+                open_ports = {p['proxy'] for p in survivors}
+                survivors = detect_protocols(survivors, self._manager.next_validation_targets()['anonymity_check'],
+                                             options['detect_timeout'], options['concurrency'], self._stop_dispatch,
+                                             self._detect_controller)
+                if self._cancelled():
+                    return
+                for address in open_ports - {p['proxy'] for p in survivors}:
+                    negative_cache.record_failure(address)  # 端口开放但不说任何代理协议
+                survivors = [p for p in survivors if not negative_cache.blocked(p['proxy'], p['protocol'])]
+                self.stats['detected'] += len(survivors)
+            for proxy_info in survivors:
+                if not self._put(self._survivors, proxy_info):
+                    return
+
+    def _iter_survivors(self):
+        while True:
+            item = self._get(self._survivors)
+            if item is _DONE:
+                return
+            yield item
+
+    def _validate_worker(self):
+        manager, options = self._manager, self._options
+        while True:
+            item = self._get(self._survivors)
+            if item is _DONE:
+                if not self._cancelled():
+                    self._survivors.put(self._entry(_DONE))  # 传给其余工作线程；刚取出一项，队列必有空位
+                return
+            result = run_adaptive(self._gate, lambda p: manager._full_check_proxy(p, self._validation_mode, self._abort,
+                                                                                 self._log_queue, options['probe']),
+                                  item, self._stop_dispatch)
+            if result and not self._abort.is_set():
+                self._on_result(result)
+
+    def _validate_stage(self):
+        options = self._options
+        if options['engine'] == 'asyncio':
+            checker = AsyncProxyChecker(self._manager, options['concurrency'], options['precheck_timeout'],
+                                        options['precheck_concurrency'], options['probe'], adaptive=options['adaptive'])
+            try:
+                checker.validate_stream(self._iter_survivors(), self._on_result, self._log_queue,
+                                        self._validation_mode, self._abort)
+            finally:
+                self._validate_controller = checker.controller
+            return
+        self._validate_controller = make_controller(options['max_workers'], options['adaptive'], "完整验证",
+                                                    self._log_queue, 2)
+        self._gate = AdaptiveSemaphore(self._validate_controller) if self._validate_controller else None
+        executor = ThreadPoolExecutor(max_workers=options['max_workers'])
+        try:
+            pending = {executor.submit(self._validate_worker) for _ in range(options['max_workers'])}
+            while pending and not self._abort.is_set():
+                _, pending = wait(pending, timeout=CANCEL_POLL_INTERVAL)
+        finally:
+            # 被中断时不等待仍阻塞在请求中的工作线程，它们之后返回的结果会被丢弃
+            executor.shutdown(wait=not self._abort.is_set())
+
+    def _on_result(self, result):
+        """记录完整验证的结果：通过的从失效缓存中清除并发布，失败的记入失效缓存。"""
+        if result['status'] == 'Working':
+            self._manager.negative_cache.forget(result['proxy'])
+            self._publish(result)
+        else:
+            self._manager.negative_cache.record_failure(result['proxy'], result['protocol'])
+
+    def _publish(self, result):
+        """验证通过的代理立即写入轮换器：已存在的更新其记录，否则新增。"""
+        if result['status'] != 'Working':
+            return
+        manager = self._manager
+        if not manager.update_proxy(result['proxy'], result):
+            manager.add_proxy(result)
+        with self._lock:
+            self._refreshed.add(result['proxy'])
+            self._latencies[result['proxy']] = result['latency']
+            self.stats['working'] += 1
+
+    def _record_sources(self):
+        """把本轮各源的产出写入 manager.source_stats，记录因长期无产出而被停用的源。"""
+        source_stats = self._manager.source_stats
+        for source, run in self._source_runs.items():
+            addresses = run['addresses']
+            working = addresses & self._latencies.keys()
+            if source_stats.record_run(source, run['fetched'], run['unique'], len(addresses & self._alive), len(working),
+                                       [self._latencies[a] for a in working]):
+                self._log_queue.put(f"[Manager] 源 {source} 连续多轮没有产出可用代理，暂时停用。")
+
+    def run(self) -> int:
+        """阻塞执行一轮刷新，返回验证通过的代理数。"""
+        previous = self._manager.all_proxies
+        stale = {p['proxy'] for p in previous}
+        for record in previous:
+            self._rank[record['proxy']] = -(_KNOWN_PRIOR + (1 - _KNOWN_PRIOR) * min(record.get('score', 0), 100) / 100)
+        finished = threading.Event()
+        deadline = time.monotonic() + self._budget if self._budget else None
+        stages = [
+            threading.Thread(target=self._watch, args=(finished, deadline), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._fetch_stage, self._candidates), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._precheck_stage, self._survivors), daemon=True),
+        ]
+        for thread in stages:
+            thread.start()
+        try:
+            self._validate_stage()
+        except Exception as e:
+            self._log_queue.put(f"[!] 刷新流水线出错: {e}")
+            self._stopped.set()
+        finished.set()
+        for thread in stages:
+            thread.join()
+
+        stats = self.stats
+        self._log_queue.put(f"[Manager] 抓取 {stats['fetched']} 个，去重后 {stats['unique']} 个，跳过近期失效 {stats['skipped']} 个，"
+                            f"预检通过 {stats['reachable']} 个，握手探测通过 {stats['detected']} 个，"
+                            f"验证通过 {stats['working']} 个。")
+        log_levels(self._log_queue, self._precheck_controller, self._detect_controller, self._validate_controller)
+        if self.expired and not (self._cancel_event and self._cancel_event.is_set()):
+            self._log_queue.put(f"[Manager] 时间预算内验证通过 {stats['working']} 个代理，未检查到的旧代理保留。")
+        if self._cancelled():
+            return stats['working']
+        self._record_sources()
+        removed = 0
+        for address in stale - self._refreshed - self._unchecked:
+            removed += self._manager.remove_proxy(address)
+        if removed:
+            self._log_queue.put(f"[Manager] 已移除 {removed} 个本轮未通过验证的旧代理。")
+        return stats['working']
@@ -0,0 +1,196 @@
+# modules/pool.py
+
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from core.handshake import socks5_greet
+
+DEFAULT_POOL_OPTIONS = {
+    'enabled': False,
+    'top_n': 10,             # 预热评分最高的前 N 个上游 (外加当前固定代理)
+    'size_per_proxy': 2,     # 每个上游保持的空闲连接数
+    'idle_seconds': 30,      # 空闲连接最长保留时间, 超时后关闭重建
+    'connect_timeout': 5,
+    'refill_interval': 1.0,  # 维护线程巡检间隔 (秒)
+}
+
+
+class _PooledConnection:
+    __slots__ = ('sock', 'created_at', 'greeted')
+
+    def __init__(self, sock, greeted):
+        self.sock = sock
+        self.created_at = time.monotonic()
+        self.greeted = greeted
+
+
+class UpstreamPool:
+    """
+    上游代理预热连接池。
+    后台线程为评分最高的上游保持若干条已完成 TCP 握手的空闲连接（SOCKS5 还会提前完成方法协商），
+    新隧道取出一条后只需再发送最后的 CONNECT / SOCKS 请求即可开始转发。
+    """
+    def __init__(self, rotator, log_queue, options=None):
+        self._rotator = rotator
+        self._log_queue = log_queue
+        self.options = dict(DEFAULT_POOL_OPTIONS)
+        if options:
+            self.options.update(options)
+
+        self._idle = {}        # 代理地址 -> deque[_PooledConnection]
+        self._protocols = {}   # 代理地址 -> 协议
+        self._dialing = set()  # 正在拨号的代理地址, 避免重复补充
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._executor = None
+
+    def log(self, message):
+        self._log_queue.put(f"[Pool] {message}")
+
+    def start(self):
+        """启动后台维护线程。"""
+        if self._running:
+            return
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=max(4, self.options['top_n']))
+        self._thread = threading.Thread(target=self._maintain_loop, daemon=True)
+        self._thread.start()
+        self.log(f"上游连接池已启动: 前 {self.options['top_n']} 个上游, 每个 {self.options['size_per_proxy']} 条连接")
+
+    def stop(self):
+        """停止维护线程并关闭所有空闲连接。"""
+        if not self._running:
+            return
+        self._running = False
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.sock.close()
+            self._idle.clear()
+        self.log("上游连接池已停止。")
+
+    def acquire(self, proxy_address: str):
+        """
+        取出一条发往指定上游的可用预热连接，返回 (socket, greeted)，没有可用连接时返回 None。
+        过期或已被对端关闭的连接会被直接丢弃。
+        """
+        idle_seconds = self.options['idle_seconds']
+        while True:
+            with self._lock:
+                conns = self._idle.get(proxy_address)
+                if not conns:
+                    return None
+                conn = conns.pop()  # 取最新建立的连接
+            if time.monotonic() - conn.created_at < idle_seconds and self._is_alive(conn.sock):
+                conn.sock.settimeout(None)
+                return conn.sock, conn.greeted
+            conn.sock.close()
+
+    def idle_count(self, proxy_address: str = None) -> int:
+        """统计空闲连接数量，可按上游地址筛选。"""
+        with self._lock:
+            if proxy_address is not None:
+                return len(self._idle.get(proxy_address, ()))
+            return sum(len(conns) for conns in self._idle.values())
+
+    @staticmethod
+    def _is_alive(sock) -> bool:
+        """非阻塞窥探 socket：可读到 EOF 或意外数据都视为不可用。"""
+        try:
+            sock.setblocking(False)
+            try:
+                sock.recv(1, socket.MSG_PEEK)
+                return False
+            except BlockingIOError:
+                return True
+            finally:
+                sock.setblocking(True)
+        except OSError:
+            return False
+
+    def _target_proxies(self):
+        """需要预热的上游: 评分最高的前 N 个 Working 代理，外加当前固定使用的代理。"""
+        targets = {}
+        for p in self._rotator.get_top_proxies(self.options['top_n']):
+            targets[p['proxy']] = p.get('protocol', 'SOCKS5').upper()
+        current = self._rotator.get_current_proxy()
+        if current and current.get('proxy'):
+            targets[current['proxy']] = current.get('protocol', 'SOCKS5').upper()
+        return targets
+
+    def _maintain_loop(self):
+        while self._running:
+            try:
+                self._maintain_once()
+            except Exception as e:
+                self.log(f"[!] 连接池维护出错: {e}")
+            time.sleep(self.options['refill_interval'])
+
+    def _maintain_once(self):
+        targets = self._target_proxies()
+        idle_seconds = self.options['idle_seconds']
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            # 移除已不在目标列表中的上游，以及过期的空闲连接
+            for addr in list(self._idle):
+                conns = self._idle[addr]
+                if addr not in targets:
+                    stale.extend(conns)
+                    del self._idle[addr]
+                    continue
+                while conns and now - conns[0].created_at >= idle_seconds:
+                    stale.append(conns.popleft())
+            self._protocols = targets
+            to_dial = []
+            for addr, protocol in targets.items():
+                if addr in self._dialing:
+                    continue
+                missing = self.options['size_per_proxy'] - len(self._idle.get(addr, ()))
+                if missing > 0:
+                    self._dialing.add(addr)
+                    to_dial.append((addr, protocol, missing))
+        for conn in stale:
+            conn.sock.close()
+        for addr, protocol, missing in to_dial:
+            self._executor.submit(self._fill, addr, protocol, missing)
+
+    def _fill(self, proxy_address, protocol, count):
+        try:
+            for _ in range(count):
+                if not self._running:
+                    return
+                conn = self._dial(proxy_address, protocol)
+                if conn is None:
+                    return  # 上游暂时不可达，等下一轮巡检再试
+                with self._lock:
+                    if self._running and proxy_address in self._protocols:
+                        self._idle.setdefault(proxy_address, deque()).append(conn)
+                        conn = None
+                if conn is not None:
+                    conn.sock.close()
+        finally:
+            with self._lock:
+                self._dialing.discard(proxy_address)
+
+    def _dial(self, proxy_address, protocol):
+        host, port_str = proxy_address.rsplit(':', 1)
+        sock = None
+        try:
+            sock = socket.create_connection((host, int(port_str)), timeout=self.options['connect_timeout'])
+            greeted = False
+            if protocol == 'SOCKS5':
+                socks5_greet(sock)
+                greeted = True
+            return _PooledConnection(sock, greeted)
+        except Exception:
+            if sock is not None:
+                sock.close()
+            return None
@@ -0,0 +1,177 @@
+# modules/precheck.py
+
+import errno
+import os
+import selectors
+import socket
+import time
+from collections import deque
+
+from core.concurrency import LocalExhaustionError
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_PRECHECK_TIMEOUT = 1.5        # 单个 TCP 连接的超时 (秒)
+DEFAULT_PRECHECK_CONCURRENCY = 10000  # 同时在途的最大连接数, 另受文件描述符上限约束
+CANCEL_POLL_INTERVAL = 0.2
+_FD_RESERVE = 256                     # 为日志、会话等其他用途保留的文件描述符
+_SELECT_FD_LIMIT = 500                # Windows 的 select() 最多监视 512 个 socket
+_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, getattr(errno, 'WSAEWOULDBLOCK', -1)}
+_OUT_OF_FDS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.EADDRNOTAVAIL}  # 描述符或本地端口耗尽
+_EXHAUSTION_ATTEMPTS = 5              # 没有在途连接可等时，因资源耗尽无法发起连接的最多重试次数
+_EXHAUSTION_BACKOFF = 0.2             # 上述重试的首次等待 (秒)，之后逐次翻倍
+
+
+def _max_in_flight(requested: int) -> int:
+    if resource is None:
+        return max(1, min(requested, _SELECT_FD_LIMIT))
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return max(1, requested)
+    return max(1, min(requested, soft - _FD_RESERVE))
+
+
+def _resolve(address: str):
+    """'host:port' -> (family, sockaddr)，格式错误或无法解析时返回 None。IP 字面量不经过 DNS。"""
+    host, sep, port_str = address.rpartition(':')
+    if not sep or not port_str.isdigit() or not 0 < int(port_str) <= 0xFFFF:
+        return None
+    host, port = host.strip('[]'), int(port_str)
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return family, (host, port)
+        except OSError:
+            continue
+    try:
+        family, _, _, _, sockaddr = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+        return family, sockaddr
+    except (OSError, UnicodeError):
+        return None
+
+
+def iter_reachable(addresses, timeout=DEFAULT_PRECHECK_TIMEOUT, concurrency=DEFAULT_PRECHECK_CONCURRENCY,
+                   cancel_event=None, controller=None, rtts=None):
+    """
+    TCP 预检：在单个线程里用非阻塞 connect_ex + selectors (Linux 下为 epoll) 同时发起大量连接，
+    按完成顺序逐个产出端口可连通的地址。每个连接最多等待 timeout 秒，同时在途的连接数不超过 concurrency，
+    并按文件描述符软限制收紧；遇到描述符或本地端口耗尽时自动降低并发，没有在途连接可等时退避重试，
+    始终无法发起连接则抛出 LocalExhaustionError，不把未能检查的地址当作不可达。cancel_event 被设置后停止产出。
+    传入 controller (core.concurrency.ConcurrencyController) 时在途上限取其当前值，
+    并把每个连接的结果与耗时反馈给它，由它按 AIMD 调整。传入字典 rtts 时记录每个可连通地址的连接耗时 (秒)。
+    """
+    limit = cap = _max_in_flight(concurrency)
+    selector = selectors.DefaultSelector()
+    in_flight = {}      # socket -> (地址, 发起时间)
+    deadlines = deque()  # (截止时间, socket)，超时相同，发起顺序即截止顺序
+    targets = iter(addresses)
+    retry = None         # 因描述符耗尽未能发起、需要重试的地址
+    exhaustion_waits = 0
+    exhausted = False
+    try:
+        while True:
+            if cancel_event and cancel_event.is_set():
+                return
+
+            if controller is not None:
+                limit = min(controller.limit, cap)
+            # 补足在途连接
+            while not exhausted and len(in_flight) < limit:
+                if retry is not None:
+                    address, retry = retry, None
+                else:
+                    address = next(targets, None)
+                if address is None:
+                    exhausted = True
+                    break
+                target = _resolve(address)
+                if target is None:
+                    continue
+                try:
+                    sock = socket.socket(target[0], socket.SOCK_STREAM)
+                except OSError as e:
+                    code = e.errno
+                else:
+                    sock.setblocking(False)
+                    code = sock.connect_ex(target[1])
+                    if code not in _IN_PROGRESS:
+                        sock.close()
+                if code in _OUT_OF_FDS:
+                    # 等在途连接释放资源后重试该地址，不把它当作不可达
+                    retry = address
+                    if in_flight:
+                        if controller is not None:
+                            controller.congested()
+                        else:
+                            limit = len(in_flight)
+                        break
+                    # 资源被进程内的其他任务占用，退避后重试
+                    if exhaustion_waits >= _EXHAUSTION_ATTEMPTS:
+                        raise LocalExhaustionError(f"TCP 预检无法发起连接: {os.strerror(code)}")
+                    if controller is not None:
+                        controller.congested()
+                    delay = _EXHAUSTION_BACKOFF * 2 ** exhaustion_waits
+                    exhaustion_waits += 1
+                    if cancel_event is None:
+                        time.sleep(delay)
+                    elif cancel_event.wait(delay):
+                        return
+                    break
+                exhaustion_waits = 0
+                if code == 0:
+                    if rtts is not None:
+                        rtts[address] = 0.0
+                    yield address
+                elif code in _IN_PROGRESS:
+                    now = time.monotonic()
+                    in_flight[sock] = (address, now)
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    deadlines.append((now + timeout, sock))
+
+            if not in_flight:
+                if exhausted:
+                    return
+                continue
+
+            wait = min(max(deadlines[0][0] - time.monotonic(), 0), CANCEL_POLL_INTERVAL)
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                address, started = in_flight.pop(sock)
+                selector.unregister(sock)
+                ok = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                sock.close()
+                rtt = time.monotonic() - started
+                if controller is not None:
+                    controller.record(ok, rtt if ok else None)
+                if ok:
+                    if rtts is not None:
+                        rtts[address] = rtt
+                    yield address
+
+            now = time.monotonic()
+            while deadlines and (deadlines[0][0] <= now or deadlines[0][1] not in in_flight):
+                _, sock = deadlines.popleft()
+                if in_flight.pop(sock, None) is not None:  # 超时未完成
+                    selector.unregister(sock)
+                    sock.close()
+                    if controller is not None:
+                        controller.record(False)
+    finally:
+        for sock in in_flight:
+            selector.unregister(sock)
+            sock.close()
+        selector.close()
+
+
+def pre_check(proxy_infos, timeout=DEFAULT_PRECHECK_TIMEOUT, concurrency=DEFAULT_PRECHECK_CONCURRENCY,
+              cancel_event=None, controller=None, rtts=None):
+    """
+    对 [{'proxy': ..., 'protocol': ...}] 做 TCP 预检，返回可连通的条目；同一地址的多个协议只连接一次。
+    本机资源持续耗尽时抛出 LocalExhaustionError (见 iter_reachable)。
+    """
+    reachable = set(iter_reachable(dict.fromkeys(p['proxy'] for p in proxy_infos), timeout, concurrency,
+                                   cancel_event, controller, rtts))
+    return [p for p in proxy_infos if p['proxy'] in reachable]
@@ -0,0 +1,376 @@
+# modules/probe.py
+
+import asyncio
+import json
+import socket
+import ssl
+import time
+from urllib.parse import urlsplit
+
+from core.concurrency import raise_if_local_exhaustion
+from core.handshake import HandshakeError, async_negotiate, negotiate
+from core.httpparse import (HttpParseError, SocketReader, async_forward_body, async_read_head, body_framing,
+                            forward_body, parse_head)
+from core.throughput import BudgetReached, MeterSink, ThroughputProbe, interrupt_at_deadline
+
+PROBE_MODES = ('separate', 'single')
+SPEED_PATH = '/bytes/102400'   # 单连接模式下在评判站点上下载的测速路径，为 httpbin /bytes 的上限 (100KB)，读取量另受测速字节上限约束
+MAX_BODY_SIZE = 1 << 20        # 需要解析的响应体上限，测速只计数不保存
+MAX_SPEED_LATENCY = 7.0        # 延迟低于该值 (秒) 的才进行测速
+
+_ssl_context = None
+_default_throughput = None
+
+
+def _default_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+class BodySink:
+    """forward_body / async_forward_body 的写端：计数，按需保存响应体。"""
+    __slots__ = ('size', 'chunks', 'keep')
+
+    def __init__(self, keep=False):
+        self.size = 0
+        self.chunks = []
+        self.keep = keep
+
+    def write(self, data):
+        self.size += len(data)
+        if self.keep:
+            if self.size > MAX_BODY_SIZE:
+                raise HttpParseError("响应体过大")
+            self.chunks.append(data)
+
+    sendall = write
+
+    async def drain(self):
+        pass
+
+    def body(self, mode='length') -> bytes:
+        raw = b"".join(self.chunks)
+        return _dechunk(raw) if mode == 'chunked' else raw
+
+
+def _dechunk(raw: bytes) -> bytes:
+    """还原原样保存下来的分块编码报文体。"""
+    body, pos = [], 0
+    while True:
+        end = raw.index(b"\n", pos)
+        size = int(raw[pos:end].split(b';', 1)[0].strip(), 16)
+        if size == 0:
+            return b"".join(body)
+        body.append(raw[end + 1:end + 1 + size])
+        pos = end + 1 + size + 2
+
+
+def classify_anonymity(data: dict, public_ip) -> str:
+    """根据评判站点回显的来源 IP 与请求头判断匿名度。"""
+    origin_ips_str = data.get('headers', {}).get('X-Forwarded-For', data.get('origin', ''))
+    origin_ips = [ip.strip() for ip in origin_ips_str.split(',')]
+    if public_ip and any(public_ip in ip for ip in origin_ips):
+        return 'Transparent'
+    if len(origin_ips) > 1 or 'Via' in data.get('headers', {}):
+        return 'Anonymous'
+    return 'Elite'
+
+
+def score_result(result: dict) -> float:
+    """综合评分：匿名度加分，速度最多加 50 分，延迟最多扣 50 分，结果非负。"""
+    score = 0
+    if result['anonymity'] == 'Elite':
+        score += 50
+    elif result['anonymity'] == 'Anonymous':
+        score += 30
+    score += min(result['speed'] * 2, 50)
+    score -= min(result['latency'] * 10, 50)
+    return max(score, 0)
+
+
+class _Plan:
+    """一次单连接验证的连接方式：直连代理后按普通代理转发，或建立隧道 (必要时再做 TLS)。"""
+    __slots__ = ('proxy_host', 'proxy_port', 'protocol', 'host', 'port', 'secure', 'forward', 'netloc', 'base')
+
+    def __init__(self, proxy, protocol, judge_url):
+        parts = urlsplit(judge_url)
+        self.proxy_host, port_str = proxy.rsplit(':', 1)
+        self.proxy_port = int(port_str)
+        # 'HTTPS' 类型的免费代理实际上几乎都是支持 CONNECT 的明文 HTTP 代理
+        self.protocol = 'HTTP' if protocol.upper() == 'HTTPS' else protocol.upper()
+        self.secure = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.secure else 80)
+        self.netloc = parts.netloc
+        # HTTP 上游访问 http:// 评判站点时与 requests 一样发送完整 URL，这样代理附加的 Via / X-Forwarded-For 才可见
+        self.forward = self.protocol == 'HTTP' and not self.secure
+        self.base = f"{parts.scheme}://{parts.netloc}" if self.forward else ''
+
+    def request(self, path: str, user_agent: str) -> bytes:
+        return (f"GET {self.base}{path} HTTP/1.1\r\nHost: {self.netloc}\r\nUser-Agent: {user_agent}\r\n"
+                f"Accept: */*\r\nAccept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n").encode()
+
+
+def _judge_path(judge_url: str) -> str:
+    parts = urlsplit(judge_url)
+    return (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+
+
+def _throughput(throughput):
+    global _default_throughput
+    if throughput is None:
+        if _default_throughput is None:
+            _default_throughput = ThroughputProbe()
+        throughput = _default_throughput
+    return throughput
+
+
+def _finish(timings, latency_parts, data, public_ip, measured, speed_error=None):
+    timings = {name: round(value, 4) for name, value in timings.items()}
+    result = {
+        'latency': sum(latency_parts),
+        'anonymity': classify_anonymity(data, public_ip),
+        'speed': measured[0],
+        'speed_confidence': measured[1],
+        'timings': timings,
+    }
+    if speed_error:
+        result['speed_error'] = speed_error
+    return result
+
+
+# --- 阻塞 socket 版本 ---
+def _dial(plan, timeout, timings=None):
+    start = time.monotonic()
+    sock = socket.create_connection((plan.proxy_host, plan.proxy_port), timeout=timeout)
+    try:
+        connected = time.monotonic()
+        if not plan.forward:
+            negotiate(sock, plan.protocol, plan.host, plan.port)
+            if plan.secure:
+                sock = _default_ssl_context().wrap_socket(sock, server_hostname=plan.host)
+        if timings is not None:
+            timings['connect'] = connected - start
+            timings['handshake'] = time.monotonic() - connected
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+def _exchange(sock, reader, request, keep_body, sink=None):
+    """发送一个请求并读完响应，返回 (响应头, BodySink, 首字节耗时, 报文体耗时)；给出 sink 时报文体写入其中。"""
+    sent = time.monotonic()
+    sock.sendall(request)
+    raw_head = reader.read_head()
+    if raw_head is None:
+        raise HttpParseError("评判站点未返回响应")
+    first_byte = time.monotonic()
+    head = parse_head(raw_head, is_request=False)
+    if head.status >= 400:
+        raise HttpParseError(f"HTTP {head.status}")
+    if sink is None:
+        sink = BodySink(keep_body)
+    mode, length = body_framing(head, 'GET')
+    forward_body(reader, sink, mode, length)
+    return head, sink, mode, first_byte - sent, time.monotonic() - first_byte
+
+
+def single_connection_probe(proxy, protocol, judge_url, timeout, public_ip=None, user_agent='Mozilla/5.0',
+                            speed_path=SPEED_PATH, throughput=None, measure_speed=True):
+    """
+    经由一条到代理的连接依次完成延迟、匿名度和测速探测（HTTP keep-alive），只建立一次隧道。
+    延迟 = 连接 + 握手 + 首个响应的首字节耗时，计时对象是评判站点；分别探测模式的延迟是向 latency_check 发送 HEAD 的总耗时，
+    两种模式的延迟与评分不能直接比较。
+    测速复用同一连接下载 speed_path，评判站点不支持 keep-alive 时才重新拨号，
+    受 throughput (core.throughput.ThroughputProbe) 的字节、时间上限与带宽预算约束。
+    返回 {'latency', 'anonymity', 'speed', 'speed_confidence', 'timings'}，timings 含 connect / handshake / ttfb / transfer
+    各阶段秒数；测速没有收到任何数据就失败 (评判站点返回错误状态、握手失败等) 时另含 'speed_error'。
+    失败时抛出异常。
+    """
+    plan = _Plan(proxy, protocol, judge_url)
+    timings = {}
+    sock = _dial(plan, timeout, timings)
+    try:
+        reader = SocketReader(sock)
+        head, sink, mode, ttfb, _ = _exchange(sock, reader, plan.request(_judge_path(judge_url), user_agent), True)
+        timings['ttfb'] = ttfb
+        data = json.loads(sink.body(mode))
+        latency_parts = (timings['connect'], timings['handshake'], ttfb)
+
+        measured, speed_error = (0, 0.0), None
+        if measure_speed and sum(latency_parts) <= MAX_SPEED_LATENCY:
+            throughput = _throughput(throughput)
+            meter = throughput.admit()
+            try:
+                if mode == 'close' or not head.keep_alive():
+                    sock.close()
+                    sock = _dial(plan, timeout)
+                    reader = SocketReader(sock)
+                sock.settimeout(meter.remaining())
+                timer = interrupt_at_deadline(meter, sock)  # 套接字超时只限制单次读取
+                try:
+                    _exchange(sock, reader, plan.request(speed_path, user_agent), False, MeterSink(meter))
+                finally:
+                    timer.cancel()
+            except (BudgetReached, OSError):
+                pass  # 达到字节或时间上限，按已收到的部分计算
+            except (HttpParseError, HandshakeError) as e:
+                if not meter.size:  # 测速失败不影响整体结果，交给调用方记录
+                    speed_error = str(e) or type(e).__name__
+            finally:
+                throughput.settle(meter)
+            measured = meter.result()
+            timings['transfer'] = meter.transfer_time()
+        return _finish(timings, latency_parts, data, public_ip, measured, speed_error)
+    finally:
+        sock.close()
+
+
+# --- asyncio 版本 ---
+async def _async_dial(plan, timeout, timings=None):
+    start = time.monotonic()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(plan.proxy_host, plan.proxy_port), timeout)
+    try:
+        connected = time.monotonic()
+        if not plan.forward:
+            await asyncio.wait_for(async_negotiate(reader, writer, plan.protocol, plan.host, plan.port), timeout)
+            if plan.secure:
+                reader, writer = await asyncio.wait_for(async_start_tls(reader, writer, plan.host), timeout)
+        if timings is not None:
+            timings['connect'] = connected - start
+            timings['handshake'] = time.monotonic() - connected
+        return reader, writer
+    except BaseException:
+        writer.close()
+        raise
+
+
+async def async_start_tls(reader, writer, server_hostname, context=None):
+    """在已建立的隧道流上进行 TLS 握手，返回新的 (reader, writer)。"""
+    context = context or _default_ssl_context()
+    if hasattr(writer, 'start_tls'):  # Python 3.11+
+        await writer.start_tls(context, server_hostname=server_hostname)
+        return reader, writer
+    loop = asyncio.get_running_loop()
+    protocol = writer.transport.get_protocol()
+    transport = await loop.start_tls(writer.transport, protocol, context, server_hostname=server_hostname)
+    return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+
+async def _async_exchange(reader, writer, request, keep_body, sink=None):
+    sent = time.monotonic()
+    writer.write(request)
+    await writer.drain()
+    raw_head = await async_read_head(reader)
+    if raw_head is None:
+        raise HttpParseError("评判站点未返回响应")
+    first_byte = time.monotonic()
+    head = parse_head(raw_head, is_request=False)
+    if head.status >= 400:
+        raise HttpParseError(f"HTTP {head.status}")
+    if sink is None:
+        sink = BodySink(keep_body)
+    mode, length = body_framing(head, 'GET')
+    await async_forward_body(reader, sink, mode, length)
+    return head, sink, mode, first_byte - sent, time.monotonic() - first_byte
+
+
+async def async_single_connection_probe(proxy, protocol, judge_url, timeout, public_ip=None, user_agent='Mozilla/5.0',
+                                        speed_path=SPEED_PATH, throughput=None, measure_speed=True):
+    """single_connection_probe 的 asyncio 版本。"""
+    plan = _Plan(proxy, protocol, judge_url)
+    timings = {}
+    reader, writer = await _async_dial(plan, timeout, timings)
+    try:
+        head, sink, mode, ttfb, _ = await asyncio.wait_for(
+            _async_exchange(reader, writer, plan.request(_judge_path(judge_url), user_agent), True), timeout)
+        timings['ttfb'] = ttfb
+        data = json.loads(sink.body(mode))
+        latency_parts = (timings['connect'], timings['handshake'], ttfb)
+
+        measured, speed_error = (0, 0.0), None
+        if measure_speed and sum(latency_parts) <= MAX_SPEED_LATENCY:
+            throughput = _throughput(throughput)
+            meter = await throughput.async_admit()
+            try:
+                if mode == 'close' or not head.keep_alive():
+                    writer.close()
+                    reader, writer = await _async_dial(plan, timeout)
+                await asyncio.wait_for(
+                    _async_exchange(reader, writer, plan.request(speed_path, user_agent), False, MeterSink(meter)),
+                    meter.remaining())
+            except asyncio.CancelledError:
+                raise
+            except (BudgetReached, asyncio.TimeoutError, OSError):
+                pass  # 达到字节或时间上限，按已收到的部分计算
+            except (HttpParseError, HandshakeError, asyncio.IncompleteReadError) as e:
+                if not meter.size:  # 测速失败不影响整体结果，交给调用方记录
+                    speed_error = str(e) or type(e).__name__
+            finally:
+                throughput.settle(meter)
+            measured = meter.result()
+            timings['transfer'] = meter.transfer_time()
+        return _finish(timings, latency_parts, data, public_ip, measured, speed_error)
+    finally:
+        writer.close()
+
+
+# --- 组装与线程版 / asyncio 版 _full_check_proxy 相同格式的结果 ---
+def _new_result(proxy_info):
+    return {
+        'proxy': proxy_info['proxy'], 'protocol': proxy_info['protocol'].upper(), 'status': 'Failed',
+        'latency': float('inf'), 'speed': 0, 'anonymity': 'Unknown', 'location': 'N/A'
+    }
+
+
+def single_connection_check(checker, proxy_info, log_queue=None, user_agent='Mozilla/5.0'):
+    """
+    单连接模式的完整验证。checker 提供 timeout、next_validation_targets、public_ip 与 _get_proxy_location；
+    以匿名度评判站点 ('anonymity_check') 作为全部探测的目标。
+    """
+    result = _new_result(proxy_info)
+    try:
+        probe = single_connection_probe(proxy_info['proxy'], proxy_info['protocol'],
+                                        checker.next_validation_targets()['anonymity_check'], checker.timeout,
+                                        checker.public_ip, user_agent, throughput=checker.throughput)
+    except Exception as e:
+        raise_if_local_exhaustion(e)
+        if log_queue:
+            log_queue.put(f"[Checker] 验证失败 {proxy_info['proxy']}: {str(e) or type(e).__name__}")
+        return result
+    speed_error = probe.pop('speed_error', None)
+    if speed_error and log_queue:
+        log_queue.put(f"[Checker] 测速失败 {proxy_info['proxy']}: {speed_error}")
+    result.update(probe)
+    result['location'] = checker._get_proxy_location(proxy_info['proxy'].split(":")[0])
+    result['score'] = score_result(result)
+    result['status'] = 'Working'
+    return result
+
+
+async def async_single_connection_check(checker, proxy_info, log_queue=None, user_agent='Mozilla/5.0'):
+    """single_connection_check 的 asyncio 版本，地理位置查询放到线程池中。"""
+    result = _new_result(proxy_info)
+    try:
+        probe = await async_single_connection_probe(proxy_info['proxy'], proxy_info['protocol'],
+                                                    checker.next_validation_targets()['anonymity_check'], checker.timeout,
+                                                    checker.public_ip, user_agent, throughput=checker.throughput)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        raise_if_local_exhaustion(e)
+        if log_queue:
+            log_queue.put(f"[Checker] 验证失败 {proxy_info['proxy']}: {str(e) or type(e).__name__}")
+        return result
+    speed_error = probe.pop('speed_error', None)
+    if speed_error and log_queue:
+        log_queue.put(f"[Checker] 测速失败 {proxy_info['proxy']}: {speed_error}")
+    result.update(probe)
+    loop = asyncio.get_running_loop()
+    result['location'] = await loop.run_in_executor(None, checker._get_proxy_location, proxy_info['proxy'].split(":")[0])
+    result['score'] = score_result(result)
+    result['status'] = 'Working'
+    return result
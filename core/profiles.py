@@ -0,0 +1,103 @@
+# modules/profiles.py
+
+import asyncio
+import statistics
+import time
+
+from core.concurrency import raise_if_local_exhaustion
+
+PROFILE_METHODS = ('HEAD', 'GET')
+
+DEFAULT_PROFILE_WEIGHTS = {
+    'success': 100,      # 全部目标都可达时的得分，按可达比例折算
+    'latency': 10,       # 每秒延迟 (各目标的中位数) 扣的分
+    'latency_cap': 50,   # 延迟最多扣的分
+    'speed': 0,          # 每 Mbps 加的分 (速度来自完整验证的测速)
+    'speed_cap': 50,     # 速度最多加的分
+    'anonymity': 0,      # 高匿 (Elite) 加的分，普通匿名 (Anonymous) 加其 60%
+}
+
+DEFAULT_PROFILE = {
+    'targets': [],       # 该业务实际访问的源站地址
+    'method': 'HEAD',
+    'timeout': 5,        # 单个目标的超时 (秒)
+    'weights': DEFAULT_PROFILE_WEIGHTS,
+}
+
+_ANONYMITY_FACTORS = {'Elite': 1.0, 'Anonymous': 0.6}
+
+
+def load_profiles(profiles) -> dict:
+    """校验配置中的画像 {名称: {...}} 并补全默认值；没有目标或请求方法未知时抛出 ValueError。"""
+    loaded = {}
+    for name, options in (profiles or {}).items():
+        profile = dict(DEFAULT_PROFILE, **options)
+        profile['weights'] = dict(DEFAULT_PROFILE_WEIGHTS, **options.get('weights', {}))
+        profile['method'] = profile['method'].upper()
+        if profile['method'] not in PROFILE_METHODS:
+            raise ValueError(f"验证画像 {name} 的请求方法未知: {profile['method']}")
+        if not profile['targets']:
+            raise ValueError(f"验证画像 {name} 没有目标")
+        loaded[name] = profile
+    return loaded
+
+
+def score_profile(profile, latencies, result) -> dict:
+    """
+    按画像的权重计算得分。latencies 为各目标的耗时，不可达的为 None；result 为完整验证的结果 (取匿名度与速度)。
+    返回 {'latency': 可达目标耗时的中位数, 'success': 可达比例, 'score'}，全部不可达时延迟为 inf、得分为 0。
+    """
+    reached = [latency for latency in latencies if latency is not None]
+    if not reached:
+        return {'latency': float('inf'), 'success': 0.0, 'score': 0}
+    weights = profile['weights']
+    latency = statistics.median(reached)
+    success = len(reached) / len(latencies)
+    score = (weights['success'] * success
+             + weights['anonymity'] * _ANONYMITY_FACTORS.get(result.get('anonymity'), 0)
+             + min(result.get('speed', 0) * weights['speed'], weights['speed_cap'])
+             - min(latency * weights['latency'], weights['latency_cap']))
+    return {'latency': round(latency, 4), 'success': round(success, 2), 'score': round(max(score, 0), 2)}
+
+
+def run_profiles(profiles, request, result, cancel_event=None):
+    """
+    依次请求各画像的全部目标，返回 {名称: score_profile 的结果}；被取消时返回 None。
+    request(url, method, timeout) 在失败 (含 HTTP 错误状态) 时抛出异常；本机资源耗尽时改抛 LocalExhaustionError。
+    """
+    scored = {}
+    for name, profile in profiles.items():
+        latencies = []
+        for url in profile['targets']:
+            if cancel_event and cancel_event.is_set():
+                return None
+            started = time.monotonic()
+            try:
+                request(url, profile['method'], profile['timeout'])
+            except Exception as e:
+                raise_if_local_exhaustion(e)
+                latencies.append(None)
+                continue
+            latencies.append(time.monotonic() - started)
+        scored[name] = score_profile(profile, latencies, result)
+    return scored
+
+
+async def async_run_profiles(profiles, request, result):
+    """run_profiles 的 asyncio 版本，request 为协程函数，超时由它自行处理。"""
+    scored = {}
+    for name, profile in profiles.items():
+        latencies = []
+        for url in profile['targets']:
+            started = time.monotonic()
+            try:
+                await request(url, profile['method'], profile['timeout'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                raise_if_local_exhaustion(e)
+                latencies.append(None)
+                continue
+            latencies.append(time.monotonic() - started)
+        scored[name] = score_profile(profile, latencies, result)
+    return scored
@@ -0,0 +1,240 @@
+# modules/records.py
+
+import socket
+from array import array
+from collections.abc import Mapping
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 numpy 时按列逐行计算
+    np = None
+
+PROTOCOLS = ('HTTP', 'HTTPS', 'SOCKS4', 'SOCKS5')
+ANONYMITY_LEVELS = ('Unknown', 'Transparent', 'Anonymous', 'Elite')
+STATUSES = ('Working', 'Unavailable', 'Failed')
+
+# 字段 -> (列类型码, 编码方式)。'enum' 列存小整数编码，'num' 列直接存数值。
+_COLUMNS = {
+    'protocol': ('B', 'enum'),
+    'anonymity': ('B', 'enum'),
+    'status': ('B', 'enum'),
+    'location': ('H', 'enum'),
+    'latency': ('f', 'num'),
+    'speed': ('f', 'num'),
+    'score': ('f', 'num'),
+    'consecutive_failures': ('H', 'num'),
+}
+_ZERO = {'B': 0, 'H': 0, 'f': 0.0}
+_ITEMSIZE = {typecode: array(typecode).itemsize for typecode in 'BHIf'}
+FIELDS = ('proxy',) + tuple(_COLUMNS)
+_FIELD_BITS = {name: 1 << i for i, name in enumerate(FIELDS)}
+_EXTRA_BIT = 1 << len(FIELDS)
+_MAX_U16 = 0xFFFF
+_FLOAT32_DIGITS = 7   # float32 的有效十进制位数，读取时按此舍入，去掉 0.2 -> 0.20000000298023224 这类噪声
+
+
+class _Enum:
+    """字符串与小整数编码的对照表，遇到新值时追加。"""
+    __slots__ = ('values', '_codes')
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self._codes = {value: code for code, value in enumerate(self.values)}
+
+    def encode(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self._codes[value] = code
+        return code
+
+    def lookup(self, value):
+        """只查不增，未出现过的值返回 None。"""
+        return self._codes.get(value)
+
+
+def _pack_address(address: str):
+    """IPv4 地址打包为 (ip << 16 | port) 整数作为索引键，其他形式的地址原样使用字符串。"""
+    host, sep, port = address.rpartition(':')
+    if sep and host.count('.') == 3 and port.isdigit() and int(port) <= _MAX_U16:
+        try:
+            return int.from_bytes(socket.inet_aton(host), 'big') << 16 | int(port)
+        except OSError:
+            pass
+    return address
+
+
+class ProxyRecordStore:
+    """
+    列式代理记录存储。每个字段一列 array（IPv4 打包为 uint32、端口 uint16，协议/匿名度/状态/地区编码为小整数，
+    延迟/速度/评分为 float32），按槽位寻址；删除的槽位进入空闲列表复用，并递增代数使旧的视图和索引键失效。
+    调用方拿到的是 record() 生成的普通 dict 副本；非 IPv4 主机名和模式外的字段存放在稀疏的旁路字典里。
+    安装了 numpy 时，按条件筛选直接在列上做向量化掩码运算。
+    """
+    VECTORIZED = np is not None
+
+    def __init__(self, base_generation=0):
+        self._gen = array('I')        # 槽位代数，槽位释放时递增
+        self._base_gen = base_generation  # 新槽位的初始代数，清空后从此前的最大代数之后开始
+        self._ip = array('I')
+        self._port = array('H')
+        self._present = array('H')    # 每个字段是否被显式设置过的位图，保持 dict.get 的默认值语义
+        self._columns = {name: array(typecode) for name, (typecode, _) in _COLUMNS.items()}
+        self._enums = {
+            'protocol': _Enum(PROTOCOLS),
+            'anonymity': _Enum(ANONYMITY_LEVELS),
+            'status': _Enum(STATUSES),
+            'location': _Enum(),
+        }
+        self._slots = {}   # 打包地址 -> 槽位
+        self._free = []
+        self._hosts = {}   # 槽位 -> 非 IPv4 的完整地址
+        self._extra = {}   # 槽位 -> 模式外字段 dict
+
+    def __len__(self):
+        return len(self._slots)
+
+    def slot_of(self, address: str):
+        return self._slots.get(_pack_address(address))
+
+    def slots(self):
+        """当前所有在用槽位的列表。"""
+        return list(self._slots.values())
+
+    def generation(self, slot: int) -> int:
+        return self._gen[slot]
+
+    def is_current(self, slot: int, gen: int) -> bool:
+        return slot < len(self._gen) and self._gen[slot] == gen and self._present[slot] != 0
+
+    def add(self, info: Mapping) -> int:
+        """写入一条记录并返回槽位；调用方需确保地址不重复。"""
+        address = info['proxy']
+        key = _pack_address(address)
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._gen)
+            self._ip.append(0)
+            self._port.append(0)
+            self._gen.append(self._base_gen)
+            self._present.append(0)
+            for name, column in self._columns.items():
+                column.append(_ZERO[column.typecode])
+        if isinstance(key, int):
+            self._ip[slot], self._port[slot] = key >> 16, key & _MAX_U16
+        else:
+            self._ip[slot], self._port[slot] = 0, 0
+            self._hosts[slot] = address
+        self._present[slot] = _FIELD_BITS['proxy']
+        self._slots[key] = slot
+        self.update(slot, {k: v for k, v in info.items() if k != 'proxy'})
+        return slot
+
+    def remove(self, slot: int):
+        # 先递增代数再改写，不加锁的读端在读取后核对代数即可发现槽位已被释放
+        address = self.address(slot)
+        self._gen[slot] = (self._gen[slot] + 1) & 0xFFFFFFFF
+        self._present[slot] = 0
+        del self._slots[_pack_address(address)]
+        self._hosts.pop(slot, None)
+        self._extra.pop(slot, None)
+        self._free.append(slot)
+
+    def clear(self):
+        """清空所有记录。代数不归零，旧快照中的索引键不会指向清空后写入同一槽位的记录。"""
+        self.__init__((max(self._gen, default=self._base_gen - 1) + 1) & 0xFFFFFFFF)
+
+    def address(self, slot: int) -> str:
+        host = self._hosts.get(slot)
+        if host is not None:
+            return host
+        return f"{socket.inet_ntoa(self._ip[slot].to_bytes(4, 'big'))}:{self._port[slot]}"
+
+    def update(self, slot: int, data: Mapping):
+        present = self._present[slot]
+        for name, value in data.items():
+            if name == 'proxy':
+                continue
+            spec = _COLUMNS.get(name)
+            if spec is None:
+                self._extra.setdefault(slot, {})[name] = value
+                present |= _EXTRA_BIT
+                continue
+            if spec[1] == 'enum':
+                value = self._enums[name].encode(value)
+            elif spec[0] == 'H':
+                value = min(max(int(value), 0), _MAX_U16)
+            self._columns[name][slot] = value
+            present |= _FIELD_BITS[name]
+        self._present[slot] = present
+
+    def get(self, slot: int, name: str, default=None):
+        if name == 'proxy':
+            return self.address(slot)
+        bit = _FIELD_BITS.get(name)
+        if bit is None:
+            return self._extra.get(slot, {}).get(name, default)
+        if not self._present[slot] & bit:
+            return default
+        value = self._columns[name][slot]
+        spec = _COLUMNS[name]
+        if spec[1] == 'enum':
+            return self._enums[name].values[value]
+        return int(value) if spec[0] == 'H' else float(f"{value:.{_FLOAT32_DIGITS}g}")
+
+    def fields(self, slot: int):
+        present = self._present[slot]
+        names = [name for name in FIELDS if present & _FIELD_BITS[name]]
+        if present & _EXTRA_BIT:
+            names.extend(self._extra.get(slot, ()))
+        return names
+
+    def record(self, slot: int) -> dict:
+        """返回记录的 dict 副本，修改副本不影响存储，需写回时调用 ProxyRotator.update_proxy。"""
+        return {name: self.get(slot, name) for name in self.fields(slot)}
+
+    # --- 批量筛选 ---
+    def _mask_inputs(self, names=('status', 'location', 'latency')):
+        """
+        复制出当前各列供向量化计算使用，不在 array 上长期持有缓冲区导出（否则写端扩容会失败）。
+        读端不加锁时各列可能在复制间隙被追加，统一截断到最短长度。
+        """
+        columns = {name: bytes(self._columns[name]) for name in names}
+        present = bytes(self._present)
+        rows = min([len(present) // _ITEMSIZE['H']]
+                   + [len(columns[name]) // _ITEMSIZE[_COLUMNS[name][0]] for name in names])
+        columns = {name: columns[name][:rows * _ITEMSIZE[_COLUMNS[name][0]]] for name in names}
+        return columns, present[:rows * _ITEMSIZE['H']]
+
+    def select(self, status=None, location=None, max_latency_ms=None):
+        """返回满足条件的槽位列表；条件为 None 表示不限。"""
+        status_code = None if status is None else self._enums['status'].lookup(status)
+        location_code = None if location is None else self._enums['location'].lookup(location)
+        if (status is not None and status_code is None) or (location is not None and location_code is None):
+            return []
+        if np is not None:
+            mask = self._vector_mask(status_code, location_code, max_latency_ms)
+            return np.flatnonzero(mask).tolist()
+        statuses, locations, latencies = (self._columns[n] for n in ('status', 'location', 'latency'))
+        present = self._present
+        location_bit, latency_bit = _FIELD_BITS['location'], _FIELD_BITS['latency']
+        return [slot for slot in self._slots.values()
+                if (status_code is None or statuses[slot] == status_code)
+                and (location_code is None or present[slot] & location_bit and locations[slot] == location_code)
+                and (max_latency_ms is None or present[slot] & latency_bit and latencies[slot] * 1000 <= max_latency_ms)]
+
+    def _vector_mask(self, status_code, location_code, max_latency_ms):
+        columns, present = self._mask_inputs()
+        present = np.frombuffer(present, dtype='H')
+        mask = present != 0
+        if status_code is not None:
+            mask &= np.frombuffer(columns['status'], dtype='B') == status_code
+        if location_code is not None:
+            mask &= (present & _FIELD_BITS['location']) != 0
+            mask &= np.frombuffer(columns['location'], dtype='H') == location_code
+        if max_latency_ms is not None:
+            mask &= (present & _FIELD_BITS['latency']) != 0
+            mask &= np.frombuffer(columns['latency'], dtype='f') * 1000 <= max_latency_ms
+        return mask
@@ -0,0 +1,175 @@
+# modules/relay.py
+
+import errno
+import os
+import select
+import socket
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+F_SETPIPE_SZ = 1031  # Linux fcntl 常量, Python 3.10 之前 fcntl 模块未导出
+
+DEFAULT_RELAY_OPTIONS = {
+    'mode': 'auto',            # auto: 优先 splice, 不可用时回退到 buffer; splice; buffer
+    'idle_timeout': 300,       # 隧道双向均无数据的最长秒数
+    'min_buffer_size': 16384,  # 初始缓冲区大小, 读满后自动翻倍
+    'max_buffer_size': 262144,
+    'tcp_nodelay': True,
+    'tcp_keepalive': True,
+    'keepalive_idle': 60,
+    'keepalive_interval': 15,
+    'keepalive_count': 4,
+}
+
+
+def splice_supported() -> bool:
+    """当前平台是否支持 os.splice (Linux, Python 3.10+)。"""
+    return hasattr(os, 'splice') and hasattr(os, 'SPLICE_F_MOVE')
+
+
+class SocketRelay:
+    """
+    在两个已连接的 socket 之间双向转发字节。
+    Linux 下通过管道使用 os.splice 在内核中搬运数据，其余情况使用预分配缓冲区
+    的 recv_into + memoryview，避免每次读写都创建新的 bytes 对象。
+    """
+    def __init__(self, options=None):
+        self.options = dict(DEFAULT_RELAY_OPTIONS)
+        if options:
+            self.options.update(options)
+        mode = self.options['mode']
+        if mode not in ('auto', 'splice', 'buffer'):
+            raise ValueError(f"未知的转发模式: {mode}")
+        self.use_splice = mode != 'buffer' and splice_supported()
+
+    def tune_socket(self, sock):
+        """按配置设置 TCP_NODELAY 和 TCP keepalive，失败时静默忽略。"""
+        opts = self.options
+        try:
+            if opts['tcp_nodelay']:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if opts['tcp_keepalive']:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                for name, key in (('TCP_KEEPIDLE', 'keepalive_idle'),
+                                  ('TCP_KEEPINTVL', 'keepalive_interval'),
+                                  ('TCP_KEEPCNT', 'keepalive_count')):
+                    if hasattr(socket, name):
+                        sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), opts[key])
+        except OSError:
+            pass
+
+    def forward(self, sock1, sock2, is_running=lambda: True):
+        """双向转发直到任意一方关闭、出错、空闲超时或 is_running() 返回 False。"""
+        self.tune_socket(sock1)
+        self.tune_socket(sock2)
+        if self.use_splice:
+            try:
+                self._forward_splice(sock1, sock2, is_running)
+                return
+            except _SpliceUnavailable:
+                pass
+        self._forward_buffered(sock1, sock2, is_running)
+
+    def _wait_readable(self, socks, last_activity):
+        """最多等待 1 秒，返回可读 socket 列表；出现异常或空闲超时返回 None。"""
+        idle_timeout = self.options['idle_timeout']
+        readable, _, exceptional = select.select(socks, [], socks, 1.0)
+        if exceptional:
+            return None
+        if readable:
+            return readable
+        if idle_timeout and time.monotonic() - last_activity >= idle_timeout:
+            return None
+        return []
+
+    def _forward_buffered(self, sock1, sock2, is_running):
+        min_size = self.options['min_buffer_size']
+        max_size = self.options['max_buffer_size']
+        # 每个方向一块可增长的缓冲区: [bytearray, memoryview]
+        buffers = {sock1: [bytearray(min_size)], sock2: [bytearray(min_size)]}
+        for entry in buffers.values():
+            entry.append(memoryview(entry[0]))
+        last_activity = time.monotonic()
+        try:
+            while is_running():
+                readable = self._wait_readable([sock1, sock2], last_activity)
+                if readable is None:
+                    break
+                for sock in readable:
+                    other = sock2 if sock is sock1 else sock1
+                    entry = buffers[sock]
+                    n = sock.recv_into(entry[1])
+                    if not n:
+                        return
+                    other.sendall(entry[1][:n])
+                    if n == len(entry[0]) and n < max_size:
+                        entry[1].release()
+                        entry[0] = bytearray(min(n * 2, max_size))
+                        entry[1] = memoryview(entry[0])
+                    last_activity = time.monotonic()
+        except (ConnectionResetError, BrokenPipeError, OSError, ValueError):
+            pass
+
+    def _forward_splice(self, sock1, sock2, is_running):
+        max_size = self.options['max_buffer_size']
+        pipes = {}
+        try:
+            for sock in (sock1, sock2):
+                r, w = os.pipe()
+                pipes[sock] = (r, w)
+                if fcntl is not None:
+                    try:
+                        fcntl.fcntl(w, F_SETPIPE_SZ, max_size)
+                    except OSError:
+                        pass
+            chunk = {sock1: self.options['min_buffer_size'], sock2: self.options['min_buffer_size']}
+            fds = {sock1: sock1.fileno(), sock2: sock2.fileno()}
+            last_activity = time.monotonic()
+            first = True
+            while is_running():
+                readable = self._wait_readable([sock1, sock2], last_activity)
+                if readable is None:
+                    break
+                for sock in readable:
+                    other = sock2 if sock is sock1 else sock1
+                    pipe_r, pipe_w = pipes[sock]
+                    try:
+                        n = os.splice(fds[sock], pipe_w, chunk[sock], flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                    except OSError as e:
+                        if first and e.errno in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):  # 该 fd 不支持 splice
+                            raise _SpliceUnavailable()
+                        if isinstance(e, BlockingIOError):
+                            continue
+                        return
+                    first = False
+                    if not n:
+                        return
+                    self._drain_pipe(pipe_r, fds[other], n)
+                    if n == chunk[sock] and n < max_size:
+                        chunk[sock] = min(n * 2, max_size)
+                    last_activity = time.monotonic()
+        except _SpliceUnavailable:
+            raise
+        except (ConnectionResetError, BrokenPipeError, OSError):
+            pass
+        finally:
+            for r, w in pipes.values():
+                os.close(r)
+                os.close(w)
+
+    @staticmethod
+    def _drain_pipe(pipe_r, out_fd, pending):
+        """把管道中的 pending 字节全部写入目标 socket，目标暂不可写时等待。"""
+        while pending > 0:
+            try:
+                pending -= os.splice(pipe_r, out_fd, pending, flags=os.SPLICE_F_MOVE)
+            except BlockingIOError:
+                select.select([], [out_fd], [], 1.0)
+
+
+class _SpliceUnavailable(Exception):
+    """splice 在当前 socket 上不可用，需要回退到缓冲区模式。"""
@@ -0,0 +1,196 @@
+# modules/revalidator.py
+
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.concurrency import run_adaptive
+
+DEFAULT_REVALIDATION_OPTIONS = {
+    'enabled': False,
+    'probes_per_second': 2.0,   # 探测预算: 平均每秒最多重新验证的代理数
+    'max_workers': 8,           # 同时进行的重新验证数
+    'interval_seconds': 600,    # 代理距上次验证超过该时长才再次验证; 有失败报告或被熔断的代理不受限制
+    'remove_after': 3,          # 连续重新验证失败多少次后从代理池移除, 0 表示只标记为 'Failed'
+    'tick_seconds': 1.0,        # 调度间隔 (秒)
+}
+
+# 到期时间按验证间隔折算的提前量: 每次失败报告、被熔断 ('Unavailable')、满分与实际评分之差 (按 100 分归一化)。
+# 失败与熔断的提前量超过一个间隔，因此这类代理立即到期，并排在只是过了间隔的代理之前
+_FAILURE_ADVANCE = 2.0
+_QUARANTINED_ADVANCE = 3.0  # 被熔断的代理优先确认是已恢复还是确已失效
+_SCORE_ADVANCE = 0.5        # 0 分的代理最多提前半个间隔
+# 重新验证通过时写回代理记录的字段
+_UPDATED_FIELDS = ('latency', 'speed', 'speed_confidence', 'score', 'anonymity', 'profiles')
+
+
+class Revalidator:
+    """
+    后台增量重新验证。调度线程按令牌桶发放探测预算 (probes_per_second)，每次取出到期最早的代理
+    重新做完整验证，结果经 update_proxy 原地写回 latency / speed / score / status，代理池无需整体重建。
+    每个代理的到期时间为上次验证时间加 interval_seconds，再按隧道失败报告 (consecutive_failures)、熔断状态与评分提前；
+    有失败报告或被熔断的代理立即到期。到期时间存放在小顶堆中，由轮换器的写操作回调 (add_listener) 随
+    新增、update_proxy、report_failure 与移除增量更新，调度时不扫描代理池。上次验证时间由调度器自行记录，
+    首次见到的代理视为刚验证过 (它们来自刚完成的刷新)。连续失败 remove_after 次的代理被移除。
+    """
+    def __init__(self, manager, log_queue, options=None):
+        self._manager = manager  # ProxyManager: 提供代理记录、_full_check_proxy 与 update_proxy / remove_proxy
+        self._log_queue = log_queue
+        self.options = dict(DEFAULT_REVALIDATION_OPTIONS)
+        if options:
+            self.options.update(options)
+        self._checked = {}       # 代理地址 -> 上次验证 (或首次见到) 的时间
+        self._misses = {}        # 代理地址 -> 连续重新验证失败次数
+        self._due = {}           # 代理地址 -> 到期时间，不含验证中的代理
+        self._heap = []          # (到期时间, 代理地址) 小顶堆，与 _due 不一致的条目已失效
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._executor = None
+        self.stats = {'checked': 0, 'working': 0, 'failed': 0, 'removed': 0}
+
+    def log(self, message):
+        self._log_queue.put(f"[Revalidate] {message}")
+
+    def start(self):
+        """登记代理池中的现有代理并订阅其变更，然后启动调度线程。"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._manager.add_listener(self._on_change)
+        now = time.monotonic()
+        for record in self._manager.get_all_proxies_for_revalidation():
+            self._on_change('update', record['proxy'], record, now)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.options['max_workers']))
+        self._thread = threading.Thread(target=self._schedule_loop, daemon=True)
+        self._thread.start()
+        self.log(f"后台重新验证已启动: 每秒最多 {self.options['probes_per_second']} 个，"
+                 f"验证间隔 {self.options['interval_seconds']} 秒")
+
+    def stop(self):
+        """停止调度并取消进行中的验证。"""
+        if not self._thread:
+            return
+        self._stop_event.set()
+        self._manager.remove_listener(self._on_change)
+        self._thread.join()
+        self._thread = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        stats = self.stats
+        self.log(f"后台重新验证已停止: 共验证 {stats['checked']} 次，通过 {stats['working']}，"
+                 f"失败 {stats['failed']}，移除 {stats['removed']} 个。")
+
+    def _due_time(self, address, fields, now):
+        """按上次验证时间、失败报告、熔断状态与评分计算到期时间，调用方需持有锁。"""
+        checked_at = self._checked.setdefault(address, now)
+        interval = self.options['interval_seconds']
+        advance = (_FAILURE_ADVANCE * fields.get('consecutive_failures', 0)
+                   + (_QUARANTINED_ADVANCE if fields.get('status') == 'Unavailable' else 0)
+                   + _SCORE_ADVANCE * (100 - min(fields.get('score', 0), 100)) / 100)
+        return checked_at + interval * (1 - advance)
+
+    def _on_change(self, event, address, fields, now=None):
+        """轮换器的写操作回调 (见 ProxyRotator.add_listener)：重新计算到期时间或清除记录。"""
+        with self._lock:
+            if event == 'clear':
+                for table in (self._checked, self._misses, self._due):
+                    table.clear()
+                self._heap.clear()
+                return
+            if event == 'remove':
+                for table in (self._checked, self._misses, self._due):
+                    table.pop(address, None)
+                return
+            if address in self._in_flight:
+                return  # 验证结束后由 _revalidate 重新登记
+            self._schedule(address, fields, time.monotonic() if now is None else now)
+
+    def _schedule(self, address, fields, now):
+        due = self._due[address] = self._due_time(address, fields, now)
+        heapq.heappush(self._heap, (due, address))
+        if len(self._heap) > 2 * len(self._due) + 64:  # 失效条目过多时重建，堆的大小与代理数同阶
+            self._heap = [(due, address) for address, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def _pick(self, count, now):
+        """取出到期最早的 count 个代理 (只取已到期的)，标记为验证中。"""
+        picked = []
+        with self._lock:
+            heap = self._heap
+            while heap and len(picked) < count and heap[0][0] <= now:
+                due, address = heapq.heappop(heap)
+                if self._due.get(address) != due:
+                    continue  # 已被重新计算或移除
+                del self._due[address]
+                self._in_flight.add(address)
+                picked.append(address)
+        return picked
+
+    def _schedule_loop(self):
+        options = self.options
+        rate = options['probes_per_second']
+        tokens, last = 0.0, time.monotonic()
+        while not self._stop_event.wait(options['tick_seconds']):
+            now = time.monotonic()
+            # 令牌桶: 预算按时间累积，最多攒够 1 秒 (且至少 1 个) 的量，空闲后不会突发大量探测
+            tokens = min(tokens + (now - last) * rate, max(rate, 1.0))
+            last = now
+            with self._lock:
+                slots = options['max_workers'] - len(self._in_flight)
+            count = min(int(tokens), slots)
+            if count <= 0:
+                continue
+            picked = self._pick(count, now)
+            tokens -= len(picked)
+            for address in picked:
+                self._executor.submit(self._revalidate, address)
+
+    def _revalidate(self, address):
+        manager = self._manager
+        try:
+            record = manager.get_proxy_by_address(address)
+            if record is None or self._stop_event.is_set():
+                return
+            proxy_info = {'proxy': address, 'protocol': record['protocol']}
+            options = manager.validation_options
+            result = run_adaptive(None, lambda p: manager._full_check_proxy(p, 'online', self._stop_event, None,
+                                                                           options['probe']),
+                                  proxy_info, self._stop_event)
+            if result is None:  # 被取消或本机资源不足，不计结果
+                return
+            self._record(address, result)
+        except Exception as e:
+            self.log(f"重新验证 {address} 出错: {e}")
+        finally:
+            record = manager.get_proxy_by_address(address)
+            with self._lock:
+                self._in_flight.discard(address)
+                # 验证结果已经 update_proxy 回调重新登记；被取消、出错或期间有新的失败报告时按当前记录登记
+                if record is not None and address not in self._due and not self._stop_event.is_set():
+                    self._schedule(address, record, time.monotonic())
+
+    def _record(self, address, result):
+        manager, working = self._manager, result['status'] == 'Working'
+        with self._lock:
+            self._checked[address] = time.monotonic()
+            self.stats['checked'] += 1
+            self.stats['working' if working else 'failed'] += 1
+            misses = 0 if working else self._misses.get(address, 0) + 1
+            if misses:
+                self._misses[address] = misses
+            else:
+                self._misses.pop(address, None)
+        if working:
+            update = {key: result[key] for key in _UPDATED_FIELDS if key in result}
+            manager.update_proxy(address, dict(update, status='Working', consecutive_failures=0))
+            return
+        remove_after = self.options['remove_after']
+        if remove_after and misses >= remove_after:
+            if manager.remove_proxy(address):
+                with self._lock:
+                    self.stats['removed'] += 1
+                self.log(f"{address} 连续 {misses} 次重新验证失败，已移除。")
+            return
+        manager.update_proxy(address, {'status': 'Failed', 'consecutive_failures': 0})
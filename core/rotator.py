@@ -1,189 +1,726 @@
 # modules/rotator.py
 
+import heapq
+import itertools
+import random
 import threading
+import time
+from bisect import bisect_left, insort
 from collections import defaultdict
 
+from core.breaker import CircuitBreaker
+from core.records import ProxyRecordStore
+
+# 延迟分桶上界 (毫秒)。按延迟筛选时，上界不超过阈值的桶整体入选，只有跨越阈值的那个桶需要逐个检查。
+LATENCY_BUCKETS_MS = (100, 200, 300, 500, 800, 1000, 1500, 2000, 3000, 5000, float('inf'))
+
+SELECTION_MODES = ('round_robin', 'weighted')
+MIN_SELECTION_WEIGHT = 1.0  # 加权模式下的最小权重，保证 0 分代理仍有少量流量
+CHEAP_PUBLISH_SECONDS = 0.001  # 单次发布快照耗时低于此值时每次写入都立即发布
+PUBLISH_COST_RATIO = 10        # 否则两次发布的间隔至少为单次发布耗时的这么多倍
+
+
+def _latency_bucket(latency_ms: float) -> int:
+    return bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+
+
+def _latency_ms(store, slot) -> float:
+    return store.get(slot, 'latency', float('inf')) * 1000
+
+
+def _profile_score(store, slot, name):
+    """代理在验证画像 name 下的得分；没有该画像的结果或其目标全部不可达时返回 None。"""
+    entry = (store.get(slot, 'profiles') or {}).get(name)
+    return entry['score'] if entry and entry.get('success') else None
+
+
+class _FenwickTree:
+    """
+    按位置存放权重的树状数组，支持 O(log n) 的权重增删。每个位置保存一个索引键，按记录槽位定位；
+    删除的位置权重置 0 并进入空闲列表，供后续新增复用。
+    """
+    __slots__ = ('_tree', '_weights', '_items', '_positions', '_free', 'total')
+
+    def __init__(self):
+        self._tree = [0.0]   # 1-based
+        self._weights = []
+        self._items = []
+        self._positions = {}  # 记录槽位 -> 树中位置
+        self._free = []
+        self.total = 0.0
+
+    def _prefix(self, i):
+        s = 0.0
+        while i > 0:
+            s += self._tree[i]
+            i &= i - 1
+        return s
+
+    def _update(self, pos, delta):
+        i = pos + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+        self.total += delta
+
+    def add(self, record_slot, item, weight):
+        if self._free:
+            pos = self._free.pop()
+            self._items[pos] = item
+            self._weights[pos] = weight
+            self._update(pos, weight)
+        else:
+            pos = len(self._weights)
+            self._weights.append(weight)
+            self._items.append(item)
+            n = pos + 1
+            # 新节点覆盖区间 (n - lowbit(n), n]，其余部分可由前缀和差得到
+            self._tree.append(weight + self._prefix(n - 1) - self._prefix(n - (n & -n)))
+            self.total += weight
+        self._positions[record_slot] = pos
+
+    def discard(self, record_slot):
+        pos = self._positions.pop(record_slot, None)
+        if pos is None:
+            return
+        self._update(pos, -self._weights[pos])
+        self._weights[pos] = 0.0
+        self._items[pos] = None
+        self._free.append(pos)
+        if not self._positions:
+            self.__init__()  # 清空时顺便消除浮点累积误差
+
+    def freeze(self):
+        return tuple(self._tree), tuple(self._items), self.total
+
+
+def _fenwick_sample(tree, items, total):
+    """在冻结的树状数组上按权重随机返回一个元素。"""
+    r = random.random() * total
+    pos, n = 0, len(items)
+    step = 1 << n.bit_length()
+    while step:
+        nxt = pos + step
+        if nxt <= n and tree[nxt] <= r:
+            pos = nxt
+            r -= tree[nxt]
+        step >>= 1
+    # 浮点误差可能落在末尾之外或已删除的槽位上，退回到最近的有效槽位
+    pos = min(pos, n - 1)
+    if items[pos] is None:
+        pos = next(i for i in range(n - 1, -1, -1) if items[i] is not None)
+    return items[pos]
+
+
+class _ScoreIndex:
+    """
+    写端使用的可变索引：按 (-score, 记录槽位, 槽位代数) 升序的有序键列表（即评分从高到低）和抽样权重。
+    """
+    __slots__ = ('keys', 'weights')
+
+    def __init__(self):
+        self.keys = []
+        self.weights = _FenwickTree()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, weight, keep_sorted=True):
+        if keep_sorted:
+            insort(self.keys, key)
+        else:
+            self.keys.append(key)  # 批量写入时由调用方最后统一排序
+        self.weights.add(key[1], key, weight)
+
+    def discard(self, key):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+            self.weights.discard(key[1])
+
+
+class _IndexView:
+    """_ScoreIndex 的不可变副本，发布后只读。"""
+    __slots__ = ('keys', 'tree', 'items', 'total')
+
+    def __init__(self, index: _ScoreIndex):
+        self.keys = tuple(index.keys)
+        self.tree, self.items, self.total = index.weights.freeze()
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class _Snapshot:
+    """
+    某一时刻全部候选索引的不可变快照。读端拿到引用后无需加锁；
+    当前筛选条件的候选序列由写端随写入增量维护 (filtered)，其他带延迟或画像筛选的序列在首次使用时计算并缓存在快照内。
+    """
+    __slots__ = ('views', 'filtered', 'store', '_merged')
+
+    def __init__(self, views, store, filtered=None):
+        self.views = views        # (地区|"All", 延迟桶|None) -> _IndexView
+        self.filtered = filtered or {}  # (地区, 延迟阈值, 画像) -> _IndexView
+        self.store = store
+        self._merged = {}
+
+    @property
+    def active_count(self):
+        view = self.views.get(("All", None))
+        return len(view) if view else 0
+
+    def eligible(self, region, quality_latency_ms):
+        """返回满足筛选条件的 (视图, 是否需逐个检查延迟) 列表。"""
+        if quality_latency_ms is None:
+            view = self.views.get((region, None))
+            return [(view, False)] if view else []
+        eligible = []
+        for bucket, upper in enumerate(LATENCY_BUCKETS_MS):
+            view = self.views.get((region, bucket))
+            if view:
+                eligible.append((view, upper > quality_latency_ms))
+            if upper >= quality_latency_ms:
+                break
+        return eligible
+
+    def candidates(self, region, quality_latency_ms, profile=None):
+        """
+        按评分从高到低排列的候选键序列。profile 为 (画像名, 最低得分) 时只保留该画像得分不低于最低得分的代理，
+        并按画像得分从高到低排列。
+        """
+        view = self.filtered.get((region, quality_latency_ms, profile))
+        if view is not None:
+            return view.keys
+        if profile is not None:
+            cache_key = (region, quality_latency_ms, profile)
+            ranked = self._merged.get(cache_key)
+            if ranked is None:
+                name, min_score = profile
+                scored = []
+                for key in self.candidates(region, quality_latency_ms):
+                    score = _profile_score(self.store, key[1], name)
+                    if score is not None and score >= min_score:
+                        scored.append((-score, key))
+                scored.sort()
+                ranked = tuple(key for _, key in scored)
+                self._merged[cache_key] = ranked
+            return ranked
+        if quality_latency_ms is None:
+            view = self.views.get((region, None))
+            return view.keys if view else ()
+        merged = self._merged.get((region, quality_latency_ms))
+        if merged is None:
+            runs = []
+            for view, partial in self.eligible(region, quality_latency_ms):
+                if partial:
+                    runs.append([key for key in view.keys if _latency_ms(self.store, key[1]) <= quality_latency_ms])
+                else:
+                    runs.append(view.keys)
+            merged = tuple(heapq.merge(*runs))
+            self._merged[(region, quality_latency_ms)] = merged
+        return merged
+
+    def profile_weights(self, region, quality_latency_ms, profile):
+        """画像筛选后候选的累计抽样权重 (按画像得分)，与 candidates 的顺序一致。"""
+        cache_key = ('weights', region, quality_latency_ms, profile)
+        weights = self._merged.get(cache_key)
+        if weights is None:
+            weights = list(itertools.accumulate(max(_profile_score(self.store, key[1], profile[0]), MIN_SELECTION_WEIGHT)
+                                      for key in self.candidates(region, quality_latency_ms, profile)))
+            self._merged[cache_key] = weights
+        return weights
+
+
+
+
 class ProxyRotator:
-    """代理轮换器，负责管理、轮换和筛选代理。"""
+    """
+    代理轮换器，负责管理、轮换和筛选代理。
+    代理记录存放在列式的 ProxyRecordStore 中，按地址哈希定位槽位，对外返回记录的 dict 副本；
+    'Working' 状态的代理另外按 (地区, 延迟桶) 维护按评分排序的候选集合，增删改为 O(log n)，不再每次全量扫描排序。
+    带延迟阈值或画像的当前筛选条件另有一份同样随写入增量维护的候选集合，筛选轮换不必在每份新快照上重建候选序列。
+    选择方式支持 'round_robin'（按评分顺序轮换）和 'weighted'（按评分加权随机，树状数组抽样）。
+
+    写操作在锁内修改索引后，以写时复制的方式发布新的不可变快照（只复制改动涉及的索引）；
+    选择、计数等读操作只读取当前快照，不加锁，因此刷新期间大量 add_proxy 不会阻塞隧道建立。
+    代理较少时每次写入都立即发布；代理很多、复制快照变得昂贵时按耗时比例合并发布，尚未发布的改动
+    由之后的读操作在锁空闲时顺带发布，避免流式写入时每次都复制整份索引（计数类读取因此可能短暂滞后）。
+    读端选中的代理若已被移除或标记为不可用则跳过重选。
+
+    隧道失败由 report_failure 交给按地址的熔断器：连续失败达到阈值后暂时移出候选集合，隔离到期后由读操作
+    顺带重新接纳为半开状态，只放行一个试探请求，试探成功 (report_success) 即恢复，无需等待整体刷新。
+    """
     def __init__(self):
-        self.all_proxies = []
-        self.proxies_by_country = defaultdict(list)
-        self.indices = defaultdict(lambda: -1)
+        self._store = ProxyRecordStore()
+        self._keys = {}                            # 记录槽位 -> 当前所在索引的 (key, 地区, 延迟桶)
+        self._indexes = defaultdict(_ScoreIndex)   # (地区|"All", 延迟桶|None) -> _ScoreIndex
+        self._filtered = {}                        # (地区, 延迟阈值, 画像) -> _ScoreIndex，只保留当前筛选条件
+        self._dirty = set()                        # 尚未发布到快照的索引键 (含筛选索引)
+        self._snapshot = _Snapshot({}, self._store)
+        self._last_publish = 0.0
+        self._publish_cost = 0.0
+        self._cursors = {}                         # 筛选条件 -> itertools.count，next() 在 GIL 下是原子操作
+        self._breaker = CircuitBreaker()
+        self._listeners = []                       # 写操作的回调 (事件, 地址, 调度字段)，在锁内按写入顺序调用
         self.current_proxy = None
-        self.lock = threading.Lock()
-        
+        self.selection_mode = 'round_robin'
+        self.lock = threading.Lock()               # 仅串行化写操作
+
         # 新增：保存当前激活的过滤器状态
         self.current_filter_region = "All"
         self.current_filter_quality_latency_ms = None
+        self.current_filter_profile = None         # (画像名, 最低得分) 或 None
+
+    # --- 兼容旧接口的只读列表 (元素为记录副本) ---
+    @property
+    def all_proxies(self):
+        with self.lock:
+            return [self._store.record(slot) for slot in self._store.slots()]
+
+    @property
+    def proxies_by_country(self):
+        with self.lock:
+            by_country = defaultdict(list)
+            for slot in self._store.slots():
+                by_country[self._store.get(slot, 'location', 'Unknown')].append(self._store.record(slot))
+            return by_country
+
+    # --- 变更通知 ---
+    def add_listener(self, callback):
+        """
+        注册写操作回调 callback(event, address, fields)，供后台任务增量跟踪代理池而无需全量扫描：
+        event 为 'update' (新增或字段变化，fields 含 status / score / consecutive_failures)、'remove' 或 'clear'
+        (address 与 fields 为 None)。回调在写锁内调用，应只做 O(log n) 的簿记，且不得再调用轮换器的写操作。
+        """
+        with self.lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self.lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def _notify(self, event, slot=None, address=None):
+        """调用方需持有锁。"""
+        if not self._listeners:
+            return
+        fields = None
+        if slot is not None:
+            store = self._store
+            address = store.address(slot)
+            fields = {'status': store.get(slot, 'status'), 'score': store.get(slot, 'score', 0),
+                      'consecutive_failures': store.get(slot, 'consecutive_failures', 0)}
+        for callback in self._listeners:
+            callback(event, address, fields)
+
+    # --- 索引维护 (调用方需持有锁) ---
+    def _index(self, slot, keep_sorted=True):
+        store = self._store
+        if store.get(slot, 'status') != 'Working':
+            return
+        region = store.get(slot, 'location', 'Unknown')
+        bucket = _latency_bucket(_latency_ms(store, slot))
+        score = store.get(slot, 'score', 0)
+        key = (-score, slot, store.generation(slot))
+        weight = max(score, MIN_SELECTION_WEIGHT)
+        for index_key in ((region, bucket), (region, None), ("All", bucket), ("All", None)):
+            self._indexes[index_key].add(key, weight, keep_sorted)
+            self._dirty.add(index_key)
+        filtered = []
+        for filter_key, index in self._filtered.items():
+            entry = self._filter_entry(slot, filter_key, key, region)
+            if entry is not None:
+                index.add(*entry, keep_sorted)
+                self._dirty.add(filter_key)
+                filtered.append((filter_key, entry[0]))
+        self._keys[slot] = (key, region, bucket, filtered)
+
+    def _unindex(self, slot):
+        entry = self._keys.pop(slot, None)
+        if entry is None:
+            return
+        key, region, bucket, filtered = entry
+        for index_key in ((region, bucket), (region, None), ("All", bucket), ("All", None)):
+            index = self._indexes.get(index_key)
+            if index is not None:
+                index.discard(key)
+                self._dirty.add(index_key)
+                if not index:
+                    del self._indexes[index_key]
+        for filter_key, filter_entry_key in filtered:
+            index = self._filtered.get(filter_key)
+            if index is not None:
+                index.discard(filter_entry_key)
+                self._dirty.add(filter_key)
+
+    def _filter_entry(self, slot, filter_key, key, region):
+        """代理满足筛选条件时返回其在筛选索引中的 (排序键, 抽样权重)，否则返回 None。画像筛选按画像得分排序与加权。"""
+        filter_region, quality_latency_ms, profile = filter_key
+        if filter_region != "All" and filter_region != region:
+            return None
+        if quality_latency_ms is not None and _latency_ms(self._store, slot) > quality_latency_ms:
+            return None
+        if profile is None:
+            return key, max(-key[0], MIN_SELECTION_WEIGHT)
+        score = _profile_score(self._store, slot, profile[0])
+        if score is None or score < profile[1]:
+            return None
+        return (-score, key[1], key[2]), max(score, MIN_SELECTION_WEIGHT)
+
+    def _track_filter(self, filter_key):
+        """
+        只为当前筛选条件维护筛选索引：丢弃旧条件的索引，新条件从现有候选建一次，之后随 _index / _unindex 增量更新，
+        读端不必在每份新快照上重新合并或扫描整个代理池。filter_key 为 None 表示无需筛选索引。
+        """
+        for stale in [k for k in self._filtered if k != filter_key]:
+            del self._filtered[stale]
+            self._dirty.add(stale)
+        if filter_key is None or filter_key in self._filtered:
+            return
+        index = self._filtered[filter_key] = _ScoreIndex()
+        for slot, (key, region, _, filtered) in self._keys.items():
+            filtered.clear()
+            entry = self._filter_entry(slot, filter_key, key, region)
+            if entry is not None:
+                index.add(*entry, keep_sorted=False)
+                filtered.append((filter_key, entry[0]))
+        index.keys.sort()
+        self._dirty.add(filter_key)
+
+    def _publish(self, force=False):
+        """基于上一份快照复制出新快照，只重建改动过的索引视图；force 为 False 时按时间间隔合并。"""
+        if not self._dirty:
+            return
+        now = time.monotonic()
+        if not force and not self._publish_due(now):
+            return
+        views = dict(self._snapshot.views)
+        filtered = dict(self._snapshot.filtered)
+        for index_key in self._dirty:
+            if len(index_key) == 3:  # 筛选索引为空时也发布，以便读端区分“无候选”与“未维护”
+                index = self._filtered.get(index_key)
+                if index is not None:
+                    filtered[index_key] = _IndexView(index)
+                else:
+                    filtered.pop(index_key, None)
+                continue
+            index = self._indexes.get(index_key)
+            if index:
+                views[index_key] = _IndexView(index)
+            else:
+                views.pop(index_key, None)
+        self._dirty.clear()
+        self._snapshot = _Snapshot(views, self._store, filtered)
+        self._last_publish = time.monotonic()
+        self._publish_cost = self._last_publish - now
+
+    def _publish_due(self, now):
+        """合并发布的间隔随单次发布耗时放大，使复制快照的开销不超过写入时间的约 1/PUBLISH_COST_RATIO。"""
+        return (self._publish_cost < CHEAP_PUBLISH_SECONDS
+                or now - self._last_publish >= self._publish_cost * PUBLISH_COST_RATIO)
+
+    def _current_snapshot(self):
+        """
+        读端入口：有到期未发布的改动或隔离到期的代理且写锁空闲时顺带处理，否则直接返回当前快照，从不等待锁。
+        """
+        now = time.monotonic()
+        if ((self._dirty and self._publish_due(now)) or self._breaker.next_due() <= now) \
+                and self.lock.acquire(blocking=False):
+            try:
+                self._readmit(now)
+                self._publish()
+            finally:
+                self.lock.release()
+        return self._snapshot
+
+    def _readmit(self, now):
+        """将隔离到期的代理重新加入候选集合 (半开状态)，调用方需持有锁。"""
+        for address in self._breaker.pop_due(now):
+            slot = self._store.slot_of(address)
+            if slot is None or self._store.get(slot, 'status') != 'Unavailable':
+                self._breaker.forget(address)  # 期间已被移除或由重新验证改写了状态
+                continue
+            self._store.update(slot, {'status': 'Working'})
+            self._index(slot)
+            self._notify('update', slot)
+
+    def _live_record(self, key):
+        """
+        快照中的代理在发布后可能已被移除或标记为不可用，仍可用时返回其记录副本。
+        读端不加锁：生成副本后再核对一次代数，期间槽位被释放、复用或存储被清空时丢弃这份可能不完整的副本。
+        """
+        _, slot, gen = key
+        store = self._store
+        if not store.is_current(slot, gen):
+            return None
+        try:
+            record = store.record(slot)
+        except IndexError:  # 读取期间存储被清空
+            return None
+        if record.get('status') != 'Working' or not store.is_current(slot, gen):
+            return None
+        return record
 
     def clear(self):
         """清空所有代理，并重置内部状态。"""
         with self.lock:
-            self.all_proxies = []
-            self.proxies_by_country.clear()
-            self.indices.clear()
+            self._store.clear()
+            self._keys.clear()
+            self._indexes.clear()
+            self._dirty.clear()
+            for filter_key in self._filtered:
+                self._filtered[filter_key] = _ScoreIndex()
+            self._snapshot = _Snapshot({}, self._store,
+                                       {k: _IndexView(index) for k, index in self._filtered.items()})
+            self._last_publish = 0.0
+            self._publish_cost = 0.0
+            self._cursors = {}
+            self._breaker.clear()
             self.current_proxy = None
-    
-    def set_filters(self, region="All", quality_latency_ms=None):
-        """设置轮换器当前使用的筛选条件。"""
+            self._notify('clear')
+
+    def set_filters(self, region="All", quality_latency_ms=None, profile=None, min_profile_score=0):
+        """
+        设置轮换器当前使用的筛选条件。给出 profile (验证画像名，见 core.profiles) 时只选用该画像下有可达目标、
+        且得分不低于 min_profile_score 的代理，并按画像得分而不是总评分排序与加权。
+        """
         with self.lock:
             self.current_filter_region = region
             self.current_filter_quality_latency_ms = quality_latency_ms
+            self.current_filter_profile = (profile, min_profile_score) if profile else None
+            needs_index = quality_latency_ms is not None or self.current_filter_profile is not None
+            self._track_filter((region, quality_latency_ms, self.current_filter_profile) if needs_index else None)
+            self._publish(force=True)
+
+    def set_selection_mode(self, mode: str):
+        """设置选择方式: 'round_robin' 按评分顺序轮换，'weighted' 按评分加权随机。"""
+        if mode not in SELECTION_MODES:
+            raise ValueError(f"未知的选择方式: {mode}")
+        with self.lock:
+            self.selection_mode = mode
+
+    def set_breaker_options(self, options: dict):
+        """调整熔断参数 (见 core.breaker.DEFAULT_BREAKER_OPTIONS)，只影响之后的失败计数与隔离时长。"""
+        self._breaker.configure(options or {})
+
+    def _add(self, proxy_info, keep_sorted=True):
+        if self._store.slot_of(proxy_info.get('proxy')) is not None:
+            return
+        record = {'consecutive_failures': 0, 'status': 'Working'}
+        record.update(proxy_info)
+        slot = self._store.add(record)
+        self._index(slot, keep_sorted)
+        self._notify('update', slot)
 
     def add_proxy(self, proxy_info: dict):
         """添加一个新代理，如果代理地址已存在则忽略。"""
         with self.lock:
-            proxy_address = proxy_info.get('proxy')
-            if any(p.get('proxy') == proxy_address for p in self.all_proxies):
-                return 
+            self._add(proxy_info)
+            self._publish()
 
-            proxy_info.setdefault('consecutive_failures', 0)
-            proxy_info.setdefault('status', 'Working')
-            self.all_proxies.append(proxy_info)
-            country = proxy_info.get('location', 'Unknown')
-            self.proxies_by_country[country].append(proxy_info)
+    def add_proxies(self, proxy_list):
+        """批量添加代理，全部写入后只发布一次快照。"""
+        with self.lock:
+            for proxy_info in proxy_list:
+                self._add(proxy_info, keep_sorted=False)
+            for index_key in self._dirty:
+                index = self._filtered.get(index_key) if len(index_key) == 3 else self._indexes.get(index_key)
+                if index is not None:
+                    index.keys.sort()
+            self._publish(force=True)
 
     def remove_proxy(self, proxy_address: str):
         """根据代理地址移除一个代理。"""
         with self.lock:
-            proxy_to_remove = None
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    proxy_to_remove = p_info
-                    break
-            
-            if proxy_to_remove:
-                self.all_proxies.remove(proxy_to_remove)
-                
-                country = proxy_to_remove.get('location', 'Unknown')
-                if country in self.proxies_by_country:
-                    try:
-                        self.proxies_by_country[country].remove(proxy_to_remove)
-                        if not self.proxies_by_country[country]:
-                            del self.proxies_by_country[country]
-                    except ValueError:
-                        pass
-                
-                if self.current_proxy and self.current_proxy.get('proxy') == proxy_address:
-                    self.current_proxy = None
-                return True
-            return False
+            slot = self._store.slot_of(proxy_address)
+            if slot is None:
+                return False
+            self._unindex(slot)
+            self._store.remove(slot)
+            self._breaker.forget(proxy_address)
+            self._notify('remove', address=proxy_address)
+            self._publish()
+            if self.current_proxy and self.current_proxy.get('proxy') == proxy_address:
+                self.current_proxy = None
+            return True
 
     def report_failure(self, proxy_address: str):
         """
-        [NEW] 报告一个代理连接失败，立即将其状态设置为不可用。
-        这个方法是线程安全的。
+        报告一个代理连接失败，累加 consecutive_failures。连续失败达到熔断阈值时将其标记为不可用并暂时移出候选集合，
+        返回本次隔离的秒数，否则返回 None。只统计 'Working' 状态的代理。这个方法是线程安全的。
         """
         with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    p_info['status'] = 'Unavailable'
-                    # 可以在这里增加失败计数，但为了即时响应，直接设为不可用更有效
-                    # p_info['consecutive_failures'] = p_info.get('consecutive_failures', 0) + 1
-                    return
+            slot = self._store.slot_of(proxy_address)
+            if slot is None or self._store.get(slot, 'status') != 'Working':
+                return None
+            failures, seconds = self._breaker.record_failure(proxy_address)
+            self._store.update(slot, {'consecutive_failures': failures})
+            if seconds:
+                self._store.update(slot, {'status': 'Unavailable'})
+                self._unindex(slot)
+                self._publish()
+            self._notify('update', slot)
+            return seconds
+
+    def report_success(self, proxy_address: str):
+        """报告一个代理连接成功，清零失败计数；半开状态的代理由此恢复正常。没有失败记录时不加锁。"""
+        if not self._breaker.tracked(proxy_address):
+            return
+        with self.lock:
+            self._breaker.record_success(proxy_address)
+            slot = self._store.slot_of(proxy_address)
+            if slot is not None:
+                self._store.update(slot, {'consecutive_failures': 0})
+                self._notify('update', slot)
 
     def get_proxy_by_address(self, proxy_address: str):
         """根据代理地址查询代理的详细信息。"""
-        with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    return p_info
-            return None
+        slot = self._store.slot_of(proxy_address)
+        return self._store.record(slot) if slot is not None else None
 
     def update_proxy(self, proxy_address: str, update_data: dict):
         """更新指定代理的信息，例如状态、延迟等。"""
         with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    p_info.update(update_data)
-                    return True
-            return False
+            slot = self._store.slot_of(proxy_address)
+            if slot is None:
+                return False
+            self._unindex(slot)
+            self._store.update(slot, update_data)
+            if 'status' in update_data:
+                self._breaker.forget(proxy_address)  # 状态由外部 (如重新验证) 重新确定，熔断状态作废
+            self._index(slot)
+            self._notify('update', slot)
+            self._publish()
+            return True
 
     def get_all_proxies_for_revalidation(self):
-        """获取所有代理的副本，用于重新验证。"""
+        """获取所有代理的视图列表，用于重新验证。"""
+        return self.all_proxies
+
+    def get_top_proxies(self, n: int):
+        """按评分降序返回前 n 个 'Working' 状态的代理，供连接池预热使用。"""
+        view = self._current_snapshot().views.get(("All", None))
+        if not view:
+            return []
+        # 半开状态的代理只留给 get_next_proxy 的试探请求，不用于预热或备用
+        half_open = self._breaker.half_open
+        return [record for record in map(self._live_record, view.keys[:n])
+                if record is not None and record['proxy'] not in half_open]
+
+    def find_proxies(self, status=None, region=None, quality_latency_ms=None):
+        """
+        按状态/地区/延迟筛选任意代理（不限 'Working'），条件为 None 表示不限。
+        直接在记录列上做掩码筛选，安装了 numpy 时为向量化运算。
+        """
         with self.lock:
-            return list(self.all_proxies)
+            slots = self._store.select(status=status, location=region, max_latency_ms=quality_latency_ms)
+            return [self._store.record(slot) for slot in slots]
 
     def get_active_proxies_count(self) -> int:
         """统计当前状态为 'Working' 的代理数量。"""
-        with self.lock:
-            return sum(1 for p in self.all_proxies if p.get('status') == 'Working')
+        return self._current_snapshot().active_count
 
     def get_available_regions_with_counts(self, quality_latency_ms=None) -> dict:
         """按地区统计 'Working' 状态的代理数量，支持按延迟筛选。"""
-        with self.lock:
-            counts = defaultdict(int)
-            for p_info in self.all_proxies:
-                if p_info.get('status') != 'Working':
-                    continue
-                
-                if quality_latency_ms is not None:
-                    latency_ms = p_info.get('latency', float('inf')) * 1000
-                    if latency_ms > quality_latency_ms:
-                        continue
-
-                region = p_info.get('location', 'Unknown')
-                counts[region] += 1
-            return dict(counts)
-
-
-    def get_next_proxy(self):
-        """根据内部存储的筛选条件，轮换获取下一个可用代理，并按分数排序。"""
-        with self.lock:
-            candidate_proxies = []
-            
-            # 使用内部存储的过滤器
-            effective_region = self.current_filter_region
-            effective_latency = self.current_filter_quality_latency_ms
-
-            for p in self.all_proxies:
-                if p.get('status') == 'Working':
-                    region_match = (effective_region == "All" or p.get('location') == effective_region)
-                    
-                    quality_match = True
-                    if effective_latency is not None:
-                        latency_ms = p.get('latency', float('inf')) * 1000
-                        quality_match = (latency_ms <= effective_latency)
-
-                    if region_match and quality_match:
-                        candidate_proxies.append(p)
-            
-            if not candidate_proxies:
-                # 如果当前条件下无代理, 尝试放宽条件(不限区域和延迟)
-                if effective_region != "All" or effective_latency is not None:
-                    original_region = self.current_filter_region
-                    original_latency = self.current_filter_quality_latency_ms
-                    self.set_filters("All", None)
-                    result = self.get_next_proxy()
-                    self.set_filters(original_region, original_latency) # 恢复之前的过滤器
-                    return result
+        snapshot = self._current_snapshot()
+        counts = {}
+        for region, bucket in snapshot.views:
+            if bucket is not None or region == "All":
+                continue
+            count = 0
+            for view, partial in snapshot.eligible(region, quality_latency_ms):
+                if partial:
+                    count += sum(1 for key in view.keys if _latency_ms(self._store, key[1]) <= quality_latency_ms)
+                else:
+                    count += len(view)
+            if count:
+                counts[region] = count
+        return counts
 
-                self.current_proxy = None
-                return None
+    def _weighted_pick(self, snapshot, region, quality_latency_ms, attempts=16):
+        """按权重在候选视图中抽样；跨越延迟阈值的桶用拒绝采样，多次落空后退回线性加权选择。"""
+        eligible = snapshot.eligible(region, quality_latency_ms)
+        if not eligible:
+            return None
+        totals = [view.total for view, _ in eligible]
+        for _ in range(attempts):
+            view, partial = random.choices(eligible, weights=totals)[0]
+            key = _fenwick_sample(view.tree, view.items, view.total)
+            if not partial or _latency_ms(self._store, key[1]) <= quality_latency_ms:
+                return key
+        candidates = snapshot.candidates(region, quality_latency_ms)
+        if not candidates:
+            return None
+        weights = [max(-key[0], MIN_SELECTION_WEIGHT) for key in candidates]
+        return random.choices(candidates, weights=weights)[0]
+
+    def _select(self, snapshot):
+        # 使用内部存储的过滤器
+        effective_region = self.current_filter_region
+        effective_latency = self.current_filter_quality_latency_ms
+        profile = self.current_filter_profile
+
+        if (effective_region != "All" or effective_latency is not None or profile is not None) \
+                and not snapshot.candidates(effective_region, effective_latency, profile):
+            # 如果当前条件下无代理, 放宽条件(不限区域、延迟和画像)
+            effective_region, effective_latency, profile = "All", None, None
 
-            candidate_proxies.sort(key=lambda p: p.get('score', 0), reverse=True)
-            
-            quality_key = f"lt{effective_latency}" if effective_latency is not None else "any"
-            index_key = f"{effective_region}_{quality_key}"
-            current_idx = self.indices.get(index_key, -1)
-            next_idx = (current_idx + 1) % len(candidate_proxies)
-            self.indices[index_key] = next_idx
-            
-            self.current_proxy = candidate_proxies[next_idx]
-            return self.current_proxy
+        if self.selection_mode == 'weighted':
+            view = snapshot.filtered.get((effective_region, effective_latency, profile))
+            if view is not None:
+                return _fenwick_sample(view.tree, view.items, view.total) if view else None
+            if profile is None:
+                return self._weighted_pick(snapshot, effective_region, effective_latency)
+            candidates = snapshot.candidates(effective_region, effective_latency, profile)
+            return random.choices(candidates,
+                                  cum_weights=snapshot.profile_weights(effective_region, effective_latency, profile))[0]
+        candidates = snapshot.candidates(effective_region, effective_latency, profile)
+        if not candidates:
+            return None
+        cursor_key = (effective_region, effective_latency, profile)
+        cursor = self._cursors.get(cursor_key)
+        if cursor is None:
+            cursor = self._cursors.setdefault(cursor_key, itertools.count())
+        return candidates[next(cursor) % len(candidates)]
+
+    def get_next_proxy(self, attempts=8):
+        """根据内部存储的筛选条件获取下一个可用代理：按评分从高到低轮换，或按评分加权随机。"""
+        snapshot = self._current_snapshot()
+        breaker = self._breaker
+        record = None
+        for _ in range(attempts):
+            key = self._select(snapshot)
+            if key is None:
+                break
+            record = self._live_record(key)
+            # 半开状态的代理同一时间只放行一个试探请求
+            if record is not None and (not breaker.half_open or breaker.claim_probe(record['proxy'])):
+                break
+            record = None
+        else:
+            # 快照中的候选连续失效，说明积压了较多未发布的移除，等待写锁发布后再选一次 (不再区分试探资格)
+            with self.lock:
+                self._publish(force=True)
+            key = self._select(self._snapshot)
+            record = self._live_record(key) if key is not None else None
+
+        self.current_proxy = record
+        return record
 
     def get_current_proxy(self):
         """获取当前正在使用的代理。"""
-        with self.lock:
-            if self.current_proxy and self.current_proxy.get('status') != 'Working':
-                self.current_proxy = None
-            return self.current_proxy
+        current = self.current_proxy
+        if current:
+            # current_proxy 是选中时的副本，状态以存储中的为准
+            slot = self._store.slot_of(current['proxy'])
+            if slot is None or self._store.get(slot, 'status') != 'Working':
+                self.current_proxy = current = None
+        return current
 
     def set_current_proxy_by_address(self, proxy_address: str):
         """根据地址手动设置当前代理，代理必须可用。"""
-        with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address and p_info.get('status') == 'Working':
-                    self.current_proxy = p_info
-                    return p_info
-            return None
+        record = self.get_proxy_by_address(proxy_address)
+        if record is not None and record.get('status') == 'Working':
+            self.current_proxy = record
+            return record
+        return None
@@ -2,14 +2,26 @@
 
 import socket
 import threading
-import select
 import struct
+import time
 import socks 
-from urllib.parse import urlparse
+
+from core.breaker import record_tunnel_outcome
+from core.failover import DEFAULT_FAILOVER_OPTIONS, connect_with_failover, iter_candidates
+from core.handshake import negotiate
+from core.httpparse import HttpParseError, SocketReader, body_framing, forward_body, parse_head, request_origin
+from core.pool import UpstreamPool
+from core.relay import SocketRelay
+
+BAD_REQUEST_RESPONSE = b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+BAD_GATEWAY_RESPONSE = b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+MAX_UPSTREAMS_PER_CLIENT = 8  # 单个客户端持久连接上最多同时保留的源站连接数
+PROXY_TYPE_MAP = {'HTTP': socks.HTTP, 'SOCKS4': socks.SOCKS4, 'SOCKS5': socks.SOCKS5}
 
 class ProxyServer:
     """本地代理服务，将进入的请求通过代理池转发。支持HTTP和SOCKS5。"""
-    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue):
+    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue, relay_options=None,
+                 pool_options=None, failover_options=None):
         self._rotator = rotator
         self._log_queue = log_queue
         self._running = False
@@ -27,13 +39,29 @@ class ProxyServer:
         # 新增: 轮换模式状态
         self.rotate_per_request = False
 
+        # 字节转发器: splice / 复用缓冲区、空闲超时、TCP 参数调优
+        self._relay = SocketRelay(relay_options)
+
+        # 上游预热连接池 (可选)
+        self._pool = None
+        if pool_options and pool_options.get('enabled'):
+            self._pool = UpstreamPool(rotator, log_queue, pool_options)
+
+        # 上游故障转移 / 竞速连接策略
+        self._failover = dict(DEFAULT_FAILOVER_OPTIONS)
+        if failover_options:
+            self._failover.update(failover_options)
+
     def log(self, message):
         self._log_queue.put(f"[Server] {message}")
 
-    def set_rotation_mode(self, per_request: bool):
-        """设置代理轮换模式。"""
+    def set_rotation_mode(self, per_request: bool, selection: str = None):
+        """设置代理轮换模式；selection 可同时切换轮换器的选择方式 ('round_robin' / 'weighted')。"""
         self.rotate_per_request = per_request
         mode = "逐请求轮换" if per_request else "固定当前"
+        if selection:
+            self._rotator.set_selection_mode(selection)
+            mode += ", 加权随机" if selection == 'weighted' else ", 顺序轮换"
         self.log(f"服务轮换模式已切换为: {mode}")
 
     def start_all(self):
@@ -48,21 +76,31 @@ class ProxyServer:
         self._socks5_thread = threading.Thread(target=self._run_socks5_server, daemon=True)
         self._socks5_thread.start()
 
+        if self._pool:
+            self._pool.start()
+
     def stop_all(self):
         """平滑地停止所有正在运行的代理服务。"""
         if not self._running:
             return
         self._running = False
         
-        if self._http_server_socket:
-            self._http_server_socket.close()
-        if self._socks5_server_socket:
-            self._socks5_server_socket.close()
+        for server_socket in (self._http_server_socket, self._socks5_server_socket):
+            if server_socket:
+                # 仅 close() 在 Linux 上无法唤醒阻塞中的 accept()，需要先 shutdown
+                try:
+                    server_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                server_socket.close()
 
         if self._http_thread and self._http_thread.is_alive():
             self._http_thread.join()
         if self._socks5_thread and self._socks5_thread.is_alive():
             self._socks5_thread.join()
+
+        if self._pool:
+            self._pool.stop()
             
         self.log("所有代理服务已停止。")
 
@@ -109,87 +147,219 @@ class ProxyServer:
         self.log("SOCKS5 代理服务循环已退出。")
         
     def _get_upstream_connection(self, target_host, target_port):
-        """从轮换器获取一个上游代理，并用它来连接目标地址。"""
-        if self.rotate_per_request:
-            # 逐请求轮换模式：每次都获取下一个代理
-            upstream_proxy_info = self._rotator.get_next_proxy()
-        else:
-            # 普通模式：使用当前固定的代理
-            upstream_proxy_info = self._rotator.get_current_proxy()
-
-        if not upstream_proxy_info:
-            self.log("[!] 代理池为空或无符合条件的代理，无法转发请求。")
+        """
+        从轮换器获取一个上游代理，并用它来连接目标地址。
+        首选上游失败时，在时限内依次（或竞速）尝试其他候选上游。
+        """
+        candidates = iter_candidates(self._rotator, self.rotate_per_request, self._failover['max_attempts'])
+        upstream_proxy_info, remote_socket, failures = connect_with_failover(
+            candidates,
+            lambda proxy_info, timeout: self._connect_upstream(proxy_info, target_host, target_port, timeout),
+            self._failover,
+        )
+        for proxy_info, error in failures:
+            self.log(f"[!] 上游代理 {proxy_info.get('proxy')} 错误: {error}")
+        for address, seconds in record_tunnel_outcome(self._rotator, upstream_proxy_info, failures):
+            self.log(f"熔断: 上游代理 {address} 连续失败, 隔离 {seconds:g} 秒")
+
+        if remote_socket is None:
+            if not failures:
+                self.log("[!] 代理池为空或无符合条件的代理，无法转发请求。")
             return None
-
+        if failures:
+            self.log(f"故障转移: {upstream_proxy_info['proxy']} -> {target_host}:{target_port} (此前 {len(failures)} 个候选失败)")
+        elif self.rotate_per_request:
+            # 固定模式的日志在UI点击轮换时已记录，此处不再重复
+            self.log(f"轮换: {upstream_proxy_info['proxy']} -> {target_host}:{target_port}")
+        return remote_socket
+
+    def _connect_upstream(self, upstream_proxy_info, target_host, target_port, timeout):
+        """
+        通过指定上游代理建立到目标地址的隧道，失败时抛出异常。
+        预热连接协商失败时重新拨号，两者共用 timeout，重新拨号只能使用剩余的时间。
+        """
         addr = upstream_proxy_info.get('proxy')
         proto = upstream_proxy_info.get('protocol')
 
         if not addr or not proto:
-            self.log(f"[!] 代理信息格式不正确: {upstream_proxy_info}")
-            return None
-
-        upstream_addr, upstream_port_str = addr.split(':')
-        
-        proxy_type_map = {'HTTP': socks.HTTP, 'SOCKS4': socks.SOCKS4, 'SOCKS5': socks.SOCKS5}
-        upstream_protocol = proxy_type_map.get(proto.upper())
+            raise ValueError(f"代理信息格式不正确: {upstream_proxy_info}")
 
+        upstream_protocol = PROXY_TYPE_MAP.get(proto.upper())
         if not upstream_protocol:
-            self.log(f"[!] 不支持的上游代理协议: {proto}")
-            return None
-        
+            raise ValueError(f"不支持的上游代理协议: {proto}")
+
+        deadline = time.monotonic() + timeout
+        if self._pool:
+            remote_socket = self._connect_via_pool(addr, proto, target_host, target_port, timeout)
+            if remote_socket:
+                return remote_socket
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise socket.timeout(f"连接上游代理 {addr} 超时")
+
+        upstream_addr, upstream_port_str = addr.rsplit(':', 1)
         remote_socket = socks.socksocket()
         try:
+            remote_socket.settimeout(timeout)
             remote_socket.set_proxy(proxy_type=upstream_protocol, addr=upstream_addr, port=int(upstream_port_str))
             remote_socket.connect((target_host, target_port))
-            # --- MODIFIED: Log rotation for per-request mode ---
-            if self.rotate_per_request:
-                self.log(f"轮换: {addr} -> {target_host}:{target_port}")
-            # 固定模式的日志在UI点击轮换时已记录，此处不再重复
+            remote_socket.settimeout(None)
             return remote_socket
-        except Exception as e:
-            self.log(f"[!] 上游代理 {addr} 错误: {e}")
-            # 可以在此处增加代理失败计数的逻辑
+        except Exception:
+            remote_socket.close()
+            raise
+
+    def _connect_via_pool(self, addr, proto, target_host, target_port, timeout):
+        """尝试用连接池中的预热连接完成隧道协商，失败或无可用连接时返回 None。"""
+        pooled = self._pool.acquire(addr)
+        if not pooled:
+            return None
+        remote_socket, greeted = pooled
+        try:
+            remote_socket.settimeout(min(timeout, self._pool.options['connect_timeout']))
+            negotiate(remote_socket, proto, target_host, target_port, greeted)
+            remote_socket.settimeout(None)
+            return remote_socket
+        except Exception:
             remote_socket.close()
             return None
 
     def _handle_http_client(self, client_socket):
-        """处理单个HTTP客户端连接。"""
-        remote_socket = None
+        """处理单个HTTP客户端连接，支持同一持久连接上的多个请求。"""
+        client = SocketReader(client_socket)
+        upstreams = {}  # (host, port) -> (socket, SocketReader)，同一客户端连接内按源站复用
         try:
-            request_data = client_socket.recv(8192)
-            if not request_data:
-                return
-
-            first_line = request_data.split(b'\r\n')[0].decode('utf-8', 'ignore')
-            method, url, _ = first_line.split()
-
-            if method == 'CONNECT':
-                target_host, target_port_str = url.split(':')
-                target_port = int(target_port_str)
-            else:
-                parsed_url = urlparse(url)
-                target_host = parsed_url.hostname
-                target_port = parsed_url.port or 80
-
-            remote_socket = self._get_upstream_connection(target_host, target_port)
-            if not remote_socket:
-                # 可以给客户端一个更友好的错误响应
-                client_socket.sendall(b'HTTP/1.1 502 Bad Gateway\r\n\r\n')
-                return
-
-            if method == 'CONNECT':
-                client_socket.sendall(b'HTTP/1.1 200 Connection Established\r\n\r\n')
-            else:
-                remote_socket.sendall(request_data)
-
-            self._forward_data(client_socket, remote_socket)
+            while self._running:
+                raw_head = client.read_head()
+                if raw_head is None:
+                    return
+                try:
+                    request = parse_head(raw_head, is_request=True)
+                except HttpParseError as e:
+                    self.log(f"[!] 无法解析 HTTP 请求: {e}")
+                    client_socket.sendall(BAD_REQUEST_RESPONSE)
+                    return
+
+                if request.method == 'CONNECT':
+                    self._handle_http_connect(client_socket, client, request)
+                    return
+                if not self._serve_http_request(client_socket, client, request, upstreams):
+                    return
         except Exception as e:
             if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError)):
                  self.log(f"处理 HTTP 请求时出错: {e}")
         finally:
-            if remote_socket: remote_socket.close()
+            for remote_socket, _ in upstreams.values():
+                remote_socket.close()
             if client_socket: client_socket.close()
 
+    def _handle_http_connect(self, client_socket, client, request):
+        """处理 CONNECT 请求：建立隧道后转为原始字节转发。"""
+        target_host, target_port_str = request.target.rsplit(':', 1)
+        remote_socket = self._get_upstream_connection(target_host, int(target_port_str))
+        if not remote_socket:
+            client_socket.sendall(BAD_GATEWAY_RESPONSE)
+            return
+        try:
+            client_socket.sendall(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+            pending = client.take_buffered()
+            if pending:
+                remote_socket.sendall(pending)
+            self._forward_data(client_socket, remote_socket)
+        finally:
+            remote_socket.close()
+
+    def _serve_http_request(self, client_socket, client, request, upstreams):
+        """
+        转发一个普通 HTTP 请求及其响应，返回客户端连接能否继续处理下一个请求。
+        非逐请求轮换模式下，发往同一源站的请求复用同一条上游连接。
+        """
+        client_keep_alive = request.keep_alive()
+        origin = request_origin(request)
+        request_mode, request_length = body_framing(request)
+        head_bytes = request.serialize()
+
+        upstream = None if self.rotate_per_request else upstreams.pop(origin, None)
+        reused = upstream is not None
+        raw_response = None
+        while True:
+            if upstream is None:
+                remote_socket = self._get_upstream_connection(*origin)
+                if not remote_socket:
+                    client_socket.sendall(BAD_GATEWAY_RESPONSE)
+                    return False
+                upstream = (remote_socket, SocketReader(remote_socket))
+            remote_socket, remote = upstream
+            try:
+                remote_socket.sendall(head_bytes)
+                if request_mode == 'none':
+                    raw_response = remote.read_head()
+                    if raw_response is None:
+                        raise ConnectionResetError("上游连接已关闭")
+                break
+            except (OSError, HttpParseError):
+                remote_socket.close()
+                upstream = None
+                # 复用的空闲连接可能已被源站关闭，无请求体时换一条新连接重试一次
+                if reused and request_mode == 'none':
+                    reused = False
+                    continue
+                raise
+
+        keep_upstream = False
+        try:
+            if request_mode != 'none':
+                if request.has_token('Expect', '100-continue'):
+                    raw_response = remote.read_head()
+                    if raw_response is not None and parse_head(raw_response, is_request=False).status == 100:
+                        client_socket.sendall(raw_response)
+                        raw_response = None
+                        forward_body(client, remote_socket, request_mode, request_length)
+                    else:
+                        # 源站拒绝了请求体，客户端连接上残留的请求体无法再可靠分帧
+                        client_keep_alive = False
+                else:
+                    forward_body(client, remote_socket, request_mode, request_length)
+
+            while True:
+                if raw_response is None:
+                    raw_response = remote.read_head()
+                    if raw_response is None:
+                        raise HttpParseError("上游未返回响应")
+                response = parse_head(raw_response, is_request=False)
+                if 100 <= response.status < 200 and response.status != 101:
+                    client_socket.sendall(raw_response)  # 转发临时响应，继续等待最终响应
+                    raw_response = None
+                    continue
+                break
+            client_socket.sendall(raw_response)
+
+            if response.status == 101:
+                # 协议升级 (如 WebSocket)：之后的数据不再是 HTTP 报文
+                pending = remote.take_buffered()
+                if pending:
+                    client_socket.sendall(pending)
+                pending = client.take_buffered()
+                if pending:
+                    remote_socket.sendall(pending)
+                self._forward_data(client_socket, remote_socket)
+                return False
+
+            response_mode, response_length = body_framing(response, request.method)
+            forward_body(remote, client_socket, response_mode, response_length)
+
+            keep_upstream = (client_keep_alive and response_mode != 'close' and response.keep_alive()
+                             and not self.rotate_per_request)
+            if keep_upstream:
+                upstreams[origin] = upstream
+                while len(upstreams) > MAX_UPSTREAMS_PER_CLIENT:
+                    stale_socket, _ = upstreams.pop(next(iter(upstreams)))
+                    stale_socket.close()
+            return client_keep_alive and response_mode != 'close'
+        finally:
+            if not keep_upstream:
+                remote_socket.close()
+
     def _handle_socks5_client(self, client_socket):
         """处理单个SOCKS5客户端连接。"""
         remote_socket = None
@@ -232,17 +402,5 @@ class ProxyServer:
             if client_socket: client_socket.close()
 
     def _forward_data(self, sock1, sock2):
-        """在两个socket之间双向转发数据，直到任意一方关闭。"""
-        while self._running:
-            try:
-                readable, _, exceptional = select.select([sock1, sock2], [], [sock1, sock2], 5)
-                if exceptional or not readable:
-                    break
-                for sock in readable:
-                    other_sock = sock2 if sock is sock1 else sock1
-                    data = sock.recv(8192)
-                    if not data:
-                        return
-                    other_sock.sendall(data)
-            except (ConnectionResetError, BrokenPipeError, OSError, select.error):
-                break
+        """在两个socket之间双向转发数据，直到任意一方关闭或空闲超时。"""
+        self._relay.forward(sock1, sock2, is_running=lambda: self._running)
@@ -0,0 +1,133 @@
+# modules/sources.py
+
+import json
+import os
+import statistics
+import threading
+import time
+
+DEFAULT_SOURCE_STATS_OPTIONS = {
+    'enabled': True,
+    'window': 10,               # 按最近多少轮刷新统计产出
+    'disable_after_runs': 5,    # 连续多少轮没有产出可用代理 (含抓取失败) 后停用该源
+    'retry_hours': 24,          # 停用多久后再试一轮，仍无产出则继续停用
+    'path': '',                 # 快照文件路径，为空时不持久化
+}
+
+# 产出率 = (可用数 + 先验可用数) / (去重后数 + 先验候选数)：没有历史的源按约 5% 估计，既不会被排到最后，也不会压过已证明高产的源
+_PRIOR_WORKING = 1
+_PRIOR_UNIQUE = 20
+_RUN_FIELDS = ('fetched', 'unique', 'alive', 'working', 'latency_ms', 'time')
+
+
+def source_name(source) -> str:
+    """在线源为其 URL，爬虫源为抓取函数名 (去掉前导下划线)。"""
+    if isinstance(source, str):
+        return source
+    return getattr(source, '__name__', repr(source)).lstrip('_')
+
+
+class SourceStats:
+    """
+    各代理源的产出统计。每轮刷新结束时记录每个源的抓取数、去重后首次贡献的候选数、预检通过数、验证通过数
+    与验证通过代理的延迟中位数，保留最近 window 轮；据此给出源的产出率，供刷新时优先验证高产源的候选。
+    连续 disable_after_runs 轮没有产出可用代理的源被停用 retry_hours 小时，之后再试一轮。
+    线程安全；可保存到磁盘快照并在启动时重新载入。
+    """
+    def __init__(self, options=None):
+        self.options = dict(DEFAULT_SOURCE_STATS_OPTIONS)
+        if options:
+            self.options.update(options)
+        self._sources = {}   # 源名 -> {'runs': [[fetched, unique, alive, working, latency_ms, time], ...], 'disabled_until': 时间戳}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if self.options['path']:
+            self.load()
+
+    def configure(self, options):
+        """更新参数；快照路径改变时载入新快照。"""
+        path = self.options['path']
+        with self._lock:
+            self.options.update(options)
+        if self.options['path'] and self.options['path'] != path:
+            self.load()
+
+    def enabled(self, name: str) -> bool:
+        """该源当前是否参与抓取。"""
+        if not self.options['enabled']:
+            return True
+        state = self._sources.get(name)
+        return state is None or state.get('disabled_until', 0) <= time.time()
+
+    def yield_rate(self, name: str) -> float:
+        """最近 window 轮中验证通过数与去重后候选数之比 (带先验平滑)。"""
+        state = self._sources.get(name)
+        runs = state['runs'] if state else ()
+        working = sum(run[3] for run in runs)
+        unique = sum(run[1] for run in runs)
+        return (working + _PRIOR_WORKING) / (unique + _PRIOR_UNIQUE)
+
+    def record_run(self, name: str, fetched: int, unique: int, alive: int, working: int, latencies=()):
+        """记录一个源在一轮刷新中的产出；返回该源是否因此被停用。"""
+        options = self.options
+        now = time.time()
+        latency_ms = round(statistics.median(latencies) * 1000, 1) if latencies else None
+        with self._lock:
+            state = self._sources.setdefault(name, {'runs': [], 'disabled_until': 0})
+            state['runs'].append([fetched, unique, alive, working, latency_ms, round(now)])
+            del state['runs'][:-options['window']]
+            self._dirty = True
+            recent = state['runs'][-options['disable_after_runs']:]
+            if (options['enabled'] and options['disable_after_runs'] and len(recent) >= options['disable_after_runs']
+                    and not any(run[3] for run in recent)):
+                state['disabled_until'] = now + options['retry_hours'] * 3600
+                return True
+            state['disabled_until'] = 0
+            return False
+
+    def report(self):
+        """按产出率降序返回各源的汇总: 名称、最近 window 轮的各项合计与延迟中位数、产出率与是否停用。"""
+        with self._lock:
+            names = list(self._sources)
+        rows = []
+        for name in names:
+            state = self._sources[name]
+            runs = state['runs']
+            row = {'source': name, 'runs': len(runs)}
+            for i, field in enumerate(_RUN_FIELDS[:4]):
+                row[field] = sum(run[i] for run in runs)
+            latencies = [run[4] for run in runs if run[4] is not None]
+            row['median_latency_ms'] = statistics.median(latencies) if latencies else None
+            row['yield'] = round(self.yield_rate(name), 4)
+            row['disabled'] = not self.enabled(name)
+            rows.append(row)
+        rows.sort(key=lambda row: row['yield'], reverse=True)
+        return rows
+
+    # --- 持久化 ---
+    def load(self):
+        """从快照文件载入统计，文件不存在或损坏时忽略。"""
+        path = self.options['path']
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for name, state in data.items():
+                if isinstance(state, dict) and isinstance(state.get('runs'), list):
+                    self._sources.setdefault(name, {'runs': state['runs'][-self.options['window']:],
+                                                    'disabled_until': state.get('disabled_until', 0)})
+
+    def save(self):
+        """有新记录时把统计写入快照文件 (先写临时文件再替换)。"""
+        path = self.options['path']
+        if not path or not self._dirty:
+            return
+        with self._lock:
+            data = json.dumps(self._sources, ensure_ascii=False)
+            self._dirty = False
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
@@ -0,0 +1,237 @@
+# modules/throughput.py
+
+import asyncio
+import socket
+import statistics
+import threading
+import time
+
+from core.judge import PAYLOAD_PATH
+
+DEFAULT_THROUGHPUT_OPTIONS = {
+    'max_bytes': 256 * 1024,    # 单次测速最多下载的字节数
+    'max_seconds': 5.0,         # 单次测速的时间上限 (秒，含建立连接与等待首字节)
+    'bandwidth_mbps': 0,        # 所有并行测速合计的带宽预算 (Mbps)，0 为不限
+    'url': '',                  # 测速地址，为空时使用验证目标的 speed_check (评判服务按 max_bytes 取负载大小)
+}
+
+_CHUNK_SIZE = 8192
+_SLICES = 4               # 计算稳定度时把稳态传输分成的时间片数
+_BURST_SECONDS = 1.0      # 带宽预算空闲后最多积攒的额度 (秒)
+_WAIT_POLL_INTERVAL = 0.2
+
+
+class BudgetReached(Exception):
+    """测速达到字节或时间上限，用于从读取报文体的循环中跳出。"""
+
+
+class ThroughputMeter:
+    """
+    记录一次测速的到达字节与时间。吞吐量只按稳态传输计算：从首个数据块到达起算，首块本身不计，
+    因此不含建立连接与首字节等待；数据只有一块时退化为按总耗时计算，置信度为 0。
+    """
+    __slots__ = ('max_bytes', 'max_seconds', 'started', 'size', '_samples')
+
+    def __init__(self, max_bytes: int, max_seconds: float):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.started = time.monotonic()
+        self.size = 0
+        self._samples = []   # (到达时间, 累计字节数)
+
+    def feed(self, count: int) -> bool:
+        """记录到达的 count 个字节，返回是否还应继续读取。"""
+        self.size += count
+        now = time.monotonic()
+        self._samples.append((now, self.size))
+        return self.size < self.max_bytes and now - self.started < self.max_seconds
+
+    def remaining(self) -> float:
+        """距时间上限还剩的秒数。"""
+        return max(self.max_seconds - (time.monotonic() - self.started), 0.0)
+
+    def transfer_time(self) -> float:
+        """首个数据块到最后一个数据块之间的秒数。"""
+        return self._samples[-1][0] - self._samples[0][0] if self._samples else 0.0
+
+    def result(self):
+        """返回 (Mbps, 置信度 0~1)，没有收到数据时为 (0, 0)。"""
+        samples = self._samples
+        if not samples:
+            return 0, 0.0
+        (first_time, first_size), (last_time, last_size) = samples[0], samples[-1]
+        duration, size = last_time - first_time, last_size - first_size
+        if duration <= 0 or size <= 0:
+            total = last_time - self.started
+            return (self.size / total * 8 / (1000**2) if total > 0 else 0), 0.0
+        mbps = size / duration * 8 / (1000**2)
+        # 数据量或时长接近上限时样本充分；各时间片速率越平稳，结果越可信
+        volume = max(min(size / self.max_bytes, 1.0), min(duration / self.max_seconds, 1.0))
+        return mbps, round(volume * self._stability(first_time, duration), 2)
+
+    def _stability(self, first_time, duration) -> float:
+        if len(self._samples) <= _SLICES:
+            return 0.5
+        slices = [0] * _SLICES
+        previous = self._samples[0][1]
+        for at, size in self._samples[1:]:
+            slices[min(int((at - first_time) / duration * _SLICES), _SLICES - 1)] += size - previous
+            previous = size
+        mean = statistics.fmean(slices)
+        return 1 / (1 + statistics.pstdev(slices) / mean) if mean else 0.0
+
+
+def interrupt_at_deadline(meter: ThroughputMeter, sock) -> threading.Timer:
+    """
+    在 meter 的时间上限到达时关闭 sock 的读写，使阻塞中的读取立即返回：套接字超时只限制单次读取，
+    数据断续到达时整次测速仍可能远超上限。返回已启动的定时器，读取结束后应 cancel()。
+    """
+    def _interrupt():
+        try:
+            getattr(sock, 'socket', sock).shutdown(socket.SHUT_RDWR)  # TLS-in-TLS 时 sock 为 SSLTransport
+        except (AttributeError, OSError):
+            pass
+
+    timer = threading.Timer(meter.remaining(), _interrupt)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class MeterSink:
+    """forward_body / async_forward_body 的写端：把报文体计入 meter，达到上限时抛出 BudgetReached。"""
+    __slots__ = ('meter', 'size')
+
+    def __init__(self, meter: ThroughputMeter):
+        self.meter = meter
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if not self.meter.feed(len(data)):
+            raise BudgetReached()
+
+    sendall = write
+
+    async def drain(self):
+        pass
+
+
+class BandwidthBudget:
+    """
+    全局带宽预算 (虚拟时钟令牌桶)：每次测速开始前预订其字节上限，预订按到达顺序排队，
+    平均速率不超过 mbps，空闲后最多积攒 _BURST_SECONDS 的额度；测速结束后退还未用完的部分。
+    测速一旦开始就不再限速，测得的是代理本身的速率。线程与 asyncio 协程共用。
+    """
+    def __init__(self, mbps: float):
+        self.rate = mbps * 1000**2 / 8   # 字节/秒
+        self._next = 0.0                  # 下一笔预订可以开始的时间
+        self._lock = threading.Lock()
+
+    def _reserve(self, nbytes: int) -> float:
+        """预订 nbytes，返回需要等待的秒数。"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now - _BURST_SECONDS)
+            self._next = start + nbytes / self.rate
+            return start - now
+
+    def refund(self, nbytes: int):
+        with self._lock:
+            self._next -= nbytes / self.rate
+
+    def acquire(self, nbytes: int, cancel_event=None) -> bool:
+        """等到预订的额度可用；cancel_event 被设置时退还预订并返回 False。"""
+        deadline = time.monotonic() + self._reserve(nbytes)
+        while (delay := deadline - time.monotonic()) > 0:
+            if cancel_event and cancel_event.is_set():
+                self.refund(nbytes)
+                return False
+            time.sleep(min(delay, _WAIT_POLL_INTERVAL))
+        return True
+
+    async def async_acquire(self, nbytes: int):
+        delay = self._reserve(nbytes)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.refund(nbytes)
+                raise
+
+
+class ThroughputProbe:
+    """
+    有上限的测速：每次最多下载 max_bytes 字节、最多 max_seconds 秒，先到者为准；
+    配置了 bandwidth_mbps 时所有并行测速共用一个全局带宽预算，避免占满本机上行。
+    用法: meter = admit() → 读取报文体并 feed(或经 MeterSink) → settle(meter) → meter.result()。
+    """
+    def __init__(self, options=None):
+        self.options = dict(DEFAULT_THROUGHPUT_OPTIONS)
+        self.budget = None
+        self.configure(options or {})
+
+    def configure(self, options):
+        self.options.update(options)
+        mbps = self.options['bandwidth_mbps']
+        self.budget = BandwidthBudget(mbps) if mbps else None
+
+    def url(self, targets: dict) -> str:
+        """
+        本次测速的下载地址：配置的 url，否则为 targets['speed_check']，评判服务的测速负载按 max_bytes 取大小。
+        不使用延迟检测站点，其响应大小未知且通常远小于字节上限。
+        """
+        if self.options['url']:
+            return self.options['url']
+        speed_url = targets['speed_check']
+        if speed_url.endswith(PAYLOAD_PATH):
+            return f"{speed_url[:-len(PAYLOAD_PATH)]}/bytes/{self.options['max_bytes']}"
+        return speed_url
+
+    def _meter(self) -> ThroughputMeter:
+        return ThroughputMeter(self.options['max_bytes'], self.options['max_seconds'])
+
+    def admit(self, cancel_event=None):
+        """在带宽预算内开始一次测速，返回 ThroughputMeter；等待期间被取消时返回 None。"""
+        if self.budget is not None and not self.budget.acquire(self.options['max_bytes'], cancel_event):
+            return None
+        return self._meter()
+
+    async def async_admit(self) -> ThroughputMeter:
+        if self.budget is not None:
+            await self.budget.async_acquire(self.options['max_bytes'])
+        return self._meter()
+
+    def settle(self, meter: ThroughputMeter):
+        """测速结束：退还预订中未用完的字节。"""
+        if self.budget is not None and meter.size < meter.max_bytes:
+            self.budget.refund(meter.max_bytes - meter.size)
+
+    def measure(self, session, url, proxies, connect_timeout, cancel_event=None):
+        """
+        经由 requests 会话测速，返回 (Mbps, 置信度)；被取消时返回 None。
+        请求失败时抛出异常；报文体读到一半出错 (如读超时) 时按已收到的部分计算。
+        收到响应头后按 max_seconds 的剩余时间设置定时器，到期时中断读取。
+        """
+        meter = self.admit(cancel_event)
+        if meter is None:
+            return None
+        try:
+            response = session.get(url, proxies=proxies, timeout=(connect_timeout, meter.remaining()), stream=True)
+            timer = interrupt_at_deadline(meter, getattr(getattr(response.raw, 'connection', None), 'sock', None))
+            try:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=_CHUNK_SIZE):
+                    if cancel_event and cancel_event.is_set():
+                        return None
+                    if not meter.feed(len(chunk)):
+                        break
+            except Exception:
+                if not meter.size:
+                    raise
+            finally:
+                timer.cancel()
+                response.close()  # 达到上限时不再读取剩余部分
+        finally:
+            self.settle(meter)
+        return meter.result()
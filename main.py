@@ -12,6 +12,7 @@ import time
 sys.path.append(os.path.join(os.path.dirname(__file__), 'modules'))
 
 from proxy_manager import ProxyManager
+from core.judge import JudgeServer
 import hq # 导入 hq 模块
 
 # 默认配置
@@ -27,10 +28,21 @@ def load_config(config_path):
         print(f"[警告] 配置文件 {config_path} 不存在，使用默认配置。")
         return {}
 
+def start_judge_server(config, log_queue, force=False):
+    """按 validation.judge_server 配置启动内置评判服务，未启用时返回 None"""
+    judge_config = config.get('validation', {}).get('judge_server', {})
+    if not (force or judge_config.get('enabled')):
+        return None
+    server = JudgeServer(judge_config.get('host', '0.0.0.0'), judge_config.get('port', 8899), log_queue, judge_config)
+    server.start()
+    return server
+
 def run_proxy_service(config, log_queue):
     """运行本地代理服务"""
+    judge_server = start_judge_server(config, log_queue)
     pm = ProxyManager(timeout=config.get('validation', {}).get('timeout', 5))
     pm.set_log_queue(log_queue)
+    pm.set_validation_options(config.get('validation', {}))
     
     # 初始刷新一次代理
     print("[*] 初始刷新代理...")
@@ -40,15 +52,25 @@ def run_proxy_service(config, log_queue):
     http_config = config.get('proxy_server', {}).get('http', {})
     socks5_config = config.get('proxy_server', {}).get('socks5', {})
     auto_refresh = config.get('proxy_server', {}).get('auto_refresh_minutes', 0)
+    engine = config.get('proxy_server', {}).get('engine', 'threaded')
+    relay_options = config.get('proxy_server', {}).get('relay', {})
+    pool_options = config.get('proxy_server', {}).get('upstream_pool', {})
+    failover_options = config.get('proxy_server', {}).get('failover', {})
+    pm.set_selection_mode(config.get('proxy_server', {}).get('selection', 'round_robin'))
+    pm.set_breaker_options(config.get('proxy_server', {}).get('circuit_breaker', {}))
     
     pm.start_local_proxy_service(
         http_host=http_config.get('host', '127.0.0.1'),
         http_port=http_config.get('port', 8888),
         socks5_host=socks5_config.get('host', '127.0.0.1'),
         socks5_port=socks5_config.get('port', 1080),
-        auto_refresh_minutes=auto_refresh
+        auto_refresh_minutes=auto_refresh,
+        engine=engine,
+        relay_options=relay_options,
+        pool_options=pool_options,
+        failover_options=failover_options
     )
-    print("[*] 本地代理服务已启动。")
+    print(f"[*] 本地代理服务已启动 (引擎: {engine})。")
     print(f"    HTTP 代理: {http_config.get('host', '127.0.0.1')}:{http_config.get('port', 8888)}")
     print(f"    SOCKS5 代理: {socks5_config.get('host', '127.0.0.1')}:{socks5_config.get('port', 1080)}")
     if auto_refresh > 0:
@@ -63,16 +85,34 @@ def run_proxy_service(config, log_queue):
     except KeyboardInterrupt:
         print("\n[*] 正在停止服务...")
         pm.stop_local_proxy_service()
+        if judge_server:
+            judge_server.stop()
         print("[*] 服务已停止。")
 
-def run_cli_refresh(config, log_queue):
-    """运行CLI刷新代理"""
+def run_cli_refresh(config, log_queue, deadline=None):
+    """运行CLI刷新代理，deadline 为时间预算 (秒)，为 None 时使用配置中的 validation.deadline_seconds"""
+    judge_server = start_judge_server(config, log_queue)
     pm = ProxyManager(timeout=config.get('validation', {}).get('timeout', 5))
     pm.set_log_queue(log_queue)
+    pm.set_validation_options(config.get('validation', {}))
     print("[*] 开始刷新代理...")
-    count = pm.refresh_proxies(log_queue)
+    try:
+        count = pm.refresh_proxies(log_queue, deadline=deadline)
+    finally:
+        if judge_server:
+            judge_server.stop()
     print(f"[+] 完成，共获取并验证 {count} 个可用代理。")
 
+def run_judge_server(config, log_queue):
+    """单独运行评判服务，供其他机器上的验证进程使用"""
+    judge_server = start_judge_server(config, log_queue, force=True)
+    print("[*] 按 Ctrl+C 停止评判服务。")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        judge_server.stop()
+
 def run_hq_fetch(log_queue, output_dir):
     """运行hq.py获取代理"""
     print("[*] 开始通过 hq.py 获取代理...")
@@ -113,8 +153,9 @@ def log_consumer(log_queue, stop_event, interval=DEFAULT_LOG_INTERVAL):
 def main():
     parser = argparse.ArgumentParser(description="全能代理管理器")
     parser.add_argument('--config', type=str, default=DEFAULT_CONFIG_PATH, help='配置文件路径')
-    parser.add_argument('--mode', choices=['service', 'refresh', 'hq'], default='service', help='运行模式: service (启动代理服务), refresh (CLI刷新), hq (运行hq.py)')
+    parser.add_argument('--mode', choices=['service', 'refresh', 'hq', 'judge'], default='service', help='运行模式: service (启动代理服务), refresh (CLI刷新), hq (运行hq.py), judge (单独运行评判服务)')
     parser.add_argument('--output-dir', type=str, help='hq模式下指定输出目录')
+    parser.add_argument('--deadline', type=float, help='refresh模式下的时间预算 (秒)，到期后返回已验证的代理')
     parser.add_argument('--log-interval', type=float, default=DEFAULT_LOG_INTERVAL, help='日志打印间隔 (秒)')
     
     args = parser.parse_args()
@@ -133,10 +174,12 @@ def main():
         if args.mode == 'service':
             run_proxy_service(config, log_queue)
         elif args.mode == 'refresh':
-            run_cli_refresh(config, log_queue)
+            run_cli_refresh(config, log_queue, args.deadline)
         elif args.mode == 'hq':
             output_dir = args.output_dir if args.output_dir else os.getcwd()
             run_hq_fetch(log_queue, output_dir)
+        elif args.mode == 'judge':
+            run_judge_server(config, log_queue)
     finally:
         # 请求停止日志线程
         stop_event.set()
@@ -3,21 +3,34 @@
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 import re
 from bs4 import BeautifulSoup
 import json
 import time
 import threading
-from collections import defaultdict
-import socket
 import subprocess
-import select
-import socks
-from urllib.parse import urlparse
-import struct
 
-class ProxyManager:
+from core.rotator import ProxyRotator
+from core.server import ProxyServer as CoreProxyServer
+from core.async_server import AsyncProxyServer
+from core.async_checker import DEFAULT_CONCURRENCY, AsyncProxyChecker
+from core.concurrency import (DEFAULT_ADAPTIVE_OPTIONS, AdaptiveSemaphore, LocalExhaustionError, log_levels,
+                              make_controller, raise_if_local_exhaustion, release_proxy_pool, run_adaptive)
+from core.detect import DEFAULT_DETECT_TIMEOUT, detect_protocols
+from core.geocache import LocationCache
+from core.geoip import GeoIPDatabase
+from core.judge import JudgePool
+from core.negcache import NegativeCache
+from core.pipeline import DEFAULT_DEADLINE_GRACE, DEFAULT_FETCH_WORKERS, DEFAULT_QUEUE_SIZE, RefreshPipeline
+from core.precheck import DEFAULT_PRECHECK_CONCURRENCY, DEFAULT_PRECHECK_TIMEOUT, pre_check
+from core.revalidator import DEFAULT_REVALIDATION_OPTIONS, Revalidator
+from core.sources import SourceStats, source_name
+from core.probe import PROBE_MODES, single_connection_check
+from core.profiles import load_profiles, run_profiles
+from core.throughput import ThroughputProbe
+
+class ProxyManager(ProxyRotator):
     """全能代理管理器，负责获取、验证、管理、轮换和筛选代理。"""
 
     def __init__(self, timeout: int = 5):
@@ -101,17 +114,28 @@ class ProxyManager:
             'Vietnam': '越南',
             'Thailand': '泰国',
         }
-        self.location_cache = {}
+        self.location_cache = LocationCache()  # 有上限、带过期与磁盘快照的地理位置缓存
+        self.negative_cache = NegativeCache()  # 近期失效候选，刷新时在预检前跳过 (见 core.negcache)
+        self.source_stats = SourceStats()  # 各源的产出统计，用于排定验证顺序与停用无产出的源 (见 core.sources)
+        self.throughput = ThroughputProbe()  # 有字节/时间上限与全局带宽预算的测速 (见 core.throughput)
         self.public_ip = None
-
-        # --- 初始化 Rotator 部分 ---
-        self.all_proxies = []
-        self.proxies_by_country = defaultdict(list)
-        self.indices = defaultdict(lambda: -1)
-        self.current_proxy = None
-        self.lock = threading.Lock()
-        self.current_filter_region = "All"
-        self.current_filter_quality_latency_ms = None
+        self.judge_pool = None  # 配置了评判服务时替代 validation_targets
+        self.validation_profiles = {}  # 验证画像: 名称 -> 业务目标、超时与评分权重 (见 core.profiles)
+        self.geoip = None  # 离线 IP 库 (core.geoip.GeoIPDatabase)，优先于在线 API
+        self.geoip_online_fallback = True  # 离线库未收录时是否再查询在线 API
+        # 验证引擎: 'threaded' 使用 max_workers 个线程，'asyncio' 使用 concurrency 个协程
+        self.validation_options = {'engine': 'threaded', 'max_workers': 100, 'concurrency': DEFAULT_CONCURRENCY,
+                                   'precheck_timeout': DEFAULT_PRECHECK_TIMEOUT,
+                                   'precheck_concurrency': DEFAULT_PRECHECK_CONCURRENCY, 'probe': 'separate',
+                                   'queue_size': DEFAULT_QUEUE_SIZE, 'fetch_workers': DEFAULT_FETCH_WORKERS,
+                                   'detect_protocol': True,
+                                   'detect_timeout': DEFAULT_DETECT_TIMEOUT, 'adaptive': dict(DEFAULT_ADAPTIVE_OPTIONS),
+                                   'revalidation': dict(DEFAULT_REVALIDATION_OPTIONS),
+                                   'deadline_seconds': 0, 'deadline_grace_seconds': DEFAULT_DEADLINE_GRACE}
+        self.revalidator = None  # 后台增量重新验证 (core.revalidator.Revalidator)，随本地代理服务启停
+
+        # --- 初始化 Rotator 部分 (索引与轮换逻辑见 core.rotator.ProxyRotator) ---
+        ProxyRotator.__init__(self)
 
         # --- 初始化 Logger ---
         self.log_queue = None  # 外部传入或默认队列
@@ -204,186 +228,13 @@ class ProxyManager:
 
 
     # ========== ProxyServer 内嵌实现 ==========
-    class ProxyServer:
-        def __init__(self, manager, http_host, http_port, socks5_host, socks5_port, log_queue):
+    class ProxyServer(CoreProxyServer):
+        """复用 core.server.ProxyServer 的线程版实现，由管理器自身充当轮换器。"""
+        def __init__(self, manager, http_host, http_port, socks5_host, socks5_port, log_queue, relay_options=None,
+                     pool_options=None, failover_options=None):
+            super().__init__(http_host, http_port, socks5_host, socks5_port, manager, log_queue, relay_options,
+                             pool_options, failover_options)
             self.manager = manager
-            self._log_queue = log_queue
-            self._running = False
-            self._http_host = http_host
-            self._http_port = http_port
-            self._http_server_socket = None
-            self._http_thread = None
-            self._socks5_host = socks5_host
-            self._socks5_port = socks5_port
-            self._socks5_server_socket = None
-            self._socks5_thread = None
-            self.rotate_per_request = False
-
-        def log(self, message):
-            self._log_queue.put(f"[Server] {message}")
-
-        def set_rotation_mode(self, per_request: bool):
-            self.rotate_per_request = per_request
-            mode = "逐请求轮换" if per_request else "固定当前"
-            self.log(f"服务轮换模式已切换为: {mode}")
-
-        def start_all(self):
-            if self._running:
-                return
-            self._running = True
-            self._http_thread = threading.Thread(target=self._run_http_server, daemon=True)
-            self._http_thread.start()
-            self._socks5_thread = threading.Thread(target=self._run_socks5_server, daemon=True)
-            self._socks5_thread.start()
-            self.log(f"HTTP 服务启动于 {self._http_host}:{self._http_port}")
-            self.log(f"SOCKS5 服务启动于 {self._socks5_host}:{self._socks5_port}")
-
-        def stop_all(self):
-            if not self._running:
-                return
-            self._running = False
-            for sock in [self._http_server_socket, self._socks5_server_socket]:
-                if sock: sock.close()
-            for t in [self._http_thread, self._socks5_thread]:
-                if t and t.is_alive(): t.join()
-            self.log("所有代理服务已停止。")
-
-        def _get_upstream_connection(self, target_host, target_port):
-            if self.rotate_per_request:
-                proxy_info = self.manager.get_next_proxy()
-            else:
-                proxy_info = self.manager.get_current_proxy()
-            if not proxy_info:
-                self.log("[!] 代理池为空")
-                return None
-            addr = proxy_info.get('proxy')
-            proto = proxy_info.get('protocol', 'SOCKS5')
-            if not addr:
-                return None
-            upstream_addr, upstream_port_str = addr.split(':')
-            proxy_type_map = {'HTTP': socks.HTTP, 'SOCKS4': socks.SOCKS4, 'SOCKS5': socks.SOCKS5}
-            upstream_protocol = proxy_type_map.get(proto.upper())
-            if not upstream_protocol:
-                self.log(f"[!] 不支持协议: {proto}")
-                return None
-            remote_socket = socks.socksocket()
-            try:
-                remote_socket.set_proxy(proxy_type=upstream_protocol, addr=upstream_addr, port=int(upstream_port_str))
-                remote_socket.connect((target_host, target_port))
-                return remote_socket
-            except Exception as e:
-                self.log(f"[!] 代理 {addr} 连接失败: {e}")
-                remote_socket.close()
-                return None
-
-        def _forward_data(self, sock1, sock2):
-            while self._running:
-                try:
-                    readable, _, exceptional = select.select([sock1, sock2], [], [sock1, sock2], 5)
-                    if exceptional or not readable: break
-                    for sock in readable:
-                        other = sock2 if sock is sock1 else sock1
-                        data = sock.recv(8192)
-                        if not data: return
-                        other.sendall(data)
-                except: break
-
-        def _handle_http_client(self, client_socket):
-            remote_socket = None
-            try:
-                data = client_socket.recv(8192)
-                if not data: return
-                first_line = data.split(b'\r\n')[0].decode('utf-8', 'ignore')
-                method, url, _ = first_line.split()
-                if method == 'CONNECT':
-                    host, port_str = url.split(':')
-                    port = int(port_str)
-                else:
-                    parsed = urlparse(url)
-                    host = parsed.hostname
-                    port = parsed.port or 80
-                remote_socket = self._get_upstream_connection(host, port)
-                if not remote_socket:
-                    client_socket.sendall(b'HTTP/1.1 502 Bad Gateway\r\n\r\n')
-                    return
-                if method == 'CONNECT':
-                    client_socket.sendall(b'HTTP/1.1 200 Connection Established\r\n\r\n')
-                else:
-                    remote_socket.sendall(data)
-                self._forward_data(client_socket, remote_socket)
-            except Exception as e:
-                if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError)):
-                    self.log(f"HTTP处理异常: {e}")
-            finally:
-                if remote_socket: remote_socket.close()
-                if client_socket: client_socket.close()
-
-        def _handle_socks5_client(self, client_socket):
-            remote_socket = None
-            try:
-                data = client_socket.recv(2)
-                if not data or data[0] != 5: return
-                nmethods = data[1]
-                client_socket.recv(nmethods)
-                client_socket.sendall(b"\x05\x00")
-                data = client_socket.recv(4)
-                if not data or data[0] != 5 or data[1] != 1: return
-                atyp = data[3]
-                if atyp == 1:
-                    addr = socket.inet_ntoa(client_socket.recv(4))
-                elif atyp == 3:
-                    domain_len = client_socket.recv(1)[0]
-                    addr = client_socket.recv(domain_len).decode('utf-8')
-                else:
-                    client_socket.sendall(b"\x05\x08\x00\x01\x00\x00\x00\x00\x00\x00")
-                    return
-                port = struct.unpack('!H', client_socket.recv(2))[0]
-                remote_socket = self._get_upstream_connection(addr, port)
-                if not remote_socket:
-                    client_socket.sendall(b"\x05\x04\x00\x01\x00\x00\x00\x00\x00\x00")
-                    return
-                client_socket.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
-                self._forward_data(client_socket, remote_socket)
-            except Exception as e:
-                if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError)):
-                    self.log(f"SOCKS5处理异常: {e}")
-            finally:
-                if remote_socket: remote_socket.close()
-                if client_socket: client_socket.close()
-
-        def _run_http_server(self):
-            try:
-                self._http_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self._http_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                self._http_server_socket.bind((self._http_host, self._http_port))
-                self._http_server_socket.listen(20)
-            except Exception as e:
-                self.log(f"[!] HTTP启动失败: {e}")
-                return
-            while self._running:
-                try:
-                    client, _ = self._http_server_socket.accept()
-                    threading.Thread(target=self._handle_http_client, args=(client,), daemon=True).start()
-                except OSError: break
-
-        def _run_socks5_server(self):
-            try:
-                self._socks5_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self._socks5_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                self._socks5_server_socket.bind((self._socks5_host, self._socks5_port))
-                self._socks5_server_socket.listen(20)
-            except Exception as e:
-                self.log(f"[!] SOCKS5启动失败: {e}")
-                return
-            while self._running:
-                try:
-                    client, _ = self._socks5_server_socket.accept()
-                    threading.Thread(target=self._handle_socks5_client, args=(client,), daemon=True).start()
-                except OSError: break
-        
-        # 保存当前激活的过滤器状态
-        self.current_filter_region = "All"
-        self.current_filter_quality_latency_ms = None
 
     def _create_robust_session(self):
         """为Fetcher创建一个健壮的requests会话。"""
@@ -607,49 +458,63 @@ class ProxyManager:
             log_queue.put(f"[!] (Scrape) 从 {display_url} 获取失败: {e}")
             return None
 
-    def fetch_all_proxies(self, log_queue, cancel_event=None):
+    def iter_fetched_proxies(self, log_queue, cancel_event=None):
         """
-        从所有在线和爬虫源获取代理。
-        返回一个字典，包含'http', 'socks4', 'socks5'类型的代理列表。
+        并发请求所有在线和爬虫源，按完成顺序逐个产出 (协议, 代理列表, 源名)，'https' 源归入 'http'；
+        抓取失败或没有结果的源产出空列表。被 source_stats 停用的源跳过 (见 core.sources)。
+        生成器被提前关闭或 cancel_event 被设置时不再等待剩余的源。
+        同时抓取的源数由 validation_options['fetch_workers'] 限制，不受自适应并发控制。
         """
-        all_proxies = {'http': set(), 'https': set(), 'socks4': set(), 'socks5': set()}
-        
-        executor = ThreadPoolExecutor(max_workers=50)
+        executor = ThreadPoolExecutor(max_workers=self.validation_options['fetch_workers'])
         try:
             future_to_protocol = {}
+            skipped = 0
             # 提交API源任务
             for protocol, urls in self.online_sources.items():
                 for url in urls:
                     if cancel_event and cancel_event.is_set(): break
+                    if not self.source_stats.enabled(url):
+                        skipped += 1
+                        continue
                     future = executor.submit(self._fetch_from_url, url, log_queue)
-                    future_to_protocol[future] = protocol
+                    future_to_protocol[future] = (protocol, url)
                 if cancel_event and cancel_event.is_set(): break
             
             # 提交爬虫源任务
             if not (cancel_event and cancel_event.is_set()):
                 for source in self.scraping_sources:
                     if cancel_event and cancel_event.is_set(): break
+                    name = source_name(source['func'])
+                    if not self.source_stats.enabled(name):
+                        skipped += 1
+                        continue
                     future = executor.submit(source['func'], log_queue)
-                    future_to_protocol[future] = source['protocol']
-            # 处理已完成的future
-            for future in as_completed(future_to_protocol):
-                if cancel_event and cancel_event.is_set():
-                    break
-                protocol = future_to_protocol[future]
-                try:
-                    proxies = future.result()
-                    if proxies:
-                        if protocol == 'https':
-                            all_proxies['http'].update(proxies)
-                        else:
-                            all_proxies[protocol].update(proxies)
-                except Exception as exc:
-                    log_queue.put(f'[!] 获取器线程产生一个错误: {exc}')
+                    future_to_protocol[future] = (source['protocol'], name)
+            if skipped:
+                log_queue.put(f"[Manager] 跳过 {skipped} 个近期没有产出可用代理的源。")
+            # 处理已完成的future，定时醒来检查 cancel_event，不被慢速源拖住
+            pending = set(future_to_protocol)
+            while pending and not (cancel_event and cancel_event.is_set()):
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    protocol, name = future_to_protocol[future]
+                    try:
+                        proxies = future.result()
+                    except Exception as exc:
+                        log_queue.put(f'[!] 获取器线程产生一个错误: {exc}')
+                        proxies = None
+                    yield ('http' if protocol == 'https' else protocol), proxies or [], name
         finally:
-            executor.shutdown(wait=not (cancel_event and cancel_event.is_set()))
-        if 'https' in all_proxies:
-            del all_proxies['https']
-            
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def fetch_all_proxies(self, log_queue, cancel_event=None):
+        """
+        从所有在线和爬虫源获取代理。
+        返回一个字典，包含'http', 'socks4', 'socks5'类型的代理列表。
+        """
+        all_proxies = {'http': set(), 'socks4': set(), 'socks5': set()}
+        for protocol, proxies, _ in self.iter_fetched_proxies(log_queue, cancel_event):
+            all_proxies.setdefault(protocol, set()).update(proxies)
         return {
             'http': list(all_proxies.get('http', set())),
             'socks4': list(all_proxies.get('socks4', set())),
@@ -681,12 +546,20 @@ class ProxyManager:
                 log_queue.put(f"[Checker] [!] 调用系统curl获取本机公网IP失败: {e}")
 
     def _get_proxy_location(self, ip: str, log_queue=None):
+        """查询IP的地理位置，经 location_cache 缓存 (见 core.geocache)，同一地址的并发查询只请求一次。"""
+        return self.location_cache.get_or_load(ip, lambda ip: self._lookup_location(ip, log_queue))
+
+    def _lookup_location(self, ip: str, log_queue=None):
         """
-        查询IP的地理位置，聚合多个API源并带缓存，优先国内源，结果翻译为中文。
+        实际查询IP的地理位置，聚合多个API源，优先国内源，结果翻译为中文。
+        加载了离线 IP 库时先查本地，未收录且允许回退时才请求在线 API。
         """
-        if ip in self.location_cache:
-            return self.location_cache[ip]
         location = "未知"
+        if self.geoip is not None:
+            country = self.geoip.lookup(ip)
+            if country or not self.geoip_online_fallback:
+                location = self.COUNTRY_NAME_MAP.get(country, country) if country else location
+                return location
         
         # API 1: ip-api.com (国际源, 覆盖广)
         try:
@@ -698,7 +571,6 @@ class ProxyManager:
                 country = data.get('country', '')
                 if country:
                     location = self.COUNTRY_NAME_MAP.get(country, country)
-                    self.location_cache[ip] = location
                     return location
         except Exception as e:
             if log_queue:
@@ -715,7 +587,6 @@ class ProxyManager:
                 country = d.get('country', '')
                 if country:
                     location = self.COUNTRY_NAME_MAP.get(country, country)
-                    self.location_cache[ip] = location
                     return location
         except Exception as e:
             if log_queue:
@@ -730,36 +601,101 @@ class ProxyManager:
             country = data.get('country', '')
             if country:
                 location = self.COUNTRY_NAME_MAP.get(country, country)
-                self.location_cache[ip] = location
                 return location
         except Exception as e:
             if log_queue:
                 log_queue.put(f"[Checker] 查询 {ip} 地理位置 (ip.sb) 失败: {e}")
             pass
             
-        self.location_cache[ip] = location
         return location
 
-    def _pre_check_proxy(self, proxy: str, log_queue=None):
-        """TCP预检，快速判断端口是否开放。"""
+    def set_geoip(self, database: str, online_fallback: bool = True):
+        """加载离线 IP 库 (CSV 或 .mmdb，见 core.geoip)；database 为空或加载失败时只使用在线 API。"""
+        old, self.geoip = self.geoip, None
+        if old is not None:
+            old.close()
+        self.geoip_online_fallback = online_fallback
+        if not database:
+            return
         try:
-            ip, port_str = proxy.split(':')
-            with socket.create_connection((ip, int(port_str)), timeout=1.5):
-                return True
-        except Exception as e:
-            if log_queue:
-                log_queue.put(f"[Checker] TCP预检失败 {proxy}: {e}")
-            return False
+            self.geoip = GeoIPDatabase(database)
+            self.log(f"已加载离线 IP 库 {database}")
+        except (OSError, ImportError, ValueError) as e:
+            self.log(f"[!] 加载离线 IP 库失败，改用在线 API: {e}")
+
+    def save_location_cache(self):
+        """把地理位置缓存写入快照文件 (配置了 location_cache.path 时)，下次启动时载入。"""
+        try:
+            self.location_cache.save()
+        except OSError as e:
+            self.log(f"[!] 保存地理位置缓存失败: {e}")
+
+    def save_source_stats(self):
+        """把各源的产出统计写入快照文件 (配置了 source_stats.path 时)，下次启动时载入。"""
+        try:
+            self.source_stats.save()
+        except OSError as e:
+            self.log(f"[!] 保存源统计失败: {e}")
+
+    def get_source_stats(self):
+        """按产出率降序返回各代理源的统计 (见 core.sources.SourceStats.report)。"""
+        return self.source_stats.report()
+
+    def save_negative_cache(self):
+        """把失效候选缓存写入快照文件 (配置了 negative_cache.path 时)，下次启动时载入。"""
+        try:
+            self.negative_cache.save()
+        except OSError as e:
+            self.log(f"[!] 保存失效候选缓存失败: {e}")
+
+    def set_judges(self, judges):
+        """设置评判服务根地址列表 (见 core.judge)，各代理的验证轮流分配到其中之一；为空时使用 validation_targets。"""
+        self.judge_pool = JudgePool(judges) if judges else None
 
-    def _full_check_proxy(self, proxy_info: dict, validation_mode: str = 'online', cancel_event=None, log_queue=None):
+    def next_validation_targets(self) -> dict:
+        """为一次验证选取验证目标：配置了评判服务时轮流使用，否则为 validation_targets。"""
+        return self.judge_pool.next_targets() if self.judge_pool else self.validation_targets
+
+    def set_profiles(self, profiles):
+        """设置验证画像 {名称: {'targets', 'method', 'timeout', 'weights'}} (见 core.profiles)，为空时不做画像测量。"""
+        self.validation_profiles = load_profiles(profiles)
+
+    def _check_profiles(self, result, cancel_event=None):
+        """对验证通过的代理逐个请求各画像的目标，结果存入 result['profiles']；被取消时返回 None。"""
+        if not result or result['status'] != 'Working' or not self.validation_profiles:
+            return result
+        proxy_url = f"{result['protocol'].lower()}://{result['proxy']}"
+        proxies_dict = {'http': proxy_url, 'https': proxy_url}
+
+        def request(url, method, timeout):
+            response = self.checker_session.request(method, url, proxies=proxies_dict, timeout=timeout, stream=True)
+            response.close()  # 只需响应头，不读取报文体
+            response.raise_for_status()
+
+        try:
+            profiles = run_profiles(self.validation_profiles, request, result, cancel_event)
+        finally:
+            release_proxy_pool(self.checker_session, proxy_url)
+        if profiles is None:
+            return None
+        result['profiles'] = profiles
+        return result
+
+    def _full_check_proxy(self, proxy_info: dict, validation_mode: str = 'online', cancel_event=None, log_queue=None, probe: str = 'separate'):
         """
         对单个代理进行完整的质量验证，此过程可随时取消。
         在每个阻塞网络操作前后，都会检查 cancel_event。
+        probe 为 'single' 时改为只建立一条隧道、经 keep-alive 完成全部探测 (见 core.probe)。
         """
+        if probe == 'single':
+            if cancel_event and cancel_event.is_set(): return None
+            result = single_connection_check(self, proxy_info, log_queue, self.checker_session.headers.get('User-Agent', 'Mozilla/5.0'))
+            return self._check_profiles(result, cancel_event)
         proxy = proxy_info['proxy']
         protocol = proxy_info['protocol']
         proxy_url = f"{protocol.lower()}://{proxy}"
         proxies_dict = {'http': proxy_url, 'https': proxy_url}
+        targets = self.next_validation_targets()
         result = {
             'proxy': proxy, 'protocol': protocol.upper(), 'status': 'Failed',
             'latency': float('inf'), 'speed': 0, 'anonymity': 'Unknown', 'location': 'N/A'
@@ -767,10 +703,10 @@ class ProxyManager:
         try:
             if cancel_event and cancel_event.is_set(): return None
             start_time = time.time()
-            self.checker_session.head(self.validation_targets['latency_check'], proxies=proxies_dict, timeout=self.timeout).raise_for_status()
+            self.checker_session.head(targets['latency_check'], proxies=proxies_dict, timeout=self.timeout).raise_for_status()
             result['latency'] = time.time() - start_time
             if cancel_event and cancel_event.is_set(): return None
-            res_anon = self.checker_session.get(self.validation_targets['anonymity_check'], proxies=proxies_dict, timeout=self.timeout)
+            res_anon = self.checker_session.get(targets['anonymity_check'], proxies=proxies_dict, timeout=self.timeout)
             res_anon.raise_for_status()
             data = res_anon.json()
             origin_ips_str = data.get('headers', {}).get('X-Forwarded-For', data.get('origin', ''))
@@ -786,22 +722,13 @@ class ProxyManager:
             if cancel_event and cancel_event.is_set(): return None
             # 延迟低于7秒的才进行测速
             if result['latency'] <= 7.0:
-                speed_check_url = self.validation_targets['latency_check'] if validation_mode == 'online' else self.validation_targets['speed_check']
                 try:
-                    start_speed = time.time()
-                    speed_response = self.checker_session.get(speed_check_url, proxies=proxies_dict, timeout=15, stream=True)
-                    speed_response.raise_for_status()
-                    
-                    content_size = 0
-                    for chunk in speed_response.iter_content(chunk_size=8192):
-                        if cancel_event and cancel_event.is_set():
-                            speed_response.close() # 及时关闭连接
-                            return None
-                        content_size += len(chunk)
-                    speed_duration = time.time() - start_speed
-                    if speed_duration > 0 and content_size > 0:
-                        # 计算速度，单位 Mbps
-                        result['speed'] = (content_size / speed_duration) * 8 / (1000**2)
+                    measured = self.throughput.measure(self.checker_session, self.throughput.url(targets),
+                                                       proxies_dict, self.timeout, cancel_event)
+                    if measured is None:
+                        return None
+                    # 速度单位 Mbps，按稳态传输计算
+                    result['speed'], result['speed_confidence'] = measured
                 except Exception as e:
                     if log_queue:
                         log_queue.put(f"[Checker] 测速失败 {proxy}: {e}")
@@ -824,56 +751,76 @@ class ProxyManager:
             result['score'] = max(score, 0) # 保证分数非负
             
             result['status'] = 'Working'
-            return result
+            return self._check_profiles(result, cancel_event)
         except requests.RequestException as e:
+            raise_if_local_exhaustion(e)  # 本机资源耗尽不是代理的问题
             if log_queue:
                 log_queue.put(f"[Checker] 验证失败 {proxy}: {e}")
             return result
         except Exception as e:
+            raise_if_local_exhaustion(e)
             if log_queue:
                 log_queue.put(f"[Checker] 验证异常 {proxy}: {e}")
             return result
+        finally:
+            release_proxy_pool(self.checker_session, proxy_url)
 
-    def validate_all_proxies(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online', max_workers=100, cancel_event=None):
+    def validate_all_proxies(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online', max_workers=100, cancel_event=None,
+                             engine='threaded', concurrency=DEFAULT_CONCURRENCY, precheck_timeout=DEFAULT_PRECHECK_TIMEOUT,
+                             precheck_concurrency=DEFAULT_PRECHECK_CONCURRENCY, probe='separate', detect_protocol=True,
+                             detect_timeout=DEFAULT_DETECT_TIMEOUT, adaptive=None):
         """
         对一组代理进行完整的质量验证。
         这是Checker的核心入口，会将结果放入 result_queue。
+        engine 为 'asyncio' 时改用 AsyncProxyChecker，以 concurrency 个协程并发验证，max_workers 不再使用。
+        TCP 预检在单线程内以非阻塞连接批量进行 (见 core.precheck)，不限代理数量。
+        probe 为 'single' 时每个代理只建立一条隧道完成全部探测，并在结果中记录各阶段耗时 ('timings')。
+        detect_protocol 为 True 时在预检与完整验证之间做握手探测 (见 core.detect)，每个地址只按实际协议验证一次。
+        给出 adaptive (自适应并发选项，见 core.concurrency) 时，max_workers / concurrency / precheck_concurrency 只作为上限，
+        实际并发由 AIMD 控制器按成功率与连接耗时调整；本机资源耗尽 (EMFILE、端口耗尽) 时降低并发并重试，不把代理判为失效。
         """
+        if engine == 'asyncio':
+            AsyncProxyChecker(self, concurrency, precheck_timeout, precheck_concurrency, probe,
+                              detect_timeout if detect_protocol else None, adaptive).validate_all(proxies_by_protocol, result_queue, log_queue, validation_mode, cancel_event)
+            return
         all_proxies_flat = [{'proxy': p, 'protocol': proto} for proto, proxies in proxies_by_protocol.items() for p in proxies]
         total_proxies = len(all_proxies_flat)
         
-        survivors = []
-        # 代理数量太多时，跳过TCP预检，避免开销过大
-        if total_proxies > 10000:
-            log_queue.put(f"[!] 代理总数 ({total_proxies}) 超过10000，跳过TCP预检。")
-            survivors = all_proxies_flat
-        else:
-            log_queue.put(f"[*] 阶段一：TCP预检开始，总数: {total_proxies}...")
-            executor = ThreadPoolExecutor(max_workers=500)
-            try:
-                future_to_proxy = {executor.submit(self._pre_check_proxy, p['proxy'], log_queue): p for p in all_proxies_flat}
-                for future in as_completed(future_to_proxy):
-                    if cancel_event and cancel_event.is_set(): break
-                    if future.result():
-                        survivors.append(future_to_proxy[future])
-            finally:
-                # 如果任务被取消，不等线程池执行完毕
-                executor.shutdown(wait=not (cancel_event and cancel_event.is_set()))
-            log_queue.put(f"[+] 阶段一：TCP预检完成，幸存者: {len(survivors)} / {total_proxies}。")
+        log_queue.put(f"[*] 阶段一：TCP预检开始，总数: {total_proxies}...")
+        precheck_controller = make_controller(precheck_concurrency, adaptive, "TCP预检", log_queue)
+        try:
+            survivors = pre_check(all_proxies_flat, precheck_timeout, precheck_concurrency, cancel_event, precheck_controller)
+        except LocalExhaustionError as e:
+            log_queue.put(f"[!] 本机资源耗尽，TCP预检中止 (未检查的代理不记为失效): {e}")
+            return
+        log_queue.put(f"[+] 阶段一：TCP预检完成，幸存者: {len(survivors)} / {total_proxies}。")
 
         if cancel_event and cancel_event.is_set():
             log_queue.put("[Checker] 任务在TCP预检后被用户取消。")
             return # 直接返回，不往队列放任何东西
 
+        detect_controller = make_controller(concurrency, adaptive, "握手探测", log_queue, 3) if detect_protocol else None
+        if detect_protocol and survivors:
+            log_queue.put(f"[*] 握手探测开始，识别 {len(survivors)} 个候选的实际协议...")
+            survivors = detect_protocols(survivors, self.next_validation_targets()['anonymity_check'], detect_timeout,
+                                         concurrency, cancel_event, detect_controller)
+            if cancel_event and cancel_event.is_set():
+                log_queue.put("[Checker] 任务在握手探测阶段被用户取消。")
+                return
+            log_queue.put(f"[+] 握手探测完成，可用代理端口: {len(survivors)}。")
+
         log_queue.put("\n" + "="*20 + f" 阶段二：开始完整质量验证 " + "="*20)
         
         if not survivors:
             result_queue.put(None) # 正常结束
             return
 
+        controller = make_controller(max_workers, adaptive, "完整验证", log_queue, 2)
+        gate = AdaptiveSemaphore(controller) if controller else None
+        check = lambda p: self._full_check_proxy(p, validation_mode, cancel_event, log_queue, probe)
         executor = ThreadPoolExecutor(max_workers=max_workers)
         try:
-            futures = [executor.submit(self._full_check_proxy, p, validation_mode, cancel_event, log_queue) for p in survivors]
+            futures = [executor.submit(run_adaptive, gate, check, p, cancel_event) for p in survivors]
             for future in as_completed(futures):
                 if cancel_event and cancel_event.is_set():
                     break
@@ -885,6 +832,7 @@ class ProxyManager:
                     log_queue.put(f"[!] 验证器线程出现异常: {e}")
         finally:
             executor.shutdown(wait=not (cancel_event and cancel_event.is_set()))
+        log_levels(log_queue, precheck_controller, detect_controller, controller)
 
         # 只有在任务未被取消的情况下，才发送结束信号(None)
         if not (cancel_event and cancel_event.is_set()):
@@ -892,233 +840,80 @@ class ProxyManager:
         else:
             log_queue.put("[Checker] 任务在完整验证阶段被用户取消。")
 
-    # --- Rotator 核心方法 ---
-    def clear(self):
-        """清空所有代理，并重置内部状态。"""
-        with self.lock:
-            self.all_proxies = []
-            self.proxies_by_country.clear()
-            self.indices.clear()
-            self.current_proxy = None
-
-    def set_filters(self, region="All", quality_latency_ms=None):
-        """设置轮换器当前使用的筛选条件。"""
-        with self.lock:
-            self.current_filter_region = region
-            self.current_filter_quality_latency_ms = quality_latency_ms
-
-    def add_proxy(self, proxy_info: dict):
-        """添加一个新代理，如果代理地址已存在则忽略。"""
-        with self.lock:
-            proxy_address = proxy_info.get('proxy')
-            if any(p.get('proxy') == proxy_address for p in self.all_proxies):
-                return 
-            proxy_info.setdefault('consecutive_failures', 0)
-            proxy_info.setdefault('status', 'Working')
-            self.all_proxies.append(proxy_info)
-            country = proxy_info.get('location', 'Unknown')
-            self.proxies_by_country[country].append(proxy_info)
-
-    def remove_proxy(self, proxy_address: str):
-        """根据代理地址移除一个代理。"""
-        with self.lock:
-            proxy_to_remove = None
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    proxy_to_remove = p_info
-                    break
-            
-            if proxy_to_remove:
-                self.all_proxies.remove(proxy_to_remove)
-                
-                country = proxy_to_remove.get('location', 'Unknown')
-                if country in self.proxies_by_country:
-                    try:
-                        self.proxies_by_country[country].remove(proxy_to_remove)
-                        if not self.proxies_by_country[country]:
-                            del self.proxies_by_country[country]
-                    except ValueError:
-                        pass
-                
-                if self.current_proxy and self.current_proxy.get('proxy') == proxy_address:
-                    self.current_proxy = None
-                return True
-            return False
-
-    def report_failure(self, proxy_address: str):
-        """
-        报告一个代理连接失败，立即将其状态设置为不可用。
-        这个方法是线程安全的。
-        """
-        with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    p_info['status'] = 'Unavailable'
-                    return
-
-    def get_proxy_by_address(self, proxy_address: str):
-        """根据代理地址查询代理的详细信息。"""
-        with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    return p_info
-            return None
-
-    def update_proxy(self, proxy_address: str, update_data: dict):
-        """更新指定代理的信息，例如状态、延迟等。"""
-        with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    p_info.update(update_data)
-                    return True
-            return False
-
-    def get_all_proxies_for_revalidation(self):
-        """获取所有代理的副本，用于重新验证。"""
-        with self.lock:
-            return list(self.all_proxies)
-
-    def get_active_proxies_count(self) -> int:
-        """统计当前状态为 'Working' 的代理数量。"""
-        with self.lock:
-            return sum(1 for p in self.all_proxies if p.get('status') == 'Working')
-
-    def get_available_regions_with_counts(self, quality_latency_ms=None) -> dict:
-        """按地区统计 'Working' 状态的代理数量，支持按延迟筛选。"""
-        with self.lock:
-            counts = defaultdict(int)
-            for p_info in self.all_proxies:
-                if p_info.get('status') != 'Working':
-                    continue
-                
-                if quality_latency_ms is not None:
-                    latency_ms = p_info.get('latency', float('inf')) * 1000
-                    if latency_ms > quality_latency_ms:
-                        continue
-                region = p_info.get('location', 'Unknown')
-                counts[region] += 1
-            return dict(counts)
-
-    def get_next_proxy(self):
-        """根据内部存储的筛选条件，轮换获取下一个可用代理，并按分数排序。"""
-        with self.lock:
-            candidate_proxies = []
-            
-            # 使用内部存储的过滤器
-            effective_region = self.current_filter_region
-            effective_latency = self.current_filter_quality_latency_ms
-            for p in self.all_proxies:
-                if p.get('status') == 'Working':
-                    region_match = (effective_region == "All" or p.get('location') == effective_region)
-                    
-                    quality_match = True
-                    if effective_latency is not None:
-                        latency_ms = p.get('latency', float('inf')) * 1000
-                        quality_match = (latency_ms <= effective_latency)
-                    if region_match and quality_match:
-                        candidate_proxies.append(p)
-            
-            if not candidate_proxies:
-                # 如果当前条件下无代理, 尝试放宽条件(不限区域和延迟)
-                if effective_region != "All" or effective_latency is not None:
-                    original_region = self.current_filter_region
-                    original_latency = self.current_filter_quality_latency_ms
-                    self.set_filters("All", None)
-                    result = self.get_next_proxy()
-                    self.set_filters(original_region, original_latency) # 恢复之前的过滤器
-                    return result
-                self.current_proxy = None
-                return None
-
-            # 按评分降序排列
-            candidate_proxies.sort(key=lambda p: p.get('score', 0), reverse=True)
-            
-            quality_key = f"lt{effective_latency}" if effective_latency is not None else "any"
-            index_key = f"{effective_region}_{quality_key}"
-            current_idx = self.indices.get(index_key, -1)
-            next_idx = (current_idx + 1) % len(candidate_proxies)
-            self.indices[index_key] = next_idx
-            
-            self.current_proxy = candidate_proxies[next_idx]
-            return self.current_proxy
-
-    def get_current_proxy(self):
-        """获取当前正在使用的代理。"""
-        with self.lock:
-            if self.current_proxy and self.current_proxy.get('status') != 'Working':
-                self.current_proxy = None
-            return self.current_proxy
-
-    def set_current_proxy_by_address(self, proxy_address: str):
-        """根据地址手动设置当前代理，代理必须可用。"""
-        with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address and p_info.get('status') == 'Working':
-                    self.current_proxy = p_info
-                    return p_info
-            return None
-
     # --- 新增的整合方法 ---
-    def refresh_proxies(self, log_queue, cancel_event=None):
+    def refresh_proxies(self, log_queue, cancel_event=None, deadline=None):
         """
-        高级整合方法：先清空现有代理，然后从网络抓取新代理，再对其进行验证，最后添加到管理器中。
+        高级整合方法：以流水线方式抓取、预检、验证代理 (见 core.pipeline.RefreshPipeline)。
+        验证通过的代理立即加入管理器，刷新期间原有代理照常提供服务，结束后移除本轮未通过验证的旧代理。
+        deadline 为本轮的时间预算 (秒)，为 None 时取 validation_options['deadline_seconds']；
+        到期后停止派发新的检查并返回已验证通过的数量。
         """
-        self.clear()
-        
-        # Step 1: Fetch
-        log_queue.put("[Manager] 开始抓取代理...")
-        fetched_proxies_dict = self.fetch_all_proxies(log_queue, cancel_event)
-        if cancel_event and cancel_event.is_set():
-            log_queue.put("[Manager] 代理抓取阶段被取消。")
-            return 0
-
-        # Step 2: Validate
-        log_queue.put("[Manager] 开始验证代理...")
         # 初始化本机IP
         self.initialize_public_ip(log_queue)
-        from queue import Queue
-        result_queue = Queue()
-        self.validate_all_proxies(fetched_proxies_dict, result_queue, log_queue, cancel_event=cancel_event)
-        
-        # Step 3: Add to Manager
-        validated_count = 0
-        while True:
-            if cancel_event and cancel_event.is_set():
-                log_queue.put("[Manager] 代理验证/添加阶段被取消。")
-                break
-            result = result_queue.get()
-            if result is None: # 结束信号
-                break
-            if result['status'] == 'Working':
-                self.add_proxy(result)
-                validated_count += 1
-
+        log_queue.put("[Manager] 开始抓取并验证代理...")
+        validated_count = RefreshPipeline(self, log_queue, self.validation_options, cancel_event=cancel_event,
+                                          deadline=deadline).run()
+        if cancel_event and cancel_event.is_set():
+            log_queue.put("[Manager] 代理刷新被取消。")
+        self.save_location_cache()
+        self.save_negative_cache()
+        self.save_source_stats()
         log_queue.put(f"[+] 代理刷新完成，共验证并添加 {validated_count} 个可用代理。")
         return validated_count
 
 
     # ========== 新增：启动本地代理服务 ==========
-    def start_local_proxy_service(self, http_host="127.0.0.1", http_port=8888, socks5_host="127.0.0.1", socks5_port=1080, auto_refresh_minutes=0):
+    def start_local_proxy_service(self, http_host="127.0.0.1", http_port=8888, socks5_host="127.0.0.1", socks5_port=1080, auto_refresh_minutes=0, engine="threaded", relay_options=None, pool_options=None,
+                                   failover_options=None):
+        """
+        启动本地代理服务。engine 为 'threaded'（每连接一个线程）或 'asyncio'（单事件循环）；
+        relay_options 为转发参数（见 core.relay.DEFAULT_RELAY_OPTIONS）；
+        pool_options 为上游预热连接池参数（见 core.pool.DEFAULT_POOL_OPTIONS）；
+        failover_options 为上游故障转移/竞速参数（见 core.failover.DEFAULT_FAILOVER_OPTIONS）。
+        """
         if not self.log_queue:
             raise ValueError("请先设置 log_queue")
         if not self._searcher:
             self._searcher = self.AssetSearcher(self.log_queue)
-        self._proxy_server = self.ProxyServer(self, http_host, http_port, socks5_host, socks5_port, self.log_queue)
+        if engine == "asyncio":
+            self._proxy_server = AsyncProxyServer(http_host, http_port, socks5_host, socks5_port, self, self.log_queue,
+                                                  relay_options=relay_options, pool_options=pool_options,
+                                                  failover_options=failover_options)
+        else:
+            self._proxy_server = self.ProxyServer(self, http_host, http_port, socks5_host, socks5_port, self.log_queue,
+                                                  relay_options, pool_options, failover_options)
         self._proxy_server.start_all()
         self._auto_refresh_minutes = auto_refresh_minutes
         if auto_refresh_minutes > 0:
             self._refresh_thread = threading.Thread(target=self._auto_refresh_proxies, daemon=True)
             self._refresh_thread.start()
             self.log(f"代理自动刷新已启用，每 {auto_refresh_minutes} 分钟执行一次。")
+        if self.validation_options['revalidation']['enabled']:
+            self.start_revalidation()
 
     def stop_local_proxy_service(self):
         if self._proxy_server:
             self._proxy_server.stop_all()
+        self.stop_revalidation()
+        self.save_location_cache()
+        self.save_negative_cache()
+        self.save_source_stats()
         if self._refresh_thread and self._refresh_thread.is_alive():
             # 无法直接中断线程，但可设标志位
             self._auto_refresh_minutes = 0
             self._refresh_thread.join(timeout=2)
 
+    def start_revalidation(self):
+        """按 validation_options['revalidation'] 启动后台增量重新验证，已在运行时不做任何事。"""
+        if self.revalidator is None:
+            self.revalidator = Revalidator(self, self.log_queue, self.validation_options['revalidation'])
+        self.revalidator.start()
+
+    def stop_revalidation(self):
+        if self.revalidator is not None:
+            self.revalidator.stop()
+            self.revalidator = None
+
     def _auto_refresh_proxies(self):
         while self._auto_refresh_minutes > 0:
             try:
@@ -1160,34 +955,44 @@ class ProxyManager:
 
     # ========== 新增：更新代理池（供轮换器使用） ==========
     def update_proxies(self, proxy_list):
-        with self.lock:
-            self.all_proxies = proxy_list
-            self.proxies_by_country.clear()
-            for p in proxy_list:
-                country = p.get('location', 'Unknown')
-                self.proxies_by_country[country].append(p)
-            self.indices.clear()
-            self.current_proxy = None if not proxy_list else None
-
-    # ========== 新增：获取当前/下一个代理（供ProxyServer调用） ==========
+        self.clear()
+        self.add_proxies(proxy_list)
+
+    # ========== 新增：获取当前代理（供ProxyServer调用） ==========
     def get_current_proxy(self):
-        with self.lock:
-            if not self.current_proxy and self.all_proxies:
-                self.current_proxy = self.all_proxies[0]
-            return self.current_proxy
-
-    def get_next_proxy(self):
-        with self.lock:
-            if not self.all_proxies:
-                return None
-            self.indices['global'] = (self.indices['global'] + 1) % len(self.all_proxies)
-            self.current_proxy = self.all_proxies[self.indices['global']]
-            return self.current_proxy
+        """获取当前代理，尚未选定时自动轮换出一个。"""
+        return super().get_current_proxy() or self.get_next_proxy()
 
     # ========== 新增：设置日志队列 ==========
     def set_log_queue(self, log_queue):
         self.log_queue = log_queue
 
+    def set_validation_options(self, options: dict):
+        """设置刷新时使用的验证参数 (engine / max_workers / concurrency / precheck_* / probe / queue_size / fetch_workers / detect_* / deadline_* / adaptive / revalidation / judges / profiles / geoip / location_cache / negative_cache / source_stats / throughput)，未给出的项保持不变。"""
+        if options.get('engine', 'threaded') not in ('threaded', 'asyncio'):
+            raise ValueError(f"未知的验证引擎: {options['engine']}")
+        if options.get('probe', 'separate') not in PROBE_MODES:
+            raise ValueError(f"未知的探测方式: {options['probe']}")
+        self.validation_options.update({k: v for k, v in options.items() if k in self.validation_options})
+        if 'adaptive' in options:
+            self.validation_options['adaptive'] = dict(DEFAULT_ADAPTIVE_OPTIONS, **options['adaptive'])
+        if 'revalidation' in options:
+            self.validation_options['revalidation'] = dict(DEFAULT_REVALIDATION_OPTIONS, **options['revalidation'])
+        if 'judges' in options:
+            self.set_judges(options['judges'])
+        if 'profiles' in options:
+            self.set_profiles(options['profiles'])
+        if 'geoip' in options:
+            self.set_geoip(options['geoip'].get('database', ''), options['geoip'].get('online_fallback', True))
+        if 'location_cache' in options:
+            self.location_cache.configure(options['location_cache'])
+        if 'negative_cache' in options:
+            self.negative_cache.configure(options['negative_cache'])
+        if 'source_stats' in options:
+            self.source_stats.configure(options['source_stats'])
+        if 'throughput' in options:
+            self.throughput.configure(options['throughput'])
+
     def log(self, message):
         if self.log_queue:
             self.log_queue.put(f"[Manager] {message}")
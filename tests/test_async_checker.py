@@ -0,0 +1,112 @@
+import asyncio
+import errno
+import threading
+from queue import Queue
+
+import pytest
+
+from core.async_checker import AsyncProxyChecker
+from core.concurrency import LocalExhaustionError
+from core.httpparse import HttpParseError
+from proxy_manager import ProxyManager
+
+
+@pytest.fixture
+def checker():
+    return AsyncProxyChecker(ProxyManager(), concurrency=4)
+
+
+async def _serve_once(status, body, requests):
+    """一次性的 HTTP 代理：记录请求头，按 HTTP/1.0 返回 status 与 body 后关闭连接。"""
+    async def handle(reader, writer):
+        requests.append(await reader.readuntil(b"\r\n\r\n"))
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+
+def test_request_forwards_absolute_url_through_http_proxy(checker):
+    async def run():
+        requests = []
+        server, proxy = await _serve_once('200 OK', b'{"origin": "1.2.3.4"}', requests)
+        async with server:
+            status, sink = await checker._request(proxy, 'HTTP', 'http://judge.example/get?x=1', keep_body=True)
+        assert status == 200 and sink.body() == b'{"origin": "1.2.3.4"}'
+        assert requests[0].startswith(b"GET http://judge.example/get?x=1 HTTP/1.0\r\nHost: judge.example\r\n")
+
+        server, proxy = await _serve_once('404 Not Found', b'', requests)
+        async with server:
+            with pytest.raises(HttpParseError):
+                await checker._request(proxy, 'HTTP', 'http://judge.example/', 'HEAD')
+
+    asyncio.run(run())
+
+
+def test_run_pool_cancels_in_flight_work(checker):
+    async def run():
+        cancel_event, started, cancelled = threading.Event(), [], []
+
+        async def worker(item):
+            started.append(item)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(item)
+                raise
+
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.1, cancel_event.set)
+        assert await asyncio.wait_for(checker._run_pool(list(range(10)), worker, cancel_event), 2)
+        assert started == [0, 1, 2, 3] and sorted(cancelled) == started  # 并发为 4，其余的不再开始
+
+        assert not await checker._run_pool([1, 2], lambda item: asyncio.sleep(0), cancel_event=None)
+
+    asyncio.run(run())
+
+
+def test_local_exhaustion_is_not_a_dead_proxy(checker, monkeypatch):
+    async def exhausted(*args, **kwargs):
+        raise OSError(errno.EMFILE, 'Too many open files')
+
+    async def refused(*args, **kwargs):
+        raise ConnectionRefusedError()
+
+    proxy = {'proxy': '127.0.0.1:9', 'protocol': 'HTTP'}
+    monkeypatch.setattr(checker, '_request', refused)
+    assert asyncio.run(checker._full_check_proxy(proxy))['status'] == 'Failed'
+    monkeypatch.setattr(checker, '_request', exhausted)
+    with pytest.raises(LocalExhaustionError):
+        asyncio.run(checker._full_check_proxy(proxy))
+
+
+def test_exhausted_checks_are_retried_and_never_reported_as_failed(checker, monkeypatch):
+    attempts = []
+
+    async def flaky_check(proxy_info, validation_mode='online', log_queue=None):
+        attempts.append(proxy_info['proxy'])
+        if proxy_info['proxy'] == 'never:1' or len(attempts) == 1:
+            raise LocalExhaustionError('EMFILE')
+        return dict(proxy_info, status='Working', latency=0.1)
+
+    monkeypatch.setattr(checker, '_full_check_proxy', flaky_check)
+    results = []
+    checker.validate_stream(iter([{'proxy': 'a:1', 'protocol': 'HTTP'}]), results.append, Queue())
+    assert attempts == ['a:1', 'a:1'] and results[0]['status'] == 'Working'
+
+    results.clear()
+    checker.validate_stream(iter([{'proxy': 'never:1', 'protocol': 'HTTP'}]), results.append, Queue())
+    assert results == []  # 重试用尽也不产生失败结果
+
+
+def test_precheck_exhaustion_aborts_without_results(checker, monkeypatch):
+    def exhausted_pre_check(*args, **kwargs):
+        raise LocalExhaustionError('EMFILE')
+
+    monkeypatch.setattr('core.async_checker.pre_check', exhausted_pre_check)
+    result_queue, log_queue = Queue(), Queue()
+    checker.validate_all({'http': ['127.0.0.1:9']}, result_queue, log_queue)
+    assert result_queue.empty()
+    assert any('本机资源耗尽' in line for line in list(log_queue.queue))
@@ -0,0 +1,72 @@
+import socket
+import time
+
+import socks
+
+from core.breaker import CircuitBreaker, record_tunnel_outcome, upstream_at_fault
+from core.rotator import ProxyRotator
+
+OPTIONS = {'failure_threshold': 2, 'open_seconds': 10, 'backoff_factor': 3, 'max_open_seconds': 60,
+           'probe_timeout': 5}
+
+
+def test_trips_after_threshold_and_backs_off_on_failed_probe():
+    breaker = CircuitBreaker(OPTIONS)
+    assert breaker.record_failure('a', now=0) == (1, None)
+    assert breaker.record_failure('a', now=1) == (2, 10)
+    assert breaker.record_failure('a', now=2) == (3, None)  # 隔离期间不再延长
+    assert breaker.next_due() == 11
+
+    assert breaker.pop_due(now=10) == []
+    assert breaker.pop_due(now=11) == ['a']
+    assert breaker.half_open == {'a'}
+    assert breaker.record_failure('a', now=12) == (4, 30)  # 试探失败立即再次隔离
+    assert breaker.pop_due(now=42) == ['a']
+    breaker.record_failure('a', now=43)
+    assert breaker.pop_due(now=43 + 60) == ['a']  # 达到 max_open_seconds
+
+
+def test_half_open_admits_one_probe_at_a_time():
+    breaker = CircuitBreaker(OPTIONS)
+    breaker.record_failure('a', now=0)
+    breaker.record_failure('a', now=0)
+    breaker.pop_due(now=10)
+    assert breaker.claim_probe('a', now=10)
+    assert not breaker.claim_probe('a', now=14)
+    assert breaker.claim_probe('a', now=15)  # 上一个试探超时未回报
+    assert breaker.claim_probe('b', now=15)
+    assert breaker.record_success('a')
+    assert not breaker.tracked('a') and not breaker.half_open
+
+
+def test_stale_due_entries_are_skipped():
+    breaker = CircuitBreaker(OPTIONS)
+    breaker.record_failure('a', now=0)
+    breaker.record_failure('a', now=0)
+    breaker.forget('a')
+    assert breaker.pop_due(now=100) == []
+
+
+def test_only_upstream_connection_errors_are_blamed():
+    assert upstream_at_fault(ConnectionRefusedError())
+    assert upstream_at_fault(socks.ProxyConnectionError('refused'))
+    assert not upstream_at_fault(socket.timeout())
+    assert not upstream_at_fault(socks.GeneralProxyError('target unreachable'))
+
+
+def test_tunnel_outcome_quarantines_and_readmits_proxies():
+    rotator = ProxyRotator()
+    rotator.set_breaker_options(dict(OPTIONS, failure_threshold=1, open_seconds=0.01))
+    rotator.add_proxies([{'proxy': 'a:1', 'score': 90}, {'proxy': 'b:1', 'score': 50}])
+    a, b = rotator.get_proxy_by_address('a:1'), rotator.get_proxy_by_address('b:1')
+
+    # 有候选成功时其余失败一律计入；全部失败时只计入明确连不上上游的
+    assert record_tunnel_outcome(rotator, None, [(a, socket.timeout())]) == []
+    assert record_tunnel_outcome(rotator, b, [(a, socket.timeout())]) == [('a:1', 0.01)]
+    assert rotator.get_active_proxies_count() == 1
+
+    time.sleep(0.02)
+    assert rotator.get_next_proxy()['proxy'] == 'a:1'  # 隔离到期后重新接纳为半开状态
+    assert rotator.get_active_proxies_count() == 2
+    rotator.report_success('a:1')
+    assert not rotator._breaker.tracked('a:1')
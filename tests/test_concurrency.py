@@ -0,0 +1,197 @@
+import asyncio
+import errno
+import threading
+import time
+import urllib.error
+from queue import Queue
+
+import pytest
+
+import core.concurrency as concurrency
+from core.concurrency import (AdaptiveSemaphore, AsyncAdaptiveSemaphore, ConcurrencyController, LocalExhaustionError,
+                              async_run_adaptive, local_exhaustion, make_controller, run_adaptive)
+
+OPTIONS = {'initial': 4, 'min': 2, 'window': 4, 'increase_step': 3, 'backoff_factor': 0.5,
+           'latency_factor': 2.0, 'failure_tolerance': 0.15, 'log_interval': 0}
+
+
+@pytest.fixture(autouse=True)
+def no_fd_limit(monkeypatch):
+    """默认不受本机文件描述符上限约束，需要时由测试自行设置。"""
+    monkeypatch.setattr(concurrency, 'fd_budget', lambda fds_per_task=1: None)
+
+
+def _window(controller, latency=0.1, failures=0):
+    """喂入恰好一个窗口的结果，其中前 failures 个失败 (窗口大小取 window 与当前并发中的较大值)。"""
+    size = max(controller.options['window'], controller.limit)
+    for i in range(size):
+        controller.record(i >= failures, latency)
+
+
+def test_slow_start_doubles_until_the_maximum():
+    controller = ConcurrencyController(20, OPTIONS)
+    assert controller.limit == 4
+    _window(controller)
+    assert controller.limit == 8
+    _window(controller)
+    assert controller.limit == 16
+    _window(controller)
+    assert controller.limit == 20
+    assert controller.peak == 20
+
+
+def test_failure_ratio_backs_off_then_grows_additively():
+    controller = ConcurrencyController(100, OPTIONS)
+    _window(controller)                 # 基线: 无失败
+    assert controller.limit == 8
+    _window(controller, failures=4)     # 失败比例 50%，高出基线 15% 以上
+    assert controller.limit == 4
+    _window(controller)
+    assert controller.limit == 7        # 出现过拥塞后改为每次加 increase_step
+
+
+def test_dead_candidates_alone_are_not_congestion():
+    controller = ConcurrencyController(100, OPTIONS)
+    _window(controller, failures=3)     # 候选中大多是死代理，但比例稳定
+    _window(controller, failures=6)
+    assert controller.limit == 16
+
+
+def test_latency_above_the_baseline_backs_off():
+    controller = ConcurrencyController(100, OPTIONS)
+    _window(controller, latency=0.1)
+    _window(controller, latency=0.5)
+    assert controller.limit == 4
+    controller = ConcurrencyController(100, OPTIONS)
+    _window(controller, latency=0.01)
+    _window(controller, latency=0.03)   # 超过 2 倍但只高出 20ms，视为噪声
+    assert controller.limit == 16
+
+
+def test_congested_respects_the_cooldown_and_the_minimum(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(concurrency.time, 'monotonic', lambda: now[0])
+    log_queue = Queue()
+    controller = ConcurrencyController(100, dict(OPTIONS, initial=16), "完整验证", log_queue)
+    controller.congested()
+    controller.congested()              # 同一批请求先后报告，只计一次
+    assert controller.limit == 8
+    now[0] += concurrency._DECREASE_COOLDOWN
+    for _ in range(3):
+        controller.congested()
+        now[0] += concurrency._DECREASE_COOLDOWN
+    assert controller.limit == 2        # 不低于 min
+    assert log_queue.get_nowait() == "[Checker] 完整验证并发下调: 16 -> 8 (本机资源耗尽)"
+
+
+def test_maximum_is_clamped_by_the_file_descriptor_limit(monkeypatch):
+    resource = pytest.importorskip('resource')
+    monkeypatch.undo()
+    monkeypatch.setattr(concurrency.resource, 'getrlimit', lambda which: (1024, resource.RLIM_INFINITY))
+    assert concurrency.fd_budget(2) == (1024 - concurrency._FD_RESERVE) // 2
+    controller = ConcurrencyController(5000, dict(OPTIONS, initial=1000), fds_per_task=2)
+    assert controller.maximum == controller.limit == 384
+    monkeypatch.setattr(concurrency.resource, 'getrlimit', lambda which: (resource.RLIM_INFINITY,) * 2)
+    assert ConcurrencyController(5000, OPTIONS).maximum == 5000
+
+
+def test_make_controller_only_when_enabled():
+    assert make_controller(10, {}) is None
+    assert make_controller(10, dict(OPTIONS, enabled=False)) is None
+    assert make_controller(10, dict(OPTIONS, enabled=True)).maximum == 10
+
+
+def test_local_exhaustion_looks_through_wrapped_errors():
+    assert local_exhaustion(OSError(errno.EMFILE, "Too many open files"))
+    assert local_exhaustion(urllib.error.URLError(OSError(errno.EADDRNOTAVAIL, "Cannot assign")))
+    try:
+        try:
+            raise OSError(errno.ENOBUFS, "No buffer space")
+        except OSError as e:
+            raise RuntimeError("wrapped") from e
+    except RuntimeError as e:
+        assert local_exhaustion(e)
+    assert not local_exhaustion(ConnectionRefusedError(errno.ECONNREFUSED, "refused"))
+
+
+def test_adaptive_semaphore_follows_the_limit():
+    controller = ConcurrencyController(10, dict(OPTIONS, initial=2, min=1))
+    gate = AdaptiveSemaphore(controller)
+    assert gate.acquire() and gate.acquire()
+    cancel = threading.Event()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(gate.acquire(cancel)))
+    waiter.start()
+    time.sleep(0.1)
+    assert not acquired                 # 已达 limit，等待空位
+    controller.limit = 3                # 控制器调高并发后不需要 release 也能获得空位
+    waiter.join(2)
+    assert acquired == [True]
+    cancel.set()
+    assert gate.acquire(cancel) is False
+
+
+def test_async_adaptive_semaphore_follows_the_limit():
+    controller = ConcurrencyController(10, dict(OPTIONS, initial=1, min=1))
+    gate = AsyncAdaptiveSemaphore(controller)
+
+    async def main():
+        await gate.acquire()
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        gate.release()
+        await asyncio.wait_for(waiter, 1)
+        controller.limit = 2
+        await asyncio.wait_for(gate.acquire(), 1)
+
+    asyncio.run(main())
+
+
+def test_run_adaptive_retries_local_exhaustion(monkeypatch):
+    monkeypatch.setattr(concurrency, '_GATE_POLL_INTERVAL', 0.01)
+    controller = ConcurrencyController(100, dict(OPTIONS, initial=16))
+    gate = AdaptiveSemaphore(controller)
+    attempts = []
+
+    def check(item):
+        attempts.append(item)
+        if len(attempts) < 3:
+            raise LocalExhaustionError("Too many open files")
+        return {'status': 'Working', 'latency': 0.1}
+
+    assert run_adaptive(gate, check, 'p') == {'status': 'Working', 'latency': 0.1}
+    assert attempts == ['p'] * 3
+    assert controller.limit == 8        # 冷却时间内的两次耗尽只下调一次
+    assert controller._count == 1       # 只有最终结果反馈给控制器
+    assert gate._active == 0
+
+
+def test_run_adaptive_gives_up_without_a_verdict(monkeypatch):
+    monkeypatch.setattr(concurrency, '_GATE_POLL_INTERVAL', 0.01)
+
+    def check(item):
+        raise LocalExhaustionError("Too many open files")
+
+    assert run_adaptive(None, check, 'p') is None
+    gate = AdaptiveSemaphore(ConcurrencyController(100, OPTIONS))
+    assert run_adaptive(gate, check, 'p') is None
+    assert gate._active == 0
+
+
+def test_async_run_adaptive_retries_local_exhaustion(monkeypatch):
+    monkeypatch.setattr(concurrency, '_GATE_POLL_INTERVAL', 0.01)
+    controller = ConcurrencyController(100, dict(OPTIONS, initial=16))
+    gate = AsyncAdaptiveSemaphore(controller)
+    attempts = []
+
+    async def check(item):
+        attempts.append(item)
+        if len(attempts) < 2:
+            raise LocalExhaustionError("Too many open files")
+        return {'status': 'Failed', 'latency': None}
+
+    assert asyncio.run(async_run_adaptive(gate, check, 'p')) == {'status': 'Failed', 'latency': None}
+    assert attempts == ['p', 'p']
+    assert controller.limit == 8
+    assert (controller._count, controller._failures) == (1, 1)
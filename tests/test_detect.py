@@ -0,0 +1,59 @@
+import asyncio
+
+from core.detect import async_detect_protocols
+
+
+async def _serve_socks4(reader, writer):
+    """只支持 SOCKS4 (不支持 4a) 的服务端：目标地址为 0.0.0.x 时拒绝。"""
+    try:
+        request = await reader.readexactly(8)
+        await reader.readuntil(b"\x00")  # user id
+        if request[0] != 4:
+            return
+        if request[4:7] == b"\x00\x00\x00":
+            writer.write(b"\x00\x5b" + b"\x00" * 6)
+        else:
+            writer.write(b"\x00\x5a" + request[2:8])
+        await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve_socks5(reader, writer):
+    try:
+        if await reader.readexactly(3) == b"\x05\x01\x00":
+            writer.write(b"\x05\x00")
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def _detect(handler, declared, target_url):
+    async def run():
+        server = await asyncio.start_server(handler, '127.0.0.1', 0)
+        address = f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        async with server:
+            return address, await async_detect_protocols([{'proxy': address, 'protocol': declared}], target_url,
+                                                         timeout=2)
+    return asyncio.run(run())
+
+
+def test_plain_socks4_server_is_detected_with_a_hostname_target():
+    address, detected = _detect(_serve_socks4, 'socks4', 'http://localhost:8080/get')
+    assert detected == [{'proxy': address, 'protocol': 'socks4'}]
+
+
+def test_misdeclared_protocol_is_corrected():
+    address, detected = _detect(_serve_socks5, 'http', 'http://127.0.0.1/get')
+    assert detected == [{'proxy': address, 'protocol': 'socks5'}]
+
+
+def test_port_speaking_no_proxy_protocol_is_dropped():
+    async def silent(reader, writer):
+        writer.close()
+
+    assert _detect(silent, 'socks4', 'http://127.0.0.1/get')[1] == []
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+
+from core.failover import DEFAULT_FAILOVER_OPTIONS, async_connect_with_failover, connect_with_failover, iter_candidates
+
+HEDGE = dict(DEFAULT_FAILOVER_OPTIONS, hedge=True, hedge_count=2, hedge_delay=0.1, deadline=2)
+
+
+class _Conn:
+    def __init__(self, name):
+        self.name = name
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+def _candidates(*names):
+    return [{'proxy': name} for name in names]
+
+
+def _connector(behaviour, log):
+    """behaviour: 名称 -> (耗时, 是否成功)；log 记录 (名称, 开始时间, 给出的 timeout)。"""
+    started = time.monotonic()
+    conns = {}
+
+    def connect_one(info, timeout):
+        name = info['proxy']
+        log.append((name, time.monotonic() - started, timeout))
+        delay, ok = behaviour[name]
+        time.sleep(min(delay, timeout))
+        if not ok or delay > timeout:
+            raise ConnectionRefusedError(name)
+        conns[name] = _Conn(name)
+        return conns[name]
+
+    return connect_one, conns
+
+
+def test_sequential_failover_returns_first_success():
+    log = []
+    connect_one, _ = _connector({'a': (0, False), 'b': (0, False), 'c': (0, True), 'd': (0, True)}, log)
+    info, conn, failures = connect_with_failover(_candidates('a', 'b', 'c', 'd'), connect_one, DEFAULT_FAILOVER_OPTIONS)
+    assert info['proxy'] == 'c' and conn.name == 'c'
+    assert [f[0]['proxy'] for f in failures] == ['a', 'b']
+    assert [entry[0] for entry in log] == ['a', 'b', 'c']
+
+
+def test_attempts_share_one_deadline():
+    log = []
+    connect_one, _ = _connector({'a': (0.3, False), 'b': (5, True), 'c': (0, True)}, log)
+    started = time.monotonic()
+    info, conn, failures = connect_with_failover(_candidates('a', 'b', 'c'), connect_one,
+                                                 dict(DEFAULT_FAILOVER_OPTIONS, deadline=0.5))
+    assert info is None and conn is None and len(failures) == 2
+    assert time.monotonic() - started < 0.8
+    assert log[1][2] < 0.25  # 第二个候选只得到剩余的时间
+    assert [entry[0] for entry in log] == ['a', 'b']
+
+
+def test_hedge_launches_backup_after_delay_and_closes_the_late_winner():
+    log = []
+    connect_one, conns = _connector({'slow': (0.4, True), 'fast': (0.05, True)}, log)
+    info, conn, failures = connect_with_failover(_candidates('slow', 'fast'), connect_one, HEDGE)
+    assert info['proxy'] == 'fast' and not failures
+    assert [entry[0] for entry in log] == ['slow', 'fast']
+    assert 0.08 <= log[1][1] < 0.3  # 首选未在 hedge_delay 内完成才启动备用
+    assert not conn.closed.is_set()
+    time.sleep(0.5)
+    assert conns['slow'].closed.is_set()  # 落后完成的连接在后台关闭
+
+
+def test_hedge_replaces_failed_attempts_immediately():
+    log = []
+    connect_one, _ = _connector({'a': (0, False), 'b': (0, True)}, log)
+    info, _, failures = connect_with_failover(_candidates('a', 'b'), connect_one, dict(HEDGE, hedge_delay=1))
+    assert info['proxy'] == 'b' and len(failures) == 1
+    assert log[1][1] < 0.5
+
+
+def test_async_failover_and_hedging():
+    async def run():
+        closed, started = [], []
+
+        class Writer:
+            def __init__(self, name):
+                self.name = name
+
+            def close(self):
+                closed.append(self.name)
+
+        async def connect_one(info, timeout):
+            name = info['proxy']
+            started.append((name, asyncio.get_running_loop().time()))
+            await asyncio.sleep({'bad': 0, 'slow': 0.4, 'fast': 0.05}[name])
+            if name == 'bad':
+                raise ConnectionRefusedError(name)
+            return None, Writer(name)
+
+        info, streams, failures = await async_connect_with_failover(
+            _candidates('bad', 'fast'), connect_one, DEFAULT_FAILOVER_OPTIONS)
+        assert info['proxy'] == 'fast' and len(failures) == 1
+
+        started.clear()
+        info, streams, failures = await async_connect_with_failover(_candidates('slow', 'fast'), connect_one, HEDGE)
+        assert info['proxy'] == 'fast' and streams[1].name == 'fast' and not failures
+        assert started[1][1] - started[0][1] >= 0.08
+
+        info, streams, failures = await async_connect_with_failover(
+            _candidates('slow'), connect_one, dict(HEDGE, deadline=0.1))
+        assert info is None and streams is None and not failures  # 到期时取消仍在进行的尝试
+        assert not closed
+
+    asyncio.run(run())
+
+
+class _Rotator:
+    def __init__(self, names):
+        self.names = names
+        self.index = 0
+
+    def get_next_proxy(self):
+        name = self.names[self.index % len(self.names)]
+        self.index += 1
+        return {'proxy': name}
+
+    def get_current_proxy(self):
+        return {'proxy': self.names[0]}
+
+    def get_top_proxies(self, n):
+        return [{'proxy': name} for name in reversed(self.names)][:n]
+
+
+def test_candidates_are_unique_and_bounded():
+    rotator = _Rotator(['a', 'b', 'a', 'c', 'd'])
+    assert [p['proxy'] for p in iter_candidates(rotator, True, 3)] == ['a', 'b', 'c']
+    assert [p['proxy'] for p in iter_candidates(_Rotator(['a']), True, 3)] == ['a']
+    assert [p['proxy'] for p in iter_candidates(rotator, False, 3)] == ['a', 'd', 'c']
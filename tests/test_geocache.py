@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from core.checker import ProxyChecker
+from core.geocache import UNKNOWN_LOCATION, LocationCache
+from proxy_manager import ProxyManager
+
+
+def test_prefix_sharing_and_lru_eviction():
+    cache = LocationCache({'max_entries': 2})
+    cache.put('1.2.3.4', '日本')
+    assert cache.get('1.2.3.200') == '日本'
+    assert cache.get('2001:db8::1') is None
+    cache.put('5.6.7.8', '美国')
+    cache.get('1.2.3.4')            # 最近使用
+    cache.put('9.9.9.9', '德国')
+    assert cache.get('5.6.7.8') is None and len(cache) == 2
+
+
+def test_unknown_results_expire_sooner(monkeypatch):
+    cache = LocationCache({'ttl_hours': 1, 'miss_ttl_minutes': 1, 'prefix_sharing': False})
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    cache.put('1.1.1.1', UNKNOWN_LOCATION)
+    cache.put('2.2.2.2', '美国')
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert cache.get('1.1.1.1') is None
+    assert cache.get('2.2.2.2') == '美国'
+
+
+def test_concurrent_lookups_of_one_key_query_once():
+    cache = LocationCache()
+    calls, release = [], threading.Event()
+
+    def loader(ip):
+        calls.append(ip)
+        release.wait(1)
+        return '新加坡'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('8.8.8.8', loader)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == ['8.8.8.8'] and results == ['新加坡'] * 8
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'locations.json')
+    cache = LocationCache({'path': path})
+    cache.put('1.2.3.4', '韩国')
+    cache.save()
+    assert LocationCache({'path': path}).get('1.2.3.9') == '韩国'
+
+
+class _Response:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+@pytest.mark.parametrize('owner, session', [(ProxyChecker, 'session'), (ProxyManager, 'checker_session')])
+def test_online_lookup_is_cached_through_get_or_load(owner, session, monkeypatch):
+    """_lookup_location 只负责查询，结果由 get_or_load 写入缓存 (曾因在 loader 内写 cache[ip] 抛出 TypeError)。"""
+    instance = owner()
+    requested = []
+
+    def fake_get(url, timeout):
+        requested.append(url)
+        return _Response({'status': 'success', 'country': 'Japan'})
+
+    monkeypatch.setattr(getattr(instance, session), 'get', fake_get)
+    assert instance._get_proxy_location('1.2.3.4') == '日本'
+    assert instance._get_proxy_location('1.2.3.5') == '日本'
+    assert len(requested) == 1 and instance.location_cache.get('1.2.3.4') == '日本'
@@ -0,0 +1,38 @@
+import queue
+
+from core.checker import ProxyChecker
+from core.geoip import GeoIPDatabase
+
+CSV = '''ip_start,ip_end,country
+1.0.0.0,1.0.0.255,CN
+1.0.1.0,1.0.3.255,US
+"16843008","16843263","JP","Japan"
+2001:db8::,2001:db8::ffff,DE
+'''
+
+
+def test_range_lookup(tmp_path):
+    path = tmp_path / 'geo.csv'
+    path.write_text(CSV)
+    db = GeoIPDatabase(str(path))
+    try:
+        assert db.lookup('1.0.0.7') == 'China'
+        assert db.lookup('1.0.2.200') == 'United States'
+        assert db.lookup('1.1.1.1') == 'Japan'  # 有国家名列时优先使用国家名
+        assert db.lookup('2001:db8::10') is None  # 仅支持 IPv4，IPv6 行被跳过
+        assert db.lookup('9.9.9.9') is None
+        assert db.lookup('not-an-ip') is None
+    finally:
+        db.close()
+
+
+def test_checker_falls_back_to_online_lookup_on_bad_database(tmp_path):
+    path = tmp_path / 'geo.csv'
+    path.write_text(CSV)
+    checker, log_queue = ProxyChecker(), queue.Queue()
+    checker.set_geoip(str(path), log_queue=log_queue)
+    assert checker.geoip is not None and checker._get_proxy_location('1.0.0.1') == '中国'
+
+    checker.set_geoip(str(tmp_path / 'missing.csv'), online_fallback=False, log_queue=log_queue)
+    assert checker.geoip is None and not checker.geoip_online_fallback
+    assert '加载离线 IP 库失败' in list(log_queue.queue)[-1]
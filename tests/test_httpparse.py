@@ -0,0 +1,148 @@
+import asyncio
+import socket
+
+import pytest
+
+from core.httpparse import (HttpParseError, SocketReader, async_forward_body, async_read_head, body_framing,
+                            forward_body, parse_head, request_origin)
+
+
+def test_parse_request_keeps_header_order_and_case():
+    head = parse_head(b"get http://example.com/a?b=1 HTTP/1.1\r\nX-One: 1\r\nhost: example.com\r\n\r\n", True)
+    assert (head.method, head.target, head.version) == ('GET', 'http://example.com/a?b=1', 'HTTP/1.1')
+    assert head.headers == [('X-One', '1'), ('host', 'example.com')]
+    assert head.header('HOST') == 'example.com'
+
+
+def test_parse_response_and_folded_header():
+    head = parse_head(b"HTTP/1.0 200 OK\r\nX-Long: a\r\n  b\r\n\r\n", False)
+    assert (head.status, head.reason, head.version) == (200, 'OK', 'HTTP/1.0')
+    assert head.header('x-long') == 'a b'
+
+
+@pytest.mark.parametrize('raw, is_request', [
+    (b"GET /\r\n\r\n", True),
+    (b"GET / FTP/1.0\r\n\r\n", True),
+    (b"HTTP/1.1 abc OK\r\n\r\n", False),
+    (b"GET / HTTP/1.1\r\nno-colon\r\n\r\n", True),
+])
+def test_parse_rejects_malformed_heads(raw, is_request):
+    with pytest.raises(HttpParseError):
+        parse_head(raw, is_request)
+
+
+@pytest.mark.parametrize('raw, expected', [
+    (b"GET / HTTP/1.1\r\n\r\n", True),
+    (b"GET / HTTP/1.1\r\nConnection: keep-alive, Close\r\n\r\n", False),
+    (b"GET / HTTP/1.1\r\nProxy-Connection: close\r\n\r\n", False),
+    (b"GET / HTTP/1.0\r\n\r\n", False),
+    (b"GET / HTTP/1.0\r\nProxy-Connection: Keep-Alive\r\n\r\n", True),
+])
+def test_keep_alive_defaults(raw, expected):
+    assert parse_head(raw, True).keep_alive() is expected
+
+
+@pytest.mark.parametrize('raw, method, expected', [
+    (b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n", 'GET', ('length', 5)),
+    (b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n", 'HEAD', ('none', 0)),
+    (b"HTTP/1.1 304 Not Modified\r\n\r\n", 'GET', ('none', 0)),
+    (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: gzip, chunked\r\nContent-Length: 5\r\n\r\n", 'GET', ('chunked', 0)),
+    (b"HTTP/1.1 200 OK\r\n\r\n", 'GET', ('close', 0)),
+])
+def test_response_body_framing(raw, method, expected):
+    assert body_framing(parse_head(raw, False), method) == expected
+
+
+def test_request_without_length_has_no_body():
+    assert body_framing(parse_head(b"POST / HTTP/1.1\r\n\r\n", True)) == ('none', 0)
+    with pytest.raises(HttpParseError):
+        body_framing(parse_head(b"POST / HTTP/1.1\r\nContent-Length: x\r\n\r\n", True))
+
+
+def test_request_origin_rewrites_absolute_uri():
+    head = parse_head(b"GET http://example.com:8080/p?q=1 HTTP/1.1\r\nProxy-Connection: keep-alive\r\n\r\n", True)
+    assert request_origin(head) == ('example.com', 8080)
+    assert head.target == '/p?q=1'
+    assert head.headers == [('Host', 'example.com:8080')]
+    assert head.serialize() == b"GET /p?q=1 HTTP/1.1\r\nHost: example.com:8080\r\n\r\n"
+
+
+def test_request_origin_uses_host_header_for_origin_form():
+    assert request_origin(parse_head(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n", True)) == ('example.com', 80)
+    with pytest.raises(HttpParseError):
+        request_origin(parse_head(b"GET / HTTP/1.1\r\n\r\n", True))
+
+
+CHUNKED = b"4;ext=1\r\nWiki\r\n0\r\nTrailer: x\r\n\r\n"
+
+
+def _forward(payload, mode, length=0):
+    src_a, src_b = socket.socketpair()
+    dst_a, dst_b = socket.socketpair()
+    with src_a, src_b, dst_a, dst_b:
+        src_a.sendall(payload)
+        src_a.shutdown(socket.SHUT_WR)
+        reader = SocketReader(src_b, recv_size=3)
+        forward_body(reader, dst_a, mode, length)
+        dst_a.shutdown(socket.SHUT_WR)
+        received = b''.join(iter(lambda: dst_b.recv(65536), b''))
+        rest = reader.take_buffered() + b''.join(iter(lambda: src_b.recv(65536), b''))
+        return received, rest
+
+
+def test_forward_body_stops_at_frame_boundary():
+    assert _forward(b"hello" + b"NEXT", 'length', 5) == (b"hello", b"NEXT")
+    assert _forward(CHUNKED + b"NEXT", 'chunked') == (CHUNKED, b"NEXT")
+    assert _forward(b"until close", 'close') == (b"until close", b"")
+
+
+def test_forward_body_rejects_truncated_body():
+    with pytest.raises(HttpParseError):
+        _forward(b"hel", 'length', 5)
+
+
+def test_socket_reader_read_head():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(b"GET / HTTP/1.1\r\n\r\nrest")
+        a.shutdown(socket.SHUT_WR)
+        reader = SocketReader(b, recv_size=4)
+        assert reader.read_head() == b"GET / HTTP/1.1\r\n\r\n"
+        with pytest.raises(HttpParseError):
+            reader.read_head()
+
+
+class _Sink:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def test_async_read_head_and_forward_chunked():
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"HTTP/1.1 200 OK\r\n\r\n" + CHUNKED + b"NEXT")
+        reader.feed_eof()
+        assert await async_read_head(reader) == b"HTTP/1.1 200 OK\r\n\r\n"
+        sink = _Sink()
+        await async_forward_body(reader, sink, 'chunked')
+        return bytes(sink.data), await reader.read()
+
+    assert asyncio.run(run()) == (CHUNKED, b"NEXT")
+
+
+def test_async_read_head_eof():
+    async def run(payload):
+        reader = asyncio.StreamReader()
+        reader.feed_data(payload)
+        reader.feed_eof()
+        return await async_read_head(reader)
+
+    assert asyncio.run(run(b"")) is None
+    with pytest.raises(HttpParseError):
+        asyncio.run(run(b"GET / HTTP/1.1\r\n"))
@@ -0,0 +1,86 @@
+import json
+import socket
+from queue import Queue
+
+import pytest
+
+from core.httpparse import SocketReader, body_framing, parse_head
+from core.judge import JudgePool, JudgeServer, ROOT_PAYLOAD_SIZE, judge_targets
+
+
+@pytest.fixture(scope='module')
+def judge():
+    server = JudgeServer('127.0.0.1', 0, Queue(), {'max_payload': 4096})
+    server.start()
+    yield server
+    server.stop()
+
+
+def _request(sock, reader, target, method='GET', headers=''):
+    sock.sendall(f"{method} {target} HTTP/1.1\r\nHost: judge\r\n{headers}\r\n".encode())
+    head = parse_head(reader.read_head(), is_request=False)
+    _, length = body_framing(head, method)
+    body = b""
+    while len(body) < length:
+        chunk = reader.read(length - len(body))
+        assert chunk
+        body += chunk
+    return head, body
+
+
+@pytest.fixture
+def conn(judge):
+    with socket.create_connection(('127.0.0.1', judge.port), timeout=3) as sock:
+        yield sock, SocketReader(sock)
+
+
+def test_get_echoes_origin_and_headers_like_httpbin(conn):
+    head, body = _request(*conn, '/get?show_env=1', headers='x-forwarded-for: 10.1.1.1\r\nVia: 1.1 proxy\r\n')
+    data = json.loads(body)
+    assert head.status == 200
+    assert data['origin'] == '10.1.1.1, 127.0.0.1'
+    assert data['headers']['X-Forwarded-For'] == '10.1.1.1' and data['headers']['Via'] == '1.1 proxy'
+    assert data['url'] == '/get?show_env=1'
+
+
+def test_bytes_are_capped_and_other_paths_return_the_root_payload(conn):
+    assert len(_request(*conn, '/bytes/1000')[1]) == 1000
+    assert len(_request(*conn, '/bytes/100000')[1]) == 4096  # 不超过 max_payload
+    head, body = _request(*conn, '/')
+    assert len(body) == ROOT_PAYLOAD_SIZE
+    head, body = _request(*conn, '/bytes/1000', method='HEAD')
+    assert head.header('Content-Length') == '1000' and body == b""
+    assert len(_request(*conn, '/bytes/5')[1]) == 5  # HEAD 之后连接仍可继续使用
+
+
+def test_absolute_uri_targets_and_keep_alive_on_one_connection(conn):
+    sock, reader = conn
+    head, body = _request(sock, reader, 'http://judge.example/get')
+    assert json.loads(body)['url'] == 'http://judge.example/get'
+    assert head.keep_alive()
+    head, body = _request(sock, reader, 'http://judge.example/bytes/10')
+    assert body == bytes(10)
+    head, _ = _request(sock, reader, '/', headers='Connection: close\r\n')
+    assert not head.keep_alive()
+    assert sock.recv(1) == b""  # 按请求关闭连接
+
+
+def test_request_bodies_are_rejected(conn):
+    sock, _ = conn
+    sock.sendall(b"POST /get HTTP/1.1\r\nHost: judge\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n")
+    assert sock.recv(1024) == b""  # 不回应，直接关闭
+
+
+def test_small_request_body_is_skipped(conn):
+    sock, reader = conn
+    sock.sendall(b"POST /get HTTP/1.1\r\nHost: judge\r\nContent-Length: 3\r\n\r\nabc")
+    head = parse_head(reader.read_head(), is_request=False)
+    assert head.status == 200
+
+
+def test_judge_targets_and_pool_rotation():
+    targets = judge_targets('http://1.2.3.4:8899/')
+    assert targets['latency_check'] == 'http://1.2.3.4:8899/'
+    assert targets['anonymity_check'] == 'http://1.2.3.4:8899/get?show_env=1'
+    pool = JudgePool(['http://a:1', 'http://b:1'])
+    assert [pool.next_targets()['latency_check'] for _ in range(3)] == ['http://a:1/', 'http://b:1/', 'http://a:1/']
@@ -0,0 +1,85 @@
+import json
+import time
+
+from core.negcache import ANY_PROTOCOL, NegativeCache
+
+OPTIONS = {'base_ttl_minutes': 1, 'backoff_factor': 2, 'max_ttl_hours': 1}
+
+
+def test_ttl_grows_exponentially_up_to_the_cap():
+    cache = NegativeCache(OPTIONS)
+    assert cache.record_failure('1.2.3.4:80') == 60
+    assert cache.record_failure('1.2.3.4:80') == 120
+    assert cache.record_failure('1.2.3.4:80') == 240
+    for _ in range(10):
+        ttl = cache.record_failure('1.2.3.4:80')
+    assert ttl == 3600
+
+
+def test_any_protocol_blocks_every_protocol_but_not_vice_versa():
+    cache = NegativeCache(OPTIONS)
+    cache.record_failure('a:1')
+    cache.record_failure('b:1', 'socks5')
+    assert cache.blocked('a:1', 'HTTP') and cache.blocked('a:1')
+    assert cache.blocked('b:1', 'SOCKS5')
+    assert not cache.blocked('b:1', 'HTTP') and not cache.blocked('b:1', ANY_PROTOCOL)
+
+
+def test_forget_clears_all_entries_of_an_address():
+    cache = NegativeCache(OPTIONS)
+    cache.record_failure('a:1')
+    cache.record_failure('a:1', 'HTTP')
+    cache.record_failure('b:1')
+    cache.forget('a:1')
+    assert not cache.blocked('a:1', 'HTTP')
+    assert cache.blocked('b:1') and len(cache) == 1
+
+
+def test_expired_entries_keep_their_failure_count():
+    cache = NegativeCache(OPTIONS)
+    cache.record_failure('a:1')
+    cache._entries['a:1|*'][1] = time.time() - 1
+    assert not cache.blocked('a:1')
+    assert cache.record_failure('a:1') == 120
+
+
+def test_disabled_cache_records_and_blocks_nothing():
+    cache = NegativeCache(dict(OPTIONS, enabled=False))
+    assert cache.record_failure('a:1') == 0
+    assert not cache.blocked('a:1') and len(cache) == 0
+
+
+def test_evicts_least_recently_failed_entries():
+    cache = NegativeCache(dict(OPTIONS, max_entries=2))
+    cache.record_failure('a:1')
+    cache.record_failure('b:1')
+    cache.record_failure('a:1')  # 再次失败的条目移到末尾
+    cache.record_failure('c:1')
+    assert not cache.blocked('b:1')
+    assert cache.blocked('a:1') and cache.blocked('c:1')
+    cache.configure({'max_entries': 1})
+    assert len(cache) == 1 and cache.blocked('c:1')
+
+
+def test_snapshot_round_trip_drops_forgotten_entries(tmp_path):
+    path = str(tmp_path / 'negcache.json')
+    cache = NegativeCache(dict(OPTIONS, path=path))
+    cache.record_failure('a:1')
+    cache.record_failure('b:1', 'HTTP')
+    cache._entries['old:1|*'] = [3, time.time() - 2 * 3600]  # 过期超过 max_ttl_hours
+    cache.save()
+    with open(path, encoding='utf-8') as f:
+        assert set(json.load(f)) == {'a:1|*', 'b:1|HTTP'}
+
+    restored = NegativeCache(dict(OPTIONS, path=path))
+    assert restored.blocked('a:1') and restored.blocked('b:1', 'HTTP')
+    assert restored.record_failure('a:1') == 120
+
+
+def test_corrupt_snapshot_is_ignored(tmp_path):
+    path = tmp_path / 'negcache.json'
+    path.write_text('{not json', encoding='utf-8')
+    cache = NegativeCache(dict(OPTIONS, path=str(path)))
+    assert len(cache) == 0
+    cache.save()  # 没有改动时不写入
+    assert path.read_text(encoding='utf-8') == '{not json'
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+from queue import Queue
+
+import pytest
+
+import core.pipeline
+from core.async_checker import AsyncProxyChecker
+from core.pipeline import RefreshPipeline
+from proxy_manager import ProxyManager
+
+SLOW = '10.0.0.9:1'
+
+
+def _record(address, status='Working'):
+    return {'proxy': address, 'protocol': 'SOCKS5', 'status': status, 'latency': 0.1, 'speed': 1.0, 'score': 50,
+            'location': '本地', 'anonymity': 'Elite'}
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    """源与检查都被替换为本地桩：预检全部通过，SLOW 的完整验证一直阻塞到被中断。"""
+    monkeypatch.setattr(core.pipeline, 'pre_check', lambda proxies, *args, **kwargs: list(proxies))
+    manager = ProxyManager()
+    manager.set_validation_options({'engine': 'threaded', 'max_workers': 2, 'detect_protocol': False,
+                                    'adaptive': {'enabled': False}, 'deadline_grace_seconds': 0.3})
+    manager.add_proxy(_record('10.0.0.1:1'))
+
+    def iter_fetched_proxies(log_queue, cancel_event=None):
+        yield 'socks5', ['10.0.0.2:1', SLOW], 'fast_source'
+
+    def full_check(proxy_info, validation_mode='online', cancel_event=None, log_queue=None, probe='separate'):
+        if proxy_info['proxy'] == SLOW:
+            cancel_event.wait(10)
+        return _record(proxy_info['proxy'])
+
+    manager.iter_fetched_proxies = iter_fetched_proxies
+    manager._full_check_proxy = full_check
+    return manager
+
+
+def test_deadline_keeps_old_proxies_and_skips_source_stats(manager):
+    started = time.monotonic()
+    pipeline = RefreshPipeline(manager, Queue(), manager.validation_options, deadline=0.5)
+    assert pipeline.run() == 1
+    assert time.monotonic() - started < 3  # 到期后最多再等 deadline_grace_seconds
+    assert pipeline.expired
+    assert {p['proxy'] for p in manager.all_proxies} == {'10.0.0.1:1', '10.0.0.2:1'}
+    assert manager.source_stats.report() == []
+    assert manager.negative_cache.blocked(SLOW) is False  # 被中断的检查不记为失效
+
+
+def test_completed_refresh_removes_stale_proxies_and_records_sources(manager):
+    manager._full_check_proxy = lambda proxy_info, *args, **kwargs: _record(proxy_info['proxy'])
+    pipeline = RefreshPipeline(manager, Queue(), manager.validation_options, deadline=5)
+    assert pipeline.run() == 2
+    assert not pipeline.expired
+    assert {p['proxy'] for p in manager.all_proxies} == {'10.0.0.2:1', SLOW}
+    [row] = manager.source_stats.report()
+    assert (row['source'], row['fetched'], row['working']) == ('fast_source', 2, 2)
+
+
+def test_results_stream_into_the_pool_while_slower_sources_are_fetched(manager):
+    published = threading.Event()
+
+    def iter_fetched_proxies(log_queue, cancel_event=None):
+        yield 'socks5', ['10.0.0.2:1'], 'fast_source'
+        # 后一个源返回之前，前一个源的代理就应已验证并写入轮换器
+        published.wait(3)
+        yield 'socks5', ['10.0.0.3:1'], 'slow_source'
+
+    def add_proxy(result):
+        ProxyManager.add_proxy(manager, result)
+        if result['proxy'] == '10.0.0.2:1':
+            published.set()
+
+    manager.iter_fetched_proxies = iter_fetched_proxies
+    manager._full_check_proxy = lambda proxy_info, *args, **kwargs: _record(proxy_info['proxy'])
+    manager.add_proxy = add_proxy
+    RefreshPipeline(manager, Queue(), manager.validation_options).run()
+    assert published.is_set()
+    assert {p['proxy'] for p in manager.all_proxies} == {'10.0.0.2:1', '10.0.0.3:1'}
+
+
+def test_candidates_are_validated_by_expected_value(manager, monkeypatch):
+    manager.set_validation_options({'max_workers': 1})
+    manager.source_stats.record_run('good_source', 10, 10, 10, 10)
+    manager.source_stats.record_run('bad_source', 100, 100, 0, 0)
+    order = []
+
+    def iter_fetched_proxies(log_queue, cancel_event=None):
+        yield 'socks5', ['10.0.1.1:1'], 'bad_source'
+        yield 'socks5', ['10.0.2.1:1'], 'good_source'
+        yield 'socks5', ['10.0.0.1:1'], 'bad_source'  # 池中已有、评分较高的代理
+
+    def full_check(proxy_info, *args, **kwargs):
+        order.append(proxy_info['proxy'])
+        return _record(proxy_info['proxy'])
+
+    precheck_stage = RefreshPipeline._precheck_stage
+
+    def delayed_precheck_stage(pipeline):
+        time.sleep(0.3)  # 等全部候选进入队列，再按优先级取出
+        precheck_stage(pipeline)
+
+    monkeypatch.setattr(RefreshPipeline, '_precheck_stage', delayed_precheck_stage)
+    manager.iter_fetched_proxies = iter_fetched_proxies
+    manager._full_check_proxy = full_check
+    RefreshPipeline(manager, Queue(), manager.validation_options).run()
+    # 池中已有的高分代理最先，其次是高产源的候选，低产源的候选虽然先抓到也排在最后
+    assert order == ['10.0.0.1:1', '10.0.2.1:1', '10.0.1.1:1']
+
+
+def test_results_update_the_pool_and_the_negative_cache(manager):
+    def full_check(proxy_info, *args, **kwargs):
+        if proxy_info['proxy'] == SLOW:
+            return dict(_record(SLOW), status='Failed')
+        return dict(_record(proxy_info['proxy']), score=77)
+
+    manager.add_proxy(_record('10.0.0.2:1'))
+    manager.negative_cache.record_failure('10.0.0.2:1', 'HTTP')  # 其他协议的旧失败不阻止 SOCKS5 验证
+    manager._full_check_proxy = full_check
+    pipeline = RefreshPipeline(manager, Queue(), manager.validation_options)
+    assert pipeline.run() == 1
+    assert manager.get_proxy_by_address('10.0.0.2:1')['score'] == 77  # 已有的记录被更新
+    assert manager.get_proxy_by_address(SLOW) is None
+    assert manager.get_proxy_by_address('10.0.0.1:1') is None  # 本轮未出现的旧代理被移除
+    assert not manager.negative_cache.blocked('10.0.0.2:1', 'HTTP')  # 验证通过后清除该地址的全部条目
+    assert manager.negative_cache.blocked(SLOW, 'SOCKS5')
+
+
+def test_asyncio_engine_publishes_off_the_event_loop(manager, monkeypatch):
+    async def full_check(checker, proxy_info, validation_mode='online', log_queue=None):
+        return _record(proxy_info['proxy'])
+
+    publishers = []
+
+    def add_proxy(result):
+        try:
+            asyncio.get_running_loop()
+            publishers.append('loop')
+        except RuntimeError:
+            publishers.append('thread')
+        ProxyManager.add_proxy(manager, result)
+
+    monkeypatch.setattr(AsyncProxyChecker, '_full_check_proxy', full_check)
+    manager.set_validation_options({'engine': 'asyncio', 'concurrency': 2})
+    manager.add_proxy = add_proxy
+    assert RefreshPipeline(manager, Queue(), manager.validation_options).run() == 2
+    assert publishers == ['thread', 'thread']
+    assert {p['proxy'] for p in manager.all_proxies} == {'10.0.0.2:1', SLOW}
@@ -0,0 +1,145 @@
+import asyncio
+import socket
+import threading
+import time
+from queue import Queue
+
+import pytest
+
+from core.async_server import AsyncProxyServer
+from core.pool import UpstreamPool
+from core.server import ProxyServer
+
+
+class _Rotator:
+    def __init__(self, proxies):
+        self.proxies = proxies
+
+    def get_top_proxies(self, n):
+        return self.proxies[:n]
+
+    def get_current_proxy(self):
+        return None
+
+
+class _Socks5Upstream:
+    """只完成 SOCKS5 方法协商的上游，记录收到的协商请求并保持连接。"""
+    def __init__(self):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.address = f"127.0.0.1:{self.server.getsockname()[1]}"
+        self.conns, self.greetings = [], []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.conns.append(conn)
+            self.greetings.append(conn.recv(3))
+            conn.sendall(b"\x05\x00")
+
+    def close_all(self):
+        for conn in self.conns:
+            conn.close()
+
+    def close(self):
+        self.server.close()
+        self.close_all()
+
+
+@pytest.fixture
+def upstream():
+    server = _Socks5Upstream()
+    yield server
+    server.close()
+
+
+def _wait_for(predicate, timeout=3):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def _pool(upstream, **options):
+    rotator = _Rotator([{'proxy': upstream.address, 'protocol': 'SOCKS5'}])
+    pool = UpstreamPool(rotator, Queue(), dict({'size_per_proxy': 2, 'refill_interval': 0.05}, **options))
+    pool.start()
+    return pool, rotator
+
+
+def test_prewarms_and_pre_greets_socks5_upstreams(upstream):
+    pool, _ = _pool(upstream)
+    try:
+        _wait_for(lambda: pool.idle_count(upstream.address) == 2)
+        assert upstream.greetings == [b"\x05\x01\x00"] * 2
+        sock, greeted = pool.acquire(upstream.address)
+        assert greeted and sock.gettimeout() is None
+        sock.close()
+        assert pool.acquire('10.0.0.1:1') is None
+    finally:
+        pool.stop()
+
+
+def test_connections_closed_by_the_upstream_are_discarded(upstream):
+    pool, rotator = _pool(upstream)
+    try:
+        _wait_for(lambda: pool.idle_count() == 2)
+        rotator.proxies = []  # 停止补充，只检查已有的连接
+        upstream.close_all()
+        time.sleep(0.1)
+        assert pool.acquire(upstream.address) is None
+    finally:
+        pool.stop()
+
+
+def test_expired_and_untargeted_connections_are_evicted(upstream):
+    pool, rotator = _pool(upstream, idle_seconds=0.2)
+    try:
+        _wait_for(lambda: pool.idle_count() == 2)
+        first = len(upstream.conns)
+        time.sleep(0.3)
+        _wait_for(lambda: len(upstream.conns) > first)  # 过期的连接被关闭并重建
+        rotator.proxies = []
+        _wait_for(lambda: pool.idle_count() == 0)
+    finally:
+        pool.stop()
+
+
+class _StalledPool:
+    """预热连接发往一个接受连接但从不回应的上游，协商必然超时。"""
+    options = {'connect_timeout': 5}
+
+    def __init__(self, address):
+        self.address = address
+
+    def acquire(self, proxy_address):
+        return socket.create_connection(self.address), True
+
+
+@pytest.fixture
+def blackhole():
+    with socket.create_server(('127.0.0.1', 0)) as server:
+        yield server.getsockname()
+
+
+def test_fallback_dial_shares_the_timeout(blackhole):
+    server = ProxyServer('127.0.0.1', 0, '127.0.0.1', 0, None, Queue())
+    server._pool = _StalledPool(blackhole)
+    proxy = {'proxy': f"{blackhole[0]}:{blackhole[1]}", 'protocol': 'SOCKS5'}
+    started = time.monotonic()
+    with pytest.raises(OSError):
+        server._connect_upstream(proxy, 'example.com', 80, 0.5)
+    assert time.monotonic() - started < 0.8  # 重新拨号不会再得到完整的 timeout
+
+
+def test_async_fallback_dial_shares_the_timeout(blackhole):
+    server = AsyncProxyServer('127.0.0.1', 0, '127.0.0.1', 0, None, Queue())
+    server._pool = _StalledPool(blackhole)
+    proxy = {'proxy': f"{blackhole[0]}:{blackhole[1]}", 'protocol': 'SOCKS5'}
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(server._connect_upstream(proxy, 'example.com', 80, 0.5))
+    assert time.monotonic() - started < 0.8
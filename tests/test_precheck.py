@@ -0,0 +1,61 @@
+import errno
+import socket
+
+import pytest
+
+from core import precheck
+from core.concurrency import LocalExhaustionError
+from core.precheck import iter_reachable, pre_check
+
+_socket = socket.socket
+
+
+@pytest.fixture
+def listener():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(16)
+    with server:
+        yield f"127.0.0.1:{server.getsockname()[1]}"
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"127.0.0.1:{port}"
+
+
+def test_pre_check_keeps_reachable_entries(listener, closed_port):
+    rtts = {}
+    infos = [{'proxy': listener, 'protocol': 'http'}, {'proxy': listener, 'protocol': 'socks5'},
+             {'proxy': closed_port, 'protocol': 'http'}, {'proxy': 'not-an-address', 'protocol': 'http'}]
+    assert pre_check(infos, timeout=1, rtts=rtts) == infos[:2]
+    assert list(rtts) == [listener]
+
+
+class _ExhaustedSocket:
+    """前 failures 次创建 socket 时报告描述符耗尽。"""
+    def __init__(self, failures):
+        self.failures = failures
+
+    def __call__(self, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise OSError(errno.EMFILE, 'Too many open files')
+        return _socket(*args, **kwargs)
+
+
+def test_exhaustion_with_nothing_in_flight_is_retried(monkeypatch, listener):
+    monkeypatch.setattr(precheck, '_EXHAUSTION_BACKOFF', 0.001)
+    monkeypatch.setattr(precheck.socket, 'socket', _ExhaustedSocket(3))
+    assert list(iter_reachable([listener], timeout=1)) == [listener]
+
+
+def test_persistent_exhaustion_raises_instead_of_reporting_unreachable(monkeypatch, listener):
+    monkeypatch.setattr(precheck, '_EXHAUSTION_BACKOFF', 0.001)
+    monkeypatch.setattr(precheck.socket, 'socket', _ExhaustedSocket(100))
+    with pytest.raises(LocalExhaustionError):
+        list(iter_reachable([listener], timeout=1))
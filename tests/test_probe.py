@@ -0,0 +1,105 @@
+import asyncio
+import json
+import socket
+import threading
+from queue import Queue
+from types import SimpleNamespace
+
+import pytest
+
+from core.judge import JudgeServer
+from core.probe import (async_single_connection_check, async_single_connection_probe, single_connection_check,
+                        single_connection_probe)
+from core.throughput import ThroughputProbe
+
+ECHO = json.dumps({'headers': {}, 'origin': '127.0.0.1'}).encode()
+
+
+@pytest.fixture(scope='module')
+def judge():
+    server = JudgeServer('127.0.0.1', 0, Queue())
+    server.start()
+    yield f"127.0.0.1:{server.port}"
+    server.stop()
+
+
+@pytest.fixture
+def failing_speed_server():
+    """第一个请求回显 JSON (keep-alive)，之后的请求都返回 503。"""
+    server = socket.create_server(('127.0.0.1', 0))
+
+    def serve():
+        conn, _ = server.accept()
+        with conn:
+            buffer, answered = b"", 0
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                buffer += data
+                while b"\r\n\r\n" in buffer:
+                    _, buffer = buffer.split(b"\r\n\r\n", 1)
+                    if answered == 0:
+                        conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(ECHO) + ECHO)
+                    else:
+                        conn.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n")
+                    answered += 1
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield f"127.0.0.1:{server.getsockname()[1]}"
+    server.close()
+
+
+def _check_probe(probe):
+    timings = probe['timings']
+    assert set(timings) == {'connect', 'handshake', 'ttfb', 'transfer'}
+    assert probe['latency'] == pytest.approx(timings['connect'] + timings['handshake'] + timings['ttfb'], abs=1e-3)
+    assert probe['anonymity'] == 'Elite'
+    assert probe['speed'] > 0 and 'speed_error' not in probe
+
+
+def test_single_connection_probe_through_a_forwarding_proxy(judge):
+    # 评判服务接受绝对 URI，可以直接充当按普通代理转发的 HTTP 上游
+    throughput = ThroughputProbe({'max_bytes': 65536})
+    _check_probe(single_connection_probe(judge, 'HTTP', f"http://{judge}/get?show_env=1", 2,
+                                         public_ip='203.0.113.9', throughput=throughput))
+    _check_probe(asyncio.run(async_single_connection_probe(judge, 'HTTP', f"http://{judge}/get?show_env=1", 2,
+                                                           public_ip='203.0.113.9', throughput=throughput)))
+
+
+def test_transparent_proxy_is_detected(judge):
+    probe = single_connection_probe(judge, 'HTTP', f"http://{judge}/get", 2, public_ip='127.0.0.1',
+                                    measure_speed=False)
+    assert probe['anonymity'] == 'Transparent' and probe['speed'] == 0
+
+
+def _checker(address):
+    return SimpleNamespace(timeout=2, public_ip=None, throughput=ThroughputProbe(),
+                           next_validation_targets=lambda: {'anonymity_check': f"http://{address}/get"},
+                           _get_proxy_location=lambda ip: '本地')
+
+
+def test_speed_errors_are_reported_not_swallowed(failing_speed_server):
+    log_queue = Queue()
+    result = single_connection_check(_checker(failing_speed_server), {'proxy': failing_speed_server,
+                                                                      'protocol': 'HTTP'}, log_queue)
+    assert result['status'] == 'Working' and result['speed'] == 0 and 'speed_error' not in result
+    assert any('测速失败' in line and 'HTTP 503' in line for line in list(log_queue.queue))
+
+
+def test_async_speed_errors_are_reported_not_swallowed(failing_speed_server):
+    log_queue = Queue()
+    result = asyncio.run(async_single_connection_check(_checker(failing_speed_server),
+                                                       {'proxy': failing_speed_server, 'protocol': 'HTTP'}, log_queue))
+    assert result['status'] == 'Working' and 'speed_error' not in result
+    assert any('HTTP 503' in line for line in list(log_queue.queue))
+
+
+def test_unreachable_proxy_fails_the_check():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        address = f"127.0.0.1:{sock.getsockname()[1]}"
+    log_queue = Queue()
+    result = single_connection_check(_checker(address), {'proxy': address, 'protocol': 'HTTP'}, log_queue)
+    assert result['status'] == 'Failed'
+    assert any('验证失败' in line for line in list(log_queue.queue))
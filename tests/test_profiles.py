@@ -0,0 +1,60 @@
+import asyncio
+import errno
+import threading
+
+import pytest
+
+from core.concurrency import LocalExhaustionError
+from core.profiles import async_run_profiles, load_profiles, run_profiles, score_profile
+
+
+def test_load_profiles_fills_defaults_and_validates():
+    profiles = load_profiles({'shop': {'targets': ['https://shop.example/'], 'method': 'get',
+                                       'weights': {'speed': 5}}})
+    shop = profiles['shop']
+    assert shop['method'] == 'GET' and shop['timeout'] == 5
+    assert shop['weights']['speed'] == 5 and shop['weights']['success'] == 100
+    assert load_profiles(None) == {}
+    with pytest.raises(ValueError):
+        load_profiles({'bad': {'targets': ['https://x/'], 'method': 'POST'}})
+    with pytest.raises(ValueError):
+        load_profiles({'empty': {}})
+
+
+def test_score_combines_success_latency_speed_and_anonymity():
+    profile = load_profiles({'p': {'targets': ['a', 'b'], 'weights': {'speed': 10, 'anonymity': 20}}})['p']
+    scored = score_profile(profile, [0.5, None, 1.5, 1.0], {'speed': 2, 'anonymity': 'Anonymous'})
+    assert scored == {'latency': 1.0, 'success': 0.75, 'score': 75 + 12 + 20 - 10}
+    assert score_profile(profile, [60.0], {'speed': 100})['score'] == 100  # 延迟与速度各有上限
+    assert score_profile(profile, [None, None], {}) == {'latency': float('inf'), 'success': 0.0, 'score': 0}
+
+
+def test_run_profiles_marks_failed_targets_and_stops_on_cancel():
+    profiles = load_profiles({'p': {'targets': ['ok', 'fail']}})
+    calls = []
+
+    def request(url, method, timeout):
+        calls.append((url, method, timeout))
+        if url == 'fail':
+            raise ConnectionError()
+
+    assert run_profiles(profiles, request, {})['p']['success'] == 0.5
+    assert calls == [('ok', 'HEAD', 5), ('fail', 'HEAD', 5)]
+    cancelled = threading.Event()
+    cancelled.set()
+    assert run_profiles(profiles, request, {}, cancelled) is None
+
+
+def test_local_exhaustion_is_not_counted_as_a_failed_target():
+    profiles = load_profiles({'p': {'targets': ['x']}})
+
+    def request(url, method, timeout):
+        raise OSError(errno.EMFILE, 'Too many open files')
+
+    async def async_request(url, method, timeout):
+        request(url, method, timeout)
+
+    with pytest.raises(LocalExhaustionError):
+        run_profiles(profiles, request, {})
+    with pytest.raises(LocalExhaustionError):
+        asyncio.run(async_run_profiles(profiles, async_request, {}))
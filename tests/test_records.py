@@ -0,0 +1,51 @@
+import json
+
+from core.records import ProxyRecordStore
+from core.rotator import ProxyRotator
+
+
+def test_store_round_trips_fields_without_float32_noise():
+    store = ProxyRecordStore()
+    slot = store.add({'proxy': '1.2.3.4:8080', 'protocol': 'SOCKS5', 'latency': 0.2, 'speed': 12.34,
+                      'score': 87.5, 'consecutive_failures': 70000, 'location': '日本', 'note': 'x'})
+    assert store.record(slot) == {'proxy': '1.2.3.4:8080', 'protocol': 'SOCKS5', 'location': '日本',
+                                  'latency': 0.2, 'speed': 12.34, 'score': 87.5,
+                                  'consecutive_failures': 0xFFFF, 'note': 'x'}
+    assert store.get(slot, 'anonymity', 'Unknown') == 'Unknown'
+
+
+def test_store_keeps_hostnames_and_reuses_slots():
+    store = ProxyRecordStore()
+    first = store.add({'proxy': 'proxy.example.com:3128'})
+    gen = store.generation(first)
+    assert store.slot_of('proxy.example.com:3128') == first
+    store.remove(first)
+    assert not store.is_current(first, gen)
+    second = store.add({'proxy': '[::1]:1080', 'status': 'Working'})
+    assert second == first and store.address(second) == '[::1]:1080'
+    assert store.is_current(second, store.generation(second))
+
+
+def test_select_filters_columns():
+    store = ProxyRecordStore()
+    store.add({'proxy': '1.1.1.1:1', 'status': 'Working', 'location': '美国', 'latency': 0.1})
+    store.add({'proxy': '1.1.1.2:1', 'status': 'Working', 'location': '日本', 'latency': 0.1})
+    store.add({'proxy': '1.1.1.3:1', 'status': 'Failed', 'location': '美国', 'latency': 0.1})
+    store.add({'proxy': '1.1.1.4:1', 'status': 'Working', 'location': '美国'})
+    slots = store.select(status='Working', location='美国', max_latency_ms=200)
+    assert [store.address(slot) for slot in slots] == ['1.1.1.1:1']
+    assert store.select(location='火星') == []
+
+
+def test_rotator_getters_return_plain_dicts():
+    rotator = ProxyRotator()
+    rotator.add_proxy({'proxy': '1.1.1.1:1', 'protocol': 'HTTP', 'latency': 0.2, 'score': 60.1})
+    record = rotator.get_next_proxy()
+    assert type(record) is dict
+    assert json.loads(json.dumps(rotator.all_proxies)) == [record]
+    assert record['latency'] == 0.2 and record['score'] == 60.1
+
+    record['status'] = 'Failed'  # 修改副本不影响池中的记录
+    assert rotator.get_proxy_by_address('1.1.1.1:1')['status'] == 'Working'
+    rotator.update_proxy('1.1.1.1:1', {'status': 'Failed'})
+    assert rotator.get_current_proxy() is None
@@ -0,0 +1,131 @@
+import errno
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from core import relay
+from core.relay import SocketRelay, splice_supported
+
+MODES = ['buffer'] + (['splice'] if splice_supported() else [])
+
+
+def _tcp_pair():
+    with socket.create_server(('127.0.0.1', 0)) as server:
+        client = socket.create_connection(server.getsockname())
+        peer, _ = server.accept()
+    return client, peer
+
+
+class _RecordingSocket:
+    """记录每次 recv_into 的缓冲区大小，其余操作交给真实的 socket。"""
+    def __init__(self, sock):
+        self.sock = sock
+        self.sizes = []
+
+    def recv_into(self, buffer):
+        self.sizes.append(len(buffer))
+        return self.sock.recv_into(buffer)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+@pytest.fixture
+def tunnel():
+    """返回 (启动转发的函数, 客户端一侧, 上游一侧)；转发在后台线程中运行于两条 TCP 连接的服务端之间。"""
+    client, client_peer = _tcp_pair()
+    upstream, upstream_peer = _tcp_pair()
+    threads = []
+
+    def start(relay_obj, wrap=lambda sock: sock):
+        thread = threading.Thread(target=relay_obj.forward, args=(wrap(client_peer), upstream_peer), daemon=True)
+        thread.start()
+        threads.append(thread)
+        return thread
+
+    yield start, client, upstream
+    for sock in (client, client_peer, upstream, upstream_peer):
+        sock.close()
+    for thread in threads:
+        thread.join(3)
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        assert chunk
+        data += chunk
+    return bytes(data)
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_forwards_both_directions_until_eof(tunnel, mode):
+    start, client, upstream = tunnel
+    thread = start(SocketRelay({'mode': mode}))
+    payload = os.urandom(1024 * 1024)
+    writer = threading.Thread(target=client.sendall, args=(payload,))
+    writer.start()
+    assert _recv_exactly(upstream, len(payload)) == payload
+    writer.join()
+    upstream.sendall(b"reply")
+    assert _recv_exactly(client, 5) == b"reply"
+    client.close()
+    thread.join(3)
+    assert not thread.is_alive()
+
+
+def test_buffer_grows_up_to_the_maximum(tunnel):
+    start, client, upstream = tunnel
+    recorder = []
+
+    def wrap(sock):
+        recorder.append(_RecordingSocket(sock))
+        return recorder[0]
+
+    thread = start(SocketRelay({'mode': 'buffer', 'min_buffer_size': 1024, 'max_buffer_size': 4096}), wrap)
+    for _ in range(20):
+        client.sendall(bytes(8192))
+        _recv_exactly(upstream, 8192)
+    client.close()
+    thread.join(3)
+    sizes = recorder[0].sizes
+    assert sizes[0] == 1024 and max(sizes) == 4096
+    assert sizes == sorted(sizes)
+
+
+@pytest.mark.skipif(not splice_supported(), reason="需要 os.splice")
+def test_splice_falls_back_to_buffer_when_the_fd_rejects_it(tunnel, monkeypatch):
+    calls = []
+
+    def rejecting_splice(*args, **kwargs):
+        calls.append(args)
+        raise OSError(errno.EINVAL, 'Invalid argument')
+
+    monkeypatch.setattr(relay.os, 'splice', rejecting_splice)
+    start, client, upstream = tunnel
+    thread = start(SocketRelay({'mode': 'splice'}))
+    client.sendall(b"hello")
+    assert _recv_exactly(upstream, 5) == b"hello"
+    assert len(calls) == 1  # 只在首次调用时回退，之后走缓冲区
+    client.close()
+    thread.join(3)
+    assert not thread.is_alive()
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_idle_timeout_closes_the_tunnel(tunnel, mode):
+    start, client, upstream = tunnel
+    started = time.monotonic()
+    thread = start(SocketRelay({'mode': mode, 'idle_timeout': 1}))
+    thread.join(5)
+    assert not thread.is_alive()
+    assert 1 <= time.monotonic() - started < 3
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        SocketRelay({'mode': 'zero-copy'})
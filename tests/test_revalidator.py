@@ -0,0 +1,83 @@
+import queue
+import time
+
+from core.revalidator import DEFAULT_REVALIDATION_OPTIONS, Revalidator
+from core.rotator import ProxyRotator
+
+
+class _Pool(ProxyRotator):
+    def __init__(self):
+        super().__init__()
+        self.scans = 0
+
+    def get_all_proxies_for_revalidation(self):
+        self.scans += 1
+        return super().get_all_proxies_for_revalidation()
+
+
+def _revalidator(pool, **options):
+    revalidator = Revalidator(pool, queue.Queue(), dict({'interval_seconds': 100}, **options))
+    pool.add_listener(revalidator._on_change)
+    for record in pool.get_all_proxies_for_revalidation():
+        revalidator._on_change('update', record['proxy'], record)
+    return revalidator
+
+
+def test_disabled_by_default():
+    assert DEFAULT_REVALIDATION_OPTIONS['enabled'] is False
+
+
+def test_nothing_is_due_before_the_interval():
+    pool = _Pool()
+    pool.add_proxies([{'proxy': 'a:1', 'protocol': 'HTTP', 'score': 100}])
+    revalidator = _revalidator(pool)
+    now = time.monotonic()
+    assert revalidator._pick(5, now + 99) == []
+    assert revalidator._pick(5, now + 101) == ['a:1']
+
+
+def test_failure_reports_make_proxies_due_immediately_and_first():
+    pool = _Pool()
+    pool.add_proxies([{'proxy': f'{name}:1', 'protocol': 'HTTP', 'score': 100} for name in 'abc'])
+    revalidator = _revalidator(pool)
+    scans = pool.scans
+    pool.report_failure('c:1')
+    pool.report_failure('b:1')
+    pool.report_failure('b:1')
+    assert revalidator._pick(5, time.monotonic()) == ['b:1', 'c:1']
+    assert pool.scans == scans  # 调度不再扫描代理池
+
+
+def test_low_scores_come_due_earlier_and_updates_reschedule():
+    pool = _Pool()
+    pool.add_proxies([{'proxy': 'good:1', 'protocol': 'HTTP', 'score': 100},
+                      {'proxy': 'poor:1', 'protocol': 'HTTP', 'score': 0}])
+    revalidator = _revalidator(pool)
+    now = time.monotonic()
+    assert revalidator._pick(5, now + 60) == ['poor:1']
+    pool.update_proxy('good:1', {'score': 0})
+    assert revalidator._pick(5, now + 60) == ['good:1']
+
+
+def test_removed_and_cleared_proxies_are_forgotten():
+    pool = _Pool()
+    pool.add_proxies([{'proxy': 'a:1', 'protocol': 'HTTP'}, {'proxy': 'b:1', 'protocol': 'HTTP'}])
+    revalidator = _revalidator(pool)
+    pool.remove_proxy('a:1')
+    assert set(revalidator._due) == {'b:1'} and 'a:1' not in revalidator._checked
+    pool.clear()
+    assert revalidator._pick(5, time.monotonic() + 1000) == []
+
+
+def test_revalidation_result_is_written_back_and_rescheduled():
+    pool = _Pool()
+    pool.add_proxies([{'proxy': 'a:1', 'protocol': 'HTTP', 'latency': 9.0, 'score': 1}])
+    pool.validation_options = {'probe': 'separate'}
+    pool._full_check_proxy = lambda proxy_info, *args: dict(proxy_info, status='Working', latency=0.1, score=90)
+    revalidator = _revalidator(pool)
+    pool.report_failure('a:1')
+    [address] = revalidator._pick(1, time.monotonic())
+    revalidator._revalidate(address)
+    record = pool.get_proxy_by_address('a:1')
+    assert (record['latency'], record['score'], record['consecutive_failures']) == (0.1, 90, 0)
+    assert revalidator._due['a:1'] > time.monotonic() + 50 and not revalidator._in_flight
@@ -0,0 +1,172 @@
+import random
+from collections import Counter
+
+import pytest
+
+from core.rotator import ProxyRotator, _fenwick_sample, _FenwickTree
+from proxy_manager import ProxyManager
+
+
+def _proxy(address, score, latency=0.1, location='美国', **extra):
+    return dict({'proxy': address, 'protocol': 'HTTP', 'score': score, 'latency': latency,
+                 'location': location}, **extra)
+
+
+def _picks(rotator, n):
+    return [rotator.get_next_proxy()['proxy'] for _ in range(n)]
+
+
+def test_fenwick_sample_follows_weights_and_skips_removed():
+    tree = _FenwickTree()
+    for slot, weight in enumerate([1.0, 3.0, 0.0, 6.0]):
+        tree.add(slot, f'p{slot}', weight)
+    tree.discard(0)
+    random.seed(1)
+    counts = Counter(_fenwick_sample(*tree.freeze()) for _ in range(9000))
+    assert set(counts) == {'p1', 'p3'}
+    assert counts['p3'] / counts['p1'] == pytest.approx(2, rel=0.15)
+
+
+def test_round_robin_walks_candidates_by_score():
+    rotator = ProxyRotator()
+    rotator.add_proxies([_proxy('a:1', 10), _proxy('b:1', 90), _proxy('c:1', 50)])
+    assert _picks(rotator, 4) == ['b:1', 'c:1', 'a:1', 'b:1']
+    assert rotator.get_active_proxies_count() == 3
+
+
+def test_weighted_mode_prefers_high_scores():
+    rotator = ProxyRotator()
+    rotator.add_proxies([_proxy('a:1', 10), _proxy('b:1', 90)])
+    rotator.set_selection_mode('weighted')
+    random.seed(2)
+    counts = Counter(_picks(rotator, 5000))
+    assert counts['b:1'] / counts['a:1'] == pytest.approx(9, rel=0.25)
+
+
+def test_latency_filter_follows_later_writes():
+    rotator = ProxyRotator()
+    rotator.add_proxies([_proxy('a:1', 90, latency=0.05), _proxy('b:1', 50, latency=0.25),
+                         _proxy('c:1', 10, latency=0.9)])
+    rotator.set_filters(quality_latency_ms=300)
+    assert set(_picks(rotator, 4)) == {'a:1', 'b:1'}
+
+    rotator.update_proxy('a:1', {'latency': 2.0})
+    rotator.update_proxy('c:1', {'latency': 0.12})
+    rotator.add_proxy(_proxy('d:1', 70, latency=0.28))
+    rotator.remove_proxy('b:1')
+    assert set(_picks(rotator, 6)) == {'c:1', 'd:1'}
+    assert rotator.get_available_regions_with_counts(300) == {'美国': 2}
+
+
+def test_region_and_latency_filter_falls_back_to_whole_pool():
+    rotator = ProxyRotator()
+    rotator.add_proxies([_proxy('a:1', 90, location='日本', latency=0.5), _proxy('b:1', 50, latency=0.1)])
+    rotator.set_filters(region='日本', quality_latency_ms=100)
+    assert set(_picks(rotator, 4)) == {'a:1', 'b:1'}
+    rotator.update_proxy('a:1', {'latency': 0.05})
+    assert set(_picks(rotator, 4)) == {'a:1'}
+
+
+def test_profile_filter_ranks_by_profile_score():
+    def profiles(score, success=1.0):
+        return {'shop': {'score': score, 'success': success, 'latency': 0.1}}
+
+    rotator = ProxyRotator()
+    rotator.add_proxies([_proxy('a:1', 90, profiles=profiles(20)), _proxy('b:1', 10, profiles=profiles(80)),
+                         _proxy('c:1', 50, profiles=profiles(60)), _proxy('d:1', 99, profiles=profiles(0, 0.0))])
+    rotator.set_filters(profile='shop', min_profile_score=30)
+    assert _picks(rotator, 3) == ['b:1', 'c:1', 'b:1']
+
+    rotator.update_proxy('a:1', {'profiles': profiles(95)})
+    assert set(_picks(rotator, 3)) == {'a:1', 'b:1', 'c:1'}
+
+    rotator.set_selection_mode('weighted')
+    random.seed(3)
+    assert set(_picks(rotator, 300)) == {'a:1', 'b:1', 'c:1'}
+
+
+def test_tripped_proxy_leaves_filtered_candidates():
+    rotator = ProxyRotator()
+    rotator.set_breaker_options({'failure_threshold': 1, 'open_seconds': 60})
+    rotator.add_proxies([_proxy('a:1', 90), _proxy('b:1', 50)])
+    rotator.set_filters(quality_latency_ms=500)
+    assert rotator.report_failure('a:1')
+    assert set(_picks(rotator, 4)) == {'b:1'}
+    assert rotator.get_proxy_by_address('a:1')['status'] == 'Unavailable'
+
+
+def test_clear_keeps_the_active_filter_usable():
+    rotator = ProxyRotator()
+    rotator.add_proxies([_proxy('a:1', 90)])
+    rotator.set_filters(quality_latency_ms=500)
+    rotator.clear()
+    assert rotator.get_next_proxy() is None
+    rotator.add_proxy(_proxy('b:1', 10))
+    assert rotator.get_next_proxy()['proxy'] == 'b:1'
+
+
+def test_status_changes_move_proxies_in_and_out_of_the_index():
+    rotator = ProxyRotator()
+    rotator.add_proxies([_proxy('a:1', 90), _proxy('b:1', 50, location='日本'),
+                         _proxy('c:1', 70, status='Unavailable')])
+    assert rotator.get_proxy_by_address('c:1')['status'] == 'Unavailable'
+    assert rotator.get_active_proxies_count() == 2
+    assert [p['proxy'] for p in rotator.get_top_proxies(5)] == ['a:1', 'b:1']
+
+    rotator.update_proxy('a:1', {'status': 'Unavailable'})
+    rotator.update_proxy('c:1', {'status': 'Working'})
+    assert [p['proxy'] for p in rotator.get_top_proxies(5)] == ['c:1', 'b:1']
+    assert rotator.get_available_regions_with_counts() == {'美国': 1, '日本': 1}
+    assert {p['proxy'] for p in rotator.find_proxies(status='Unavailable')} == {'a:1'}
+    assert not rotator.update_proxy('x:1', {'score': 1})
+    assert rotator.remove_proxy('b:1') and not rotator.remove_proxy('b:1')
+    assert rotator.get_available_regions_with_counts() == {'美国': 1}
+
+
+def test_current_proxy_is_dropped_when_it_stops_working():
+    rotator = ProxyRotator()
+    rotator.add_proxies([_proxy('a:1', 90), _proxy('b:1', 50)])
+    assert rotator.set_current_proxy_by_address('b:1')['proxy'] == 'b:1'
+    rotator.update_proxy('b:1', {'status': 'Unavailable'})
+    assert rotator.get_current_proxy() is None
+    assert rotator.set_current_proxy_by_address('b:1') is None
+
+
+def test_manager_serves_the_rotator_interface():
+    # 本地代理服务、连接池与 GUI 都把 ProxyManager 本身当作轮换器使用
+    manager = ProxyManager()
+    assert isinstance(manager, ProxyRotator)
+    manager.update_proxies([_proxy('a:1', 90), _proxy('b:1', 50)])
+    assert manager.get_current_proxy()['proxy'] == 'a:1'  # 尚未选定时自动轮换出一个
+    manager.update_proxies([_proxy('c:1', 10)])
+    assert [p['proxy'] for p in manager.all_proxies] == ['c:1']
+    assert manager.get_current_proxy()['proxy'] == 'c:1'
+
+
+def test_stale_snapshot_keys_do_not_resolve_after_clear_and_re_add():
+    rotator = ProxyRotator()
+    rotator.add_proxy(_proxy('1.1.1.1:80', 90))
+    old_key = rotator._current_snapshot().views[("All", None)].keys[0]
+    rotator.clear()
+    rotator.add_proxy(_proxy('9.9.9.9:3128', 50))
+    new_key = rotator._current_snapshot().views[("All", None)].keys[0]
+    assert new_key[1] == old_key[1]  # 复用同一槽位
+    assert rotator._live_record(old_key) is None
+    assert rotator._live_record(new_key)['proxy'] == '9.9.9.9:3128'
+
+
+def test_record_torn_by_a_concurrent_reuse_is_discarded(monkeypatch):
+    rotator = ProxyRotator()
+    rotator.add_proxy(_proxy('1.1.1.1:80', 90))
+    key = rotator._current_snapshot().views[("All", None)].keys[0]
+    store = rotator._store
+    read = store.record
+
+    def racing_record(slot):
+        # 读端核对代数之后、生成副本期间，写端移除该代理并把槽位分给新代理
+        rotator.remove_proxy('1.1.1.1:80')
+        rotator.add_proxy(_proxy('9.9.9.9:3128', 50))
+        return read(slot)
+
+    monkeypatch.setattr(store, 'record', racing_record)
+    assert rotator._live_record(key) is None
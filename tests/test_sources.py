@@ -0,0 +1,80 @@
+import json
+import time
+
+from core.sources import SourceStats, source_name
+from proxy_manager import ProxyManager
+
+OPTIONS = {'window': 3, 'disable_after_runs': 2, 'retry_hours': 1}
+
+
+def _fetch_example():
+    return []
+
+
+def test_source_name():
+    assert source_name('https://example.com/list.txt') == 'https://example.com/list.txt'
+    assert source_name(_fetch_example) == 'fetch_example'
+
+
+def test_yield_rate_is_smoothed_and_windowed():
+    stats = SourceStats(OPTIONS)
+    assert stats.yield_rate('new') == 1 / 20
+    stats.record_run('a', fetched=100, unique=80, alive=40, working=20)
+    assert stats.yield_rate('a') == 21 / 100
+    for _ in range(3):
+        stats.record_run('a', fetched=10, unique=9, alive=5, working=3)
+    assert stats.yield_rate('a') == 10 / 47  # 只保留最近 window 轮
+
+
+def test_disabled_after_dead_runs_and_retried_later():
+    stats = SourceStats(OPTIONS)
+    assert not stats.record_run('dead', 10, 10, 0, 0)
+    assert stats.record_run('dead', 0, 0, 0, 0)
+    assert not stats.enabled('dead')
+
+    stats._sources['dead']['disabled_until'] = time.time() - 1  # 停用期满
+    assert stats.enabled('dead')
+    assert stats.record_run('dead', 5, 5, 0, 0)  # 再试一轮仍无产出
+    assert not stats.record_run('dead', 5, 5, 1, 1)
+    assert stats.enabled('dead')
+
+
+def test_disabling_can_be_turned_off():
+    stats = SourceStats(dict(OPTIONS, enabled=False))
+    stats.record_run('dead', 0, 0, 0, 0)
+    assert not stats.record_run('dead', 0, 0, 0, 0)
+    assert stats.enabled('dead')
+
+
+def test_report_orders_by_yield():
+    stats = SourceStats(OPTIONS)
+    stats.record_run('low', 100, 100, 10, 1, latencies=[0.5])
+    stats.record_run('high', 50, 40, 30, 20, latencies=[0.1, 0.3, 0.2])
+    rows = stats.report()
+    assert [row['source'] for row in rows] == ['high', 'low']
+    assert rows[0]['working'] == 20 and rows[0]['median_latency_ms'] == 200.0
+    assert not rows[0]['disabled']
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'sources.json')
+    stats = SourceStats(dict(OPTIONS, path=path))
+    stats.record_run('a', 10, 8, 4, 2)
+    stats.record_run('dead', 0, 0, 0, 0)
+    stats.record_run('dead', 0, 0, 0, 0)
+    stats.save()
+    with open(path, encoding='utf-8') as f:
+        assert set(json.load(f)) == {'a', 'dead'}
+
+    restored = SourceStats(dict(OPTIONS, path=path, window=1))
+    assert restored.yield_rate('a') == stats.yield_rate('a')
+    assert not restored.enabled('dead')
+
+
+def test_stopping_the_service_persists_source_stats(tmp_path):
+    path = str(tmp_path / 'sources.json')
+    manager = ProxyManager()
+    manager.set_validation_options({'source_stats': {'path': path}})
+    manager.source_stats.record_run('a', 10, 8, 4, 2)
+    manager.stop_local_proxy_service()
+    assert SourceStats({'path': path}).yield_rate('a') == manager.source_stats.yield_rate('a')
@@ -0,0 +1,92 @@
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+from core.judge import judge_targets
+from core.throughput import BandwidthBudget, ThroughputMeter, ThroughputProbe
+
+TARGETS = {'latency_check': 'https://www.baidu.com', 'anonymity_check': 'http://httpbin.org/get?show_env=1',
+           'speed_check': 'http://cachefly.cachefly.net/100kb.test'}
+
+
+def test_meter_excludes_first_chunk_and_scores_confidence(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+    meter = ThroughputMeter(max_bytes=500000, max_seconds=10)
+    clock[0] += 3  # 首字节等待不计入
+    assert meter.feed(125000)
+    for offset in (0.5, 1.0, 1.0, 1.0):  # 每个时间片各到达一块
+        clock[0] += offset
+        meter.feed(125000)
+    assert not meter.feed(0)  # 达到字节上限
+    mbps, confidence = meter.result()
+    assert mbps == pytest.approx(500000 * 8 / 3.5 / 1000**2)
+    assert confidence == 1.0  # 数据量达到上限，各时间片速率相同
+
+    clock[0] += 3.5  # 长时间停顿后才到达最后一块：速率不平稳
+    meter.feed(500000)
+    assert 0 < meter.result()[1] < 1
+
+
+def test_single_chunk_falls_back_to_total_time(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+    meter = ThroughputMeter(max_bytes=1000, max_seconds=10)
+    clock[0] = 1.0
+    assert not meter.feed(1000)  # 达到字节上限
+    assert meter.result() == (0.008, 0.0)
+    assert ThroughputMeter(1000, 10).result() == (0, 0.0)
+
+
+def test_budget_queues_reservations_and_refunds_unused_bytes(monkeypatch):
+    monkeypatch.setattr(time, 'monotonic', lambda: 100.0)
+    budget = BandwidthBudget(mbps=8)  # 每秒 1MB
+    assert budget._reserve(1000000) == -1.0  # 空闲时积攒的额度立即可用
+    assert budget._reserve(1000000) == 0.0
+    assert budget._reserve(1000000) == 1.0
+    budget.refund(1000000)
+    assert budget._reserve(0) == 1.0
+
+
+def test_url_never_uses_the_latency_target():
+    probe = ThroughputProbe({'max_bytes': 4096})
+    assert probe.url(TARGETS) == TARGETS['speed_check']
+    assert probe.url(judge_targets('http://1.2.3.4:8899/')) == 'http://1.2.3.4:8899/bytes/4096'
+    probe.configure({'url': 'http://example.com/payload'})
+    assert probe.url(TARGETS) == 'http://example.com/payload'
+
+
+def _trickle_server():
+    """声明 1MB 报文体，先发送一个数据块，之后每 0.1 秒只发送 1 个字节。"""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+
+    def serve():
+        conn, _ = server.accept()
+        with conn:
+            conn.recv(65536)
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 1048576\r\n\r\n" + bytes(8192))
+            try:
+                for _ in range(100):
+                    conn.sendall(b"x")
+                    time.sleep(0.1)
+            except OSError:
+                pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server
+
+
+def test_measure_enforces_a_wall_clock_deadline():
+    server = _trickle_server()
+    probe = ThroughputProbe({'max_seconds': 0.5})
+    started = time.monotonic()
+    with requests.Session() as session:
+        mbps, confidence = probe.measure(session, f'http://127.0.0.1:{server.getsockname()[1]}/', None, 2)
+    server.close()
+    assert time.monotonic() - started < 1.5  # 数据一直在到达，单次读取的超时不会触发
+    assert mbps > 0 and confidence < 1